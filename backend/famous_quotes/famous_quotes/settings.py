@@ -14,6 +14,8 @@ pymysql.install_as_MySQLdb()
 
 from datetime import datetime
 import os
+import sys
+import tempfile
 import logging.config
 from django.utils.log import DEFAULT_LOGGING
 
@@ -50,7 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    'corsheaders.middleware.CorsMiddleware',
+    'corsheaders.middleware.CorsMiddleware',  # no db access, and lets the browser read a throttle response
+    'quotes.middleware.IpThrottleMiddleware',  # must come before anything that touches the db
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,12 +97,31 @@ DATABASES = {
     }
 }
 
+# shared by all the workers on the host
+SHARED_CACHE = {
+    'BACKEND': 'quotes.cache_backends.FileCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'fq_cache'),
+    'OPTIONS': {'MAX_ENTRIES': 5000},
+}
 CACHES = {
+    # hot keys from memory in each worker, the rest from files shared by all workers - see quotes/cache_backends.py
     'default': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
-        'LOCATION': 'cache_table',
-    }
+        'BACKEND': 'quotes.cache_backends.TieredCache',
+        'OPTIONS': {
+            'SHARED': SHARED_CACHE,
+            'LOCAL_MAX_ENTRIES': 500,
+            'LOCAL_TIMEOUT': 10,
+        },
+    },
+    # the ETag version counters (quotes/versions.py) have to change in every worker at once, so no local tier
+    'versions': SHARED_CACHE,
 }
+# tests get a cache of their own, rather than clearing (and reading leftovers from) the files a dev server uses
+if 'test' in sys.argv:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fq-test'},
+        'versions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fq-test-versions'},
+    }
 
 
 # Password validation
@@ -175,3 +197,8 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated'
     ]
 }
+
+# prior for the bayesian score (see quotes/scoring.py). Fixed rather than worked out from the table on each
+# run, so scores written by different update_scores runs stay comparable - run update_scores --all after changing it
+BAYESIAN_PRIOR_MEAN = 0.8
+BAYESIAN_PRIOR_WEIGHT = 10
@@ -12,6 +12,23 @@ CORS_ALLOW_CREDENTIALS = True
 # CT custom IP monitoring and throttling
 IP_MONITOR_LIMIT_SECONDS = 1
 IP_MONITOR_LIMIT_COUNT = 100e3
+IP_MONITOR_BACKEND = {
+    'BACKEND': 'quotes.throttle_backends.LocalMemoryBackend',
+}
+# 0 = write IpThrottle rows as soon as a block is applied
+IP_THROTTLE_FLUSH_SECONDS = 0
+# 0 = save each vote as it comes in
+VOTE_BUFFER_FLUSH_SECONDS = 0
+
+# {management command: seconds between runs} run by the web workers (see quotes/jobs.py) - locally run them by hand
+PERIODIC_JOBS = {}
+# subnet (/24, /64) limit as a multiple of the per-IP limit, None = off
+IP_MONITOR_SUBNET_FACTOR = None
+# {path prefix: (seconds, count)} - longest prefix wins, unmatched paths are not monitored
+IP_MONITOR_ROUTE_LIMITS = {
+    '/api/': (IP_MONITOR_LIMIT_SECONDS, IP_MONITOR_LIMIT_COUNT),
+    '/test/': (IP_MONITOR_LIMIT_SECONDS, IP_MONITOR_LIMIT_COUNT),
+}
 
 DB_USERNAME='conor'
 DB_PASSWORD='password'
@@ -20,6 +20,30 @@ CORS_ORIGIN_ALLOW_ALL = True  # https://stackoverflow.com/questions/67327660/cor
 # CT custom IP monitoring and throttling
 IP_MONITOR_LIMIT_SECONDS = 30
 IP_MONITOR_LIMIT_COUNT = 30
+# shared between all gunicorn workers on the host
+IP_MONITOR_BACKEND = {
+    'BACKEND': 'quotes.throttle_backends.MmapBackend',
+}
+# IpThrottle rows are written in batches by a background thread every N seconds
+IP_THROTTLE_FLUSH_SECONDS = 2
+# votes are written in batches by a background thread every N seconds
+VOTE_BUFFER_FLUSH_SECONDS = 2
+
+# {management command: seconds between runs} run by the web workers (see quotes/jobs.py)
+PERIODIC_JOBS = {
+    'refresh_leaderboards': 60,
+    'update_scores': 300,
+}
+# subnet (/24, /64) limit as a multiple of the per-IP limit, None = off
+IP_MONITOR_SUBNET_FACTOR = 4
+# {path prefix: (seconds, count)} - longest prefix wins, unmatched paths are not monitored
+IP_MONITOR_ROUTE_LIMITS = {
+    '/api/': (IP_MONITOR_LIMIT_SECONDS, IP_MONITOR_LIMIT_COUNT),
+    '/api/login/': (60, 10),
+    '/api/forgot-password/': (60, 5),
+    '/api/reset-password/': (60, 5),
+    '/test/': (IP_MONITOR_LIMIT_SECONDS, IP_MONITOR_LIMIT_COUNT),
+}
 
 DB_HOST='localhost'
 
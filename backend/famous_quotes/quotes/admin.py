@@ -41,6 +41,10 @@ class IpThrottleAdmin(admin.ModelAdmin):
     list_display = ('id', 'ip_address', 'created_at', 'block_expires')
     list_filter = ('ip_address', 'created_at')
 
+class IpOffenceAdmin(admin.ModelAdmin):
+    list_display = ('id', 'ip_address', 'offences', 'last_blocked')
+    search_fields = ('ip_address',)
+
 class UserSessionAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'session_username', 'session_key')
     list_filter = ('session_key', 'user__email')
@@ -57,3 +61,4 @@ admin.site.register(Category)
 admin.site.register(UserSession, UserSessionAdmin)
 admin.site.register(IpMonitor, IpMonitorAdmin)
 admin.site.register(IpThrottle, IpThrottleAdmin)
+admin.site.register(IpOffence, IpOffenceAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class QuotesConfig(AppConfig):
     name = 'quotes'
+
+    def ready(self):
+        # connect the version counter signals
+        from quotes import signals
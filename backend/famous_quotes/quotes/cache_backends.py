@@ -0,0 +1,215 @@
+'''
+A two-tier django cache backend. Hot keys are served from a small LRU dict inside the process
+(no I/O at all), and everything else from a shared backend that all the gunicorn workers can
+see - by default django's file-based cache, so a cache hit never touches MySQL the way
+DatabaseCache does.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'quotes.cache_backends.TieredCache',
+            'OPTIONS': {
+                'SHARED': {'BACKEND': 'quotes.cache_backends.FileCache', 'LOCATION': '/tmp/fq_cache'},
+                'LOCAL_MAX_ENTRIES': 500,
+                'LOCAL_TIMEOUT': 10,
+            },
+        }
+    }
+
+A worker's local copy can outlive a change made through another worker by up to LOCAL_TIMEOUT
+seconds, so keep it short. add() always goes to the shared tier, so it works as a lock as long as
+the shared backend's add() is atomic - FileCache below is, django's FileBasedCache is not.
+'''
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import os
+import pickle
+import threading
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('fq')
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        options = dict(params.get('OPTIONS', {}))
+        shared = options.pop('SHARED', {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        self.local_max_entries = options.pop('LOCAL_MAX_ENTRIES', 500)
+        self.local_timeout = options.pop('LOCAL_TIMEOUT', 10)
+        self.stats_every = options.pop('STATS_EVERY', 10000)
+        super().__init__(dict(params, OPTIONS=options))
+
+        shared_params = {k: v for k, v in shared.items() if k not in ('BACKEND', 'LOCATION')}
+        shared_params.setdefault('TIMEOUT', params.get('TIMEOUT', 300))
+        self.shared = import_string(shared['BACKEND'])(shared.get('LOCATION', location), shared_params)
+
+        self.local = OrderedDict()  # {key: (expires, pickled value)}, least recently used first
+        self.lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    # local tier
+
+    def local_get(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.local[key]
+                return None
+            self.local.move_to_end(key)
+            return entry
+
+    def local_set(self, key, value, timeout):
+        # never keep it locally for longer than the shared tier will
+        seconds = self.local_timeout if timeout is None else min(timeout, self.local_timeout)
+        if seconds <= 0:
+            self.local_delete(key)
+            return
+        # pickled, like LocMemCache, so callers can't change the cached copy by mutating what they got
+        entry = (time.monotonic() + seconds, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            self.local[key] = entry
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_max_entries:
+                self.local.popitem(last=False)
+
+    def local_delete(self, key):
+        with self.lock:
+            self.local.pop(key, None)
+
+    def count(self, stat):
+        self.stats[stat] += 1
+        total = sum(self.stats.values())
+        if self.stats_every and total % self.stats_every == 0:
+            logger.info(f'TieredCache {self.get_stats()}')
+
+    def get_stats(self):
+        total = sum(self.stats.values())
+        stats = dict(self.stats, local_entries=len(self.local))
+        stats['hit_rate'] = round((self.stats['local_hits'] + self.stats['shared_hits']) / total, 3) if total else 0
+        return stats
+
+    # django cache api
+
+    def get_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        entry = self.local_get(key)
+        if entry is not None:
+            self.count('local_hits')
+            return pickle.loads(entry[1])
+
+        sentinel = object()
+        value = self.shared.get(key, sentinel, version=None)
+        if value is sentinel:
+            self.count('misses')
+            return default
+        self.count('shared_hits')
+        self.local_set(key, value, self.local_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = {}
+        for key in keys:
+            full_key = self.make_key(key, version=version)
+            entry = self.local_get(full_key)
+            if entry is None:
+                missing[full_key] = key
+            else:
+                self.count('local_hits')
+                found[key] = pickle.loads(entry[1])
+
+        if missing:
+            shared = self.shared.get_many(missing.keys(), version=None)
+            for full_key, key in missing.items():
+                if full_key in shared:
+                    self.count('shared_hits')
+                    self.local_set(full_key, shared[full_key], self.local_timeout)
+                    found[key] = shared[full_key]
+                else:
+                    self.count('misses')
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        timeout = self.get_timeout(timeout)
+        self.shared.set(key, value, timeout, version=None)
+        self.local_set(key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        timeout = self.get_timeout(timeout)
+        # only the shared tier knows whether another worker got there first
+        if not self.shared.add(key, value, timeout, version=None):
+            return False
+        self.local_set(key, value, timeout)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.local_delete(key)
+        return self.shared.touch(key, self.get_timeout(timeout), version=None)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.local_delete(key)
+        return self.shared.delete(key, version=None)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        return self.local_get(key) is not None or self.shared.has_key(key, version=None)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.local_delete(key)
+        return self.shared.incr(key, delta, version=None)
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+
+class FileCache(FileBasedCache):
+    '''
+    django's FileBasedCache with add() and incr() made atomic between processes. The stock add()
+    is has_key() then set(), so two workers can both get True - which lets two of them into a
+    FragmentCache rebuild at once. Here both hold an flock on a lock file in the cache directory
+    while they check and write. set() already writes a temp file and renames it into place, so
+    readers never see half a value and don't need the lock.
+    '''
+
+    lock_filename = 'fq.lock'  # not a .djcache file, so clear() and culling leave it alone
+
+    @contextmanager
+    def locked(self):
+        import fcntl  # POSIX only - import here so the module still loads elsewhere
+        self._createdir()
+        # a new descriptor every time - flock on separate descriptors also excludes threads of this process
+        fd = os.open(os.path.join(self._dir, self.lock_filename), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self.locked():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self.locked():
+            return super().incr(key, delta, version)
@@ -0,0 +1,125 @@
+'''
+Near-duplicate detection for quotes with MinHash and locality-sensitive hashing (LSH).
+
+Each quote (plus author) is cut into overlapping character shingles, and its signature is
+the minimum hash of those shingles under NUM_PERM different hash functions. The fraction of
+signature values two quotes share estimates the Jaccard similarity of their shingle sets.
+
+To avoid comparing against every quote, the signature is split into BANDS bands of ROWS values
+and each band is hashed into a bucket. Quotes sharing any bucket are candidates - with 8 bands
+of 4 that catches most pairs above ~0.6 similarity and very few below ~0.3.
+'''
+
+import hashlib
+import re
+import struct
+
+from django.db.models import Count
+
+from quotes.models import QuoteSignature, QuoteBucket
+
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# most candidates scored per lookup - the ones sharing the most buckets, so the closest are kept
+MAX_CANDIDATES = 100
+
+# fixed (not random) so that signatures stored in the db stay comparable between processes
+PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f'a{i}'.encode(), digest_size=8).digest(), 'big') % (PRIME - 1) + 1,
+     int.from_bytes(hashlib.blake2b(f'b{i}'.encode(), digest_size=8).digest(), 'big') % PRIME)
+    for i in range(NUM_PERM)
+]
+
+SIGNATURE = struct.Struct(f'<{NUM_PERM}I')
+
+
+def normalise(text):
+    # case, punctuation and spacing differences shouldn't stop two quotes matching
+    return ' '.join(re.sub(r'[^\w\s]', '', (text or '').lower()).split())
+
+
+def shingles(quote, author=''):
+    text = normalise(quote)
+    if len(text) <= SHINGLE_SIZE:
+        shingle_set = {text}
+    else:
+        shingle_set = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    # the author counts, but only as much as a few words of the quote would
+    shingle_set.update(f'@{word}' for word in normalise(author).split())
+    return shingle_set
+
+
+def get_signature(quote, author=''):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'big') for s in shingles(quote, author)]
+    return tuple(min((a * h + b) % PRIME for h in hashes) & MAX_HASH for a, b in PERMUTATIONS)
+
+
+def get_buckets(signature):
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(struct.pack(f'<I{ROWS}I', band, *rows), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))  # fits a BigIntegerField
+    return buckets
+
+
+def similarity(signature1, signature2):
+    return sum(x == y for x, y in zip(signature1, signature2)) / NUM_PERM
+
+
+def pack_signature(signature):
+    return SIGNATURE.pack(*signature)
+
+
+def unpack_signature(value):
+    return SIGNATURE.unpack(bytes(value))
+
+
+def index_quote(quote, signature=None):
+    '''Store (or replace) the signature and LSH buckets for a saved quote'''
+    if signature is None:
+        signature = get_signature(quote.quote, quote.author)
+    QuoteSignature.objects.filter(quote_id=quote.id).delete()
+    quote_signature = QuoteSignature.objects.create(quote_id=quote.id, minhash=pack_signature(signature))
+    QuoteBucket.objects.bulk_create([QuoteBucket(signature=quote_signature, bucket=bucket) for bucket in get_buckets(signature)])
+    return signature
+
+
+def find_similar(quote, author='', threshold=0.5, signature=None, exclude=None, limit=5):
+    '''
+    Return up to limit live (not redirected) quotes that look like near-duplicates, most similar
+    first, as [{'id', 'quote', 'author', 'similarity'}].
+
+    Two queries. The first ranks the quotes sharing a bucket by how many they share (which goes
+    up with similarity), grouped on the quote id alone so it stays on the (bucket, signature) index,
+    and keeps the best MAX_CANDIDATES - however big a bucket gets, the closest are scored. The
+    second loads the signatures and text of just those.
+    '''
+    if signature is None:
+        signature = get_signature(quote, author)
+    ranked = (
+        QuoteBucket.objects
+        .filter(bucket__in=get_buckets(signature), signature__quote__redirect_quote__isnull=True)
+        .exclude(signature_id=exclude)
+        .values('signature_id')
+        .annotate(shared=Count('id'))
+        .order_by('-shared', 'signature_id')
+        .values_list('signature_id', flat=True)[:MAX_CANDIDATES]
+    )
+    # a list rather than a subquery - MySQL doesn't allow LIMIT inside IN (...)
+    quote_ids = list(ranked)
+    if not quote_ids:
+        return []
+    candidates = QuoteSignature.objects.filter(quote_id__in=quote_ids).values_list('quote_id', 'minhash', 'quote__quote', 'quote__author')
+
+    matches = []
+    for quote_id, minhash, text, quote_author in candidates:
+        score = similarity(signature, unpack_signature(minhash))
+        if score >= threshold:
+            matches.append({'id': quote_id, 'quote': text, 'author': quote_author, 'similarity': round(score, 2)})
+    matches.sort(key=lambda x: -x['similarity'])
+    return matches[:limit]
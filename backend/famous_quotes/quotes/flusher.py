@@ -0,0 +1,44 @@
+import atexit
+import threading
+import time
+
+from django.db import close_old_connections
+
+
+class PeriodicFlusher:
+    '''
+    Base for the write-behind buffers (VoteBuffer, IpThrottleWriter): calls self.flush() every
+    flush_interval seconds from a daemon thread, and once more when the process exits.
+
+    The thread is started by the first start() rather than in __init__, so it is created inside
+    the gunicorn worker and not the master. start() is safe to call from any number of request
+    threads at once - only one thread (and one atexit hook) is ever created.
+    '''
+
+    thread_name = 'flusher'
+    flush_at_exit = True
+
+    def __init__(self, flush_interval=0):
+        self.flush_interval = flush_interval
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.thread_lock:
+            if self.thread is None:
+                thread = threading.Thread(target=self.run, name=self.thread_name, daemon=True)
+                thread.start()
+                if self.flush_at_exit:
+                    atexit.register(self.flush)
+                self.thread = thread
+
+    def flush(self):
+        raise NotImplementedError
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            close_old_connections()
+            self.flush()
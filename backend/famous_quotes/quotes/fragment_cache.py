@@ -0,0 +1,89 @@
+'''
+Caching for pieces of a page that are expensive to build but fine to serve a little out of date.
+
+Each fragment is stored with the time it was built. Until fresh_seconds have passed it is served
+as is. After that it is stale: the first request to notice takes a short lock and rebuilds it,
+while every other request carries on being served the stale copy (stale-while-revalidate), so an
+expiry never sends every request to the db at once. Only when a fragment is missing altogether
+does anyone wait - briefly - for whoever holds the lock, before giving up and building it too.
+If a rebuild fails, the stale copy is served and the error logged.
+'''
+
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger('fq')
+
+
+class FragmentCache:
+
+    def __init__(self, prefix, fresh_seconds=60, stale_seconds=600, lock_seconds=10, wait_seconds=2):
+        self.prefix = prefix
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.lock_seconds = lock_seconds  # in case whoever took the lock died before releasing it
+        self.wait_seconds = wait_seconds
+
+    def key(self, name):
+        return f'{self.prefix}:{name}'
+
+    def get_many(self, builders):
+        '''{name: value} for {name: function that builds the value}, fetched from the cache in one go'''
+        cached = cache.get_many([self.key(name) for name in builders])
+        now = time.time()
+
+        values = {}
+        missing = []
+        for name, build in builders.items():
+            entry = cached.get(self.key(name))
+            if entry is None:
+                missing.append(name)
+                continue
+            value, built_at = entry
+            if now - built_at > self.fresh_seconds and self.lock(name):
+                try:
+                    value = self.build(name, build)
+                except Exception as e:
+                    # the stale copy is still better than an error - the next request will try again
+                    logger.error(f'FragmentCache could not rebuild {self.key(name)}, serving the stale copy: {str(e)}')
+            values[name] = value
+
+        for name in missing:
+            values[name] = self.get_missing(name, builders[name])
+        return values
+
+    def get(self, name, build):
+        return self.get_many({name: build})[name]
+
+    def lock(self, name):
+        # cache.add only succeeds if the key isn't there, so only one process gets it
+        return cache.add(self.key(f'{name}:lock'), 1, self.lock_seconds)
+
+    def build(self, name, build):
+        try:
+            value = build()
+            cache.set(self.key(name), (value, time.time()), self.fresh_seconds + self.stale_seconds)
+        finally:
+            cache.delete(self.key(f'{name}:lock'))
+        return value
+
+    def get_missing(self, name, build):
+        if self.lock(name):
+            return self.build(name, build)
+
+        # someone else is building it - give them a moment rather than doing the same work
+        waited = 0
+        while waited < self.wait_seconds:
+            time.sleep(0.05)
+            waited += 0.05
+            entry = cache.get(self.key(name))
+            if entry is not None:
+                return entry[0]
+
+        logger.warn(f'FragmentCache gave up waiting for {self.key(name)} and is building it too')
+        return build()
+
+    def invalidate(self, *names):
+        cache.delete_many([self.key(name) for name in names])
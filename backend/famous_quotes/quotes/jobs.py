@@ -0,0 +1,49 @@
+'''
+Management commands run on a timer from inside the web workers, so the site keeps itself up to date
+without cron. settings.PERIODIC_JOBS is {command name: seconds between runs}.
+
+Every worker has the thread, but each time a job is due only the worker that claims it runs it: the
+claim is a cache.add on the shared cache, which only one of them can win until it expires. With
+several hosts (each with its own cache) every host runs the jobs, which they are all safe to do.
+'''
+
+from io import StringIO
+import logging
+
+from django.core.cache import cache
+from django.core.management import call_command
+
+from quotes.flusher import PeriodicFlusher
+
+logger = logging.getLogger('fq')
+
+
+class PeriodicJobs(PeriodicFlusher):
+
+    thread_name = 'periodic-jobs'
+    flush_at_exit = False  # nothing is waiting to be written, and exiting shouldn't wait for a rebuild
+
+    def __init__(self, jobs, check_seconds=10):
+        super().__init__(check_seconds)
+        self.jobs = dict(jobs)
+
+    def start(self):
+        if self.jobs:
+            super().start()
+
+    def claim(self, name, seconds):
+        return cache.add(f'job:{name}', 1, seconds)
+
+    def flush(self):
+        '''Run whichever jobs are due and not claimed by another worker. Returns their names'''
+        ran = []
+        for name, seconds in self.jobs.items():
+            if not self.claim(name, seconds):
+                continue
+            try:
+                call_command(name, stdout=StringIO())
+                ran.append(name)
+            except Exception as e:
+                # try again next time round rather than take the thread down
+                logger.error(f'Periodic job {name} failed: {str(e)}')
+        return ran
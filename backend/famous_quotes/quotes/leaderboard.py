@@ -0,0 +1,119 @@
+'''
+Materialised "top quotes per category" lists. Sorting a category means joining through the
+categories table and sorting every quote in it, which no index can avoid. Instead the
+refresh_leaderboards command stores the first TOP_K quote ids of each category for each sort
+order in CategoryLeaderboard, so the home screen and the first page of a category listing are
+a primary key lookup.
+
+The command runs every minute or so (settings.PERIODIC_JOBS, see jobs.py) and only rebuilds
+categories with a quote voted on or added since their last refresh, or marked dirty by some other
+change (Category.mark_leaderboards_dirty). Votes themselves write nothing here - the refresh finds
+them through Quote.last_voted_at. Until it runs, the leaderboard is served as it is, so the first
+page can lag the votes by up to a refresh interval (and the cursor pages after it, which are live,
+may repeat or skip a quote that moved in between). Only a change that makes a leaderboard wrong,
+like a quote leaving the category, stops it being served (Category.invalidate_leaderboards).
+Anything redirected since the refresh is dropped on the way out.
+'''
+
+from datetime import datetime
+import logging
+import pytz
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from quotes import fast_json
+from quotes.models import Category, CategoryLeaderboard, Quote
+from quotes.pagination import get_names, get_ordering
+from quotes.scoring import SCORERS
+
+logger = logging.getLogger('fq')
+
+TOP_K = 100
+
+# the orderings QuoteView and HomeScreenView use
+SORT_KEYS = {
+    'default': ['-total_upvotes', '-popularity'],
+    'popularity': ['-popularity'],
+    'total_upvotes': ['-total_upvotes'],
+    'net_votes': ['-net_votes'],
+    'newest': ['-created_at'],
+}
+SORT_KEYS.update({name: [f'-{scorer.field}'] for name, scorer in SCORERS.items()})
+
+KEYS_BY_ORDERING = {tuple(get_ordering(ordering)): key for key, ordering in SORT_KEYS.items()}
+
+
+def get_sort_key(ordering):
+    '''The SORT_KEYS name for a QuoteView ordering, or None if it isn't materialised'''
+    return KEYS_BY_ORDERING.get(tuple(get_ordering(ordering)))
+
+
+def refresh_category(category, updated_at=None):
+    with transaction.atomic():
+        # a change marking the category dirty (or invalidating it) while we read waits for this lock in
+        # its UPDATE - a single statement, with no unlocked read first - and lands after our commit.
+        # one that committed before we got the lock is in what we read, so the flag can be cleared
+        Category.objects.select_for_update().filter(id=category.id).first()
+
+        rows = []
+        queryset = Quote.objects.filter(categories=category, redirect_quote__isnull=True)
+        for key, ordering in SORT_KEYS.items():
+            quote_ids = queryset.order_by(*get_ordering(ordering)).values_list('id', flat=True)[:TOP_K]
+            rows.extend(CategoryLeaderboard(category=category, sort_key=key, rank=rank, quote_id=quote_id) for rank, quote_id in enumerate(quote_ids))
+
+        CategoryLeaderboard.objects.filter(category=category).delete()
+        CategoryLeaderboard.objects.bulk_create(rows)
+        Category.objects.filter(id=category.id).update(leaderboard_updated_at=updated_at or datetime.now(pytz.UTC), leaderboard_dirty=False)
+
+
+def refresh(everything=False):
+    '''Rebuild the leaderboards of every category that may have changed. Returns how many were rebuilt'''
+    # anything voted on after this gets picked up next time
+    started = datetime.now(pytz.UTC)
+
+    categories = Category.objects.all()
+    if not everything:
+        categories = categories.filter(
+            Q(leaderboard_updated_at__isnull=True)
+            | Q(leaderboard_dirty=True)
+            | Q(quote__last_voted_at__gte=F('leaderboard_updated_at'))
+            | Q(quote__created_at__gte=F('leaderboard_updated_at'))
+        ).distinct()
+
+    categories = list(categories)
+    for category in categories:
+        refresh_category(category, started)
+    return len(categories)
+
+
+def get_top(category_names, ordering, number):
+    '''
+    {category name: [quote]} with up to number + 1 quotes each, best first - the extra one
+    says whether there is another page. Each quote is a values() row as from fast_json.get_values,
+    with the ordering's columns too, for the cursor. Categories that have never been refreshed (or
+    an ordering that isn't materialised) are left out, so the caller can fall back to a query.
+    '''
+    key = get_sort_key(ordering)
+    if key is None or number >= TOP_K:
+        return {}
+
+    top = {
+        name: [] for name in
+        Category.objects.filter(category__in=category_names, leaderboard_updated_at__isnull=False).values_list('category', flat=True)
+    }
+    if not top:
+        return top
+
+    # some headroom for quotes redirected since the refresh
+    fields = fast_json.QUOTE_FIELDS + [x for x in get_names(ordering) if x not in fast_json.QUOTE_FIELDS]
+    rows = (CategoryLeaderboard.objects
+        .filter(category__category__in=top.keys(), sort_key=key, rank__lte=number * 2, quote__redirect_quote__isnull=True)
+        .order_by('rank')
+        .values_list('category__category', *[f'quote__{field}' for field in fields])
+    )
+    for name, *values in rows:
+        quotes = top[name]
+        if len(quotes) <= number:
+            quotes.append(dict(zip(fields, values)))
+    return top
@@ -0,0 +1,160 @@
+from datetime import datetime
+import logging
+import pytz
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from quotes.models import Category, Quote, Vote
+from quotes.views import HOME_CATEGORIES, VOTE_AGAIN_AFTER, home_cache
+
+logger = logging.getLogger('fq')
+
+# tables small enough that scanning them is fine
+SMALL_TABLES = ['quotes_category', 'django_content_type', 'django_site']
+
+# the GET requests the frontend makes most, as (name, url)
+URL_SCENARIOS = [
+    ('quotes default', '/api/quotes/'),
+    ('quotes next page', '/api/quotes/?c={cursor}'),
+    ('quotes newest', '/api/quotes/?s=newest'),
+    ('quotes net_votes', '/api/quotes/?s=-net_votes'),
+    ('quotes wilson', '/api/quotes/?s=wilson'),
+    ('quotes random', '/api/quotes/?s=random'),
+    ('quotes by category', '/api/quotes/?categories=Motivation'),
+    ('quotes search', '/api/quotes/?q=love'),
+    ('home screen', '/api/home/'),  # with the fragment cache emptied first - see get_url
+    ('votes for quote', '/api/votes/?quote={quote_id}&n=20'),
+    ('comments for quote', '/api/comments/?quote={quote_id}&n=20'),
+    ('quote of the day', '/api/quotes/qotd/'),
+]
+
+
+def duplicate_vote_check(quote_id):
+    # what VoteView runs before accepting a vote
+    recent = datetime.now(pytz.UTC) - VOTE_AGAIN_AFTER
+    Vote.objects.filter(created_at__gte=recent, quote_id=quote_id, session_id='audit').count()
+
+
+def explain(sql):
+    '''Return a list of problems with the plan for one SELECT - full scans, filesorts and temporary tables'''
+    problems = []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(f'EXPLAIN {sql}')
+            columns = [col[0].lower() for col in cursor.description]
+            for row in cursor.fetchall():
+                row = dict(zip(columns, row))
+                table = row.get('table') or ''
+                extra = row.get('extra') or ''
+                if row.get('type') == 'ALL' and table not in SMALL_TABLES and not table.startswith('<'):
+                    problems.append(f'full scan of {table}')
+                if 'Using filesort' in extra:
+                    problems.append(f'filesort on {table}')
+                if 'Using temporary' in extra:
+                    problems.append(f'temporary table for {table}')
+
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            for row in cursor.fetchall():
+                detail = row[-1]
+                if detail.startswith('SCAN ') and 'INDEX' not in detail and 'SUBQUERY' not in detail:
+                    table = detail.split()[1]
+                    if table not in SMALL_TABLES:
+                        problems.append(f'full scan of {table}')
+                if 'USE TEMP B-TREE' in detail:
+                    problems.append(detail.lower())
+
+        else:
+            raise CommandError(f'EXPLAIN parsing is not implemented for {connection.vendor}')
+    return problems
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the main read paths against a seeded copy of the data, EXPLAIN every SELECT they emit, '
+        'and flag full table scans, filesorts and temporary tables. Point it at the MySQL test db - '
+        'everything it writes is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quotes', type=int, default=2000, help='Synthetic quotes to add first, so the planner has a realistic table to work with')
+        parser.add_argument('--votes', type=int, default=5000)
+        parser.add_argument('--verbose-sql', action='store_true', help='Print the SQL of flagged queries')
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if anything is flagged, e.g. for CI')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            quote_id = self.seed(options['quotes'], options['votes'])
+            findings = self.audit(quote_id)
+            transaction.set_rollback(True)
+
+        flagged = 0
+        for name, queries in findings:
+            problems = [(sql, problems) for sql, problems in queries if problems]
+            status = self.style.WARNING(f'{len(problems)} flagged') if problems else self.style.SUCCESS('ok')
+            self.stdout.write(f'{name}: {len(queries)} queries, {status}')
+            for sql, query_problems in problems:
+                self.stdout.write(f'    {"; ".join(query_problems)}')
+                if options['verbose_sql']:
+                    self.stdout.write(f'        {sql}')
+            flagged += len(problems)
+
+        logger.info(f'audit_queries flagged {flagged} queries')
+        if flagged and options['fail']:
+            raise CommandError(f'{flagged} queries have full scans, filesorts or temporary tables')
+        self.stdout.write(self.style.SUCCESS(f'Done - {flagged} queries flagged'))
+
+    def seed(self, quotes, votes):
+        categories = [Category.objects.get_or_create(category=name)[0] for name in ['Motivation', 'Travel', 'Funny', 'Politics', 'Career']]
+        Quote.objects.bulk_create([
+            Quote(quote=f'Audit quote {i} about love', author=f'Author {i % 100}', total_upvotes=i % 50, total_downvotes=i % 7, popularity=(i % 50) / 50)
+            for i in range(quotes)
+        ], batch_size=500)
+        quote_ids = list(Quote.objects.order_by('-id').values_list('id', flat=True)[:max(quotes, 1)])
+        if not quote_ids:
+            raise CommandError('No quotes to audit against')
+        for i, category in enumerate(categories):
+            category.quote_set.add(*quote_ids[i::len(categories) * 4])
+        Vote.objects.bulk_create([
+            Vote(quote_id=quote_ids[i % len(quote_ids)], session_id=f'audit{i}', value=1 if i % 3 else -1)
+            for i in range(votes)
+        ], batch_size=500)
+        return quote_ids[0]
+
+    def audit(self, quote_id):
+        '''Return [(scenario name, [(sql, [problems])])]'''
+        findings = []
+        scenarios = [(name, self.get_url(url, quote_id)) for name, url in URL_SCENARIOS]
+        scenarios.append(('vote duplicate check', lambda: duplicate_vote_check(quote_id)))
+
+        with override_settings(ALLOWED_HOSTS=['testserver'], SECURE_SSL_REDIRECT=False):
+            self.client = Client()
+            for name, run in scenarios:
+                # once to warm up (the middleware and sampler load their state on first use), then for real
+                run()
+                with CaptureQueriesContext(connection) as context:
+                    run()
+                # the same statement often comes up more than once (e.g. per category)
+                statements = []
+                for query in context.captured_queries:
+                    sql = query['sql']
+                    if sql.lstrip().upper().startswith('SELECT') and sql not in statements:
+                        statements.append(sql)
+                findings.append((name, [(sql, explain(sql)) for sql in statements]))
+        return findings
+
+    def get_url(self, url, quote_id):
+        def run():
+            cursor = ''
+            if '{cursor}' in url:
+                cursor = self.client.get('/api/quotes/?n=5').json()['next']
+            if url.startswith('/api/home/'):
+                # otherwise the pools come straight from the cache and none of their queries are seen
+                home_cache.invalidate('top', 'random', *[name.lower() for name in HOME_CATEGORIES])
+            response = self.client.get(url.format(cursor=cursor, quote_id=quote_id))
+            if response.status_code != 200:
+                logger.warn(f'audit_queries got {response.status_code} from {url}')
+        return run
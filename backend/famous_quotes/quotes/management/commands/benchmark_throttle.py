@@ -0,0 +1,229 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import pytz
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+
+from quotes.models import IpThrottle
+from quotes.throttling import IpMonitorLive, IpRequest, IpThrottleWriter
+from quotes.throttle_backends import get_backend
+
+logger = logging.getLogger('fq')
+
+# smaller is better for these, bigger is better for ops_per_sec
+LOWER_IS_BETTER = ('p50_us', 'p99_us', 'peak_memory_kb')
+
+
+def generate_traffic(rng, requests, ips, heavy_hitters, heavy_share, blocked, blocked_share):
+    '''
+    Return (list of ip addresses in request order, list of pre-blocked ip addresses).
+    Most traffic is spread over many addresses, a few heavy hitters send heavy_share of
+    it between them, and blocked_share comes from addresses that are already blocked.
+    '''
+    def address(i):
+        if i % 10 == 9:
+            return f'2001:db8::{i:x}'
+        return f'10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}'
+
+    normal = [address(i) for i in range(ips)]
+    heavy = [address(ips + i) for i in range(heavy_hitters)]
+    blocked_ips = [address(ips + heavy_hitters + i) for i in range(blocked)]
+
+    traffic = []
+    for _ in range(requests):
+        r = rng.random()
+        if blocked_ips and r < blocked_share:
+            traffic.append(rng.choice(blocked_ips))
+        elif heavy and r < blocked_share + heavy_share:
+            traffic.append(rng.choice(heavy))
+        else:
+            traffic.append(rng.choice(normal))
+    return traffic, blocked_ips
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarise(latencies, elapsed, peak_memory, **extra):
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'ops_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_us': round(percentile(latencies, 50) / 1000, 2),
+        'p99_us': round(percentile(latencies, 99) / 1000, 2),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+    result.update(extra)
+    return result
+
+
+def compare(baseline, results, tolerance):
+    '''Return a list of human-readable regressions of results against baseline'''
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(scenario, {}).get(metric)
+            if not previous or metric not in ('ops_per_sec',) + LOWER_IS_BETTER:
+                continue
+            change = (value - previous) / previous
+            if metric not in LOWER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(f'{scenario}.{metric}: {previous} -> {value} ({change:+.0%} worse)')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive synthetic traffic through IpMonitorLive.add_request and the full django request path, '
+        'report ops/sec, p50/p99 latency and peak memory, and compare against a saved baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100000, help='Requests sent straight to the monitor')
+        parser.add_argument('--django-requests', type=int, default=2000, help='Requests sent through the django test client (0 to skip)')
+        parser.add_argument('--ips', type=int, default=10000, help='Distinct well-behaved addresses')
+        parser.add_argument('--heavy-hitters', type=int, default=5)
+        parser.add_argument('--heavy-share', type=float, default=0.2, help='Fraction of traffic from the heavy hitters')
+        parser.add_argument('--blocked', type=int, default=50, help='Addresses that are blocked before the run starts')
+        parser.add_argument('--blocked-share', type=float, default=0.05, help='Fraction of traffic from blocked addresses')
+        parser.add_argument('--limit-seconds', type=int, default=30)
+        parser.add_argument('--limit-count', type=int, default=30)
+        parser.add_argument('--backend', choices=['local', 'mmap'], default='local')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default='throttle_benchmark.json', help='Baseline file to save to / compare against')
+        parser.add_argument('--save', action='store_true', help='Save the results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Fractional slowdown allowed before a metric counts as a regression')
+
+    def handle(self, *args, **options):
+        self.options = options
+        rng = random.Random(options['seed'])
+        traffic, blocked_ips = generate_traffic(
+            rng,
+            options['requests'],
+            options['ips'],
+            options['heavy_hitters'],
+            options['heavy_share'],
+            options['blocked'],
+            options['blocked_share'],
+        )
+
+        results = {}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.tmpdir = tmpdir
+            results['monitor'] = self.run_scenario(self.bench_monitor, traffic, blocked_ips)
+            if options['django_requests']:
+                results['django'] = self.run_scenario(self.bench_django, traffic[:options['django_requests']], blocked_ips)
+
+        for scenario, metrics in results.items():
+            self.stdout.write(f'{scenario}: ' + ', '.join(f'{k}={v}' for k, v in metrics.items()))
+
+        if options['save']:
+            with open(options['baseline'], 'w') as f:
+                json.dump({'created': datetime.now().isoformat(), 'options': self.describe_options(), 'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {options["baseline"]}'))
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(f'No baseline at {options["baseline"]} - run with --save to create one')
+            return
+
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        if baseline.get('options') != self.describe_options():
+            self.stdout.write(self.style.WARNING('Baseline was recorded with different options, so the comparison may not be meaningful'))
+
+        regressions = compare(baseline['results'], results, options['tolerance'])
+        if regressions:
+            logger.warning(f'benchmark_throttle regressions: {regressions}')
+            raise CommandError('Throttling has regressed against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def describe_options(self):
+        keys = ('requests', 'django_requests', 'ips', 'heavy_hitters', 'heavy_share', 'blocked', 'blocked_share', 'limit_seconds', 'limit_count', 'backend', 'seed')
+        return {key: self.options[key] for key in keys}
+
+    def run_scenario(self, bench, traffic, blocked_ips):
+        # time it without tracemalloc (which slows everything down), then replay it for memory.
+        # blocks get written to IpThrottle as they would be for real, then rolled back
+        with transaction.atomic():
+            latencies, elapsed, extra = bench(traffic, blocked_ips)
+            transaction.set_rollback(True)
+
+        with transaction.atomic():
+            tracemalloc.start()
+            try:
+                bench(traffic, blocked_ips)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            transaction.set_rollback(True)
+
+        return summarise(latencies, elapsed, peak_memory, **extra)
+
+    def get_backend_config(self):
+        '''--backend as an IP_MONITOR_BACKEND setting'''
+        if self.options['backend'] == 'mmap':
+            # a fresh file every time, never the one the site is using
+            path = os.path.join(self.tmpdir, f'ipmon-{len(os.listdir(self.tmpdir))}.mmap')
+            return {'BACKEND': 'quotes.throttle_backends.MmapBackend', 'OPTIONS': {'path': path}}
+        return {'BACKEND': 'quotes.throttle_backends.LocalMemoryBackend'}
+
+    def bench_monitor(self, traffic, blocked_ips):
+        until = datetime.now(pytz.UTC) + timedelta(hours=1)
+        monitor = IpMonitorLive(
+            monitor_limit_seconds=self.options['limit_seconds'],
+            monitor_limit_count=self.options['limit_count'],
+            backend=get_backend(self.get_backend_config()),
+            blocked_ips={ip: until for ip in blocked_ips},
+            writer=IpThrottleWriter(),
+        )
+
+        latencies = []
+        rejected = 0
+        started = time.perf_counter()
+        for ip in traffic:
+            request = IpRequest(ip)
+            start = time.perf_counter_ns()
+            allowed = monitor.add_request(request)
+            latencies.append(time.perf_counter_ns() - start)
+            rejected += not allowed
+        elapsed = time.perf_counter() - started
+        return latencies, elapsed, {'rejected': rejected}
+
+    def bench_django(self, traffic, blocked_ips):
+        # the full middleware stack and url resolution, ending at the cheap TestView.
+        # the blocks go in the db so the middleware loads them like it would on startup
+        until = datetime.now(pytz.UTC) + timedelta(hours=1)
+        IpThrottle.objects.bulk_create([IpThrottle(ip_address=ip, block_expires=until) for ip in blocked_ips])
+
+        monitor_settings = override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            SECURE_SSL_REDIRECT=False,
+            IP_MONITOR_BACKEND=self.get_backend_config(),
+            IP_THROTTLE_FLUSH_SECONDS=0,
+            IP_MONITOR_ROUTE_LIMITS={'/api/': (self.options['limit_seconds'], self.options['limit_count'])},
+        )
+        with monitor_settings:
+            client = Client()
+            latencies = []
+            rejected = 0
+            started = time.perf_counter()
+            for ip in traffic:
+                start = time.perf_counter_ns()
+                response = client.get('/api/test/', REMOTE_ADDR=ip)
+                latencies.append(time.perf_counter_ns() - start)
+                rejected += response.status_code == 403
+            elapsed = time.perf_counter() - started
+        return latencies, elapsed, {'rejected': rejected}
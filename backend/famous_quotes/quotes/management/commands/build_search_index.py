@@ -0,0 +1,43 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from quotes import search
+from quotes.models import Quote, QuoteTerm
+
+logger = logging.getLogger('fq')
+
+
+class Command(BaseCommand):
+    help = 'Add quotes that are missing from the search index (or rebuild it from scratch with --rebuild)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Re-index every quote, e.g. after quotes have been edited')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            QuoteTerm.objects.all().delete()
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Quote.objects.filter(id__gt=last_id, quoteterm__isnull=True).order_by('id').values_list('id', 'quote', 'author', 'context')[:options['batch_size']]
+            )
+            if not batch:
+                break
+
+            terms = []
+            for quote_id, quote, author, context in batch:
+                terms.extend(QuoteTerm(quote_id=quote_id, term=term, weight=weight) for term, weight in search.get_terms(quote, author, context).items())
+            with transaction.atomic():
+                QuoteTerm.objects.bulk_create(terms, batch_size=options['batch_size'])
+
+            total += len(batch)
+            last_id = batch[-1][0]
+            self.stdout.write(f'Indexed {total} quotes')
+
+        logger.info(f'build_search_index indexed {total} quotes')
+        self.stdout.write(self.style.SUCCESS(f'Done - indexed {total} quotes'))
@@ -0,0 +1,96 @@
+import csv
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from quotes import dedupe
+from quotes.models import Quote, QuoteSignature, QuoteBucket
+
+logger = logging.getLogger('fq')
+
+
+class Command(BaseCommand):
+    help = (
+        'Index any quotes without a MinHash signature, then list likely duplicate pairs across the '
+        'whole corpus as KEEP:DUPLICATE, ready to pass to merge_quotes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every signature, e.g. after quotes have been edited')
+        parser.add_argument('--threshold', type=float, default=0.6, help='Minimum estimated similarity (0-1) to report')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--csv', help='Also write the pairs to this file')
+
+    def handle(self, *args, **options):
+        indexed = self.index(options['rebuild'], options['batch_size'])
+        self.stdout.write(f'Indexed {indexed} quotes')
+
+        pairs = self.find_pairs(options['threshold'])
+        for keep_id, duplicate_id, score in pairs:
+            self.stdout.write(f'{keep_id}:{duplicate_id} {score:.2f}')
+
+        if options['csv']:
+            with open(options['csv'], 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['keep_id', 'duplicate_id', 'similarity'])
+                writer.writerows((keep_id, duplicate_id, f'{score:.2f}') for keep_id, duplicate_id, score in pairs)
+
+        logger.info(f'find_duplicate_quotes indexed {indexed} quotes and found {len(pairs)} candidate pairs')
+        self.stdout.write(self.style.SUCCESS(f'Done - {len(pairs)} candidate pairs'))
+
+    def index(self, rebuild, batch_size):
+        if rebuild:
+            QuoteSignature.objects.all().delete()
+
+        total = 0
+        while True:
+            batch = list(Quote.objects.filter(quotesignature__isnull=True).order_by('id').values_list('id', 'quote', 'author')[:batch_size])
+            if not batch:
+                return total
+
+            signatures = []
+            buckets = []
+            for quote_id, quote, author in batch:
+                signature = dedupe.get_signature(quote, author)
+                signatures.append(QuoteSignature(quote_id=quote_id, minhash=dedupe.pack_signature(signature)))
+                buckets.extend(QuoteBucket(signature_id=quote_id, bucket=bucket) for bucket in dedupe.get_buckets(signature))
+            with transaction.atomic():
+                QuoteSignature.objects.bulk_create(signatures)
+                QuoteBucket.objects.bulk_create(buckets, batch_size=batch_size)
+            total += len(batch)
+
+    def find_pairs(self, threshold):
+        # the whole corpus fits comfortably in memory as signatures (128 bytes per quote),
+        # so band it here rather than asking the db for every shared bucket
+        rows = QuoteSignature.objects.filter(quote__redirect_quote__isnull=True).values_list(
+            'quote_id', 'minhash', 'quote__total_upvotes', 'quote__total_downvotes',
+        )
+        signatures = {}
+        votes = {}
+        bands = {}
+        for quote_id, minhash, upvotes, downvotes in rows.iterator():
+            signature = dedupe.unpack_signature(minhash)
+            signatures[quote_id] = signature
+            votes[quote_id] = upvotes + downvotes
+            for bucket in dedupe.get_buckets(signature):
+                bands.setdefault(bucket, []).append(quote_id)
+
+        candidates = set()
+        for quote_ids in bands.values():
+            for i, quote_id in enumerate(quote_ids):
+                for other_id in quote_ids[i + 1:]:
+                    candidates.add((min(quote_id, other_id), max(quote_id, other_id)))
+
+        pairs = []
+        for quote_id, other_id in candidates:
+            score = dedupe.similarity(signatures[quote_id], signatures[other_id])
+            if score < threshold:
+                continue
+            # keep whichever has more votes, or the older one if they're level
+            if votes[other_id] > votes[quote_id]:
+                pairs.append((other_id, quote_id, score))
+            else:
+                pairs.append((quote_id, other_id, score))
+        pairs.sort(key=lambda x: (-x[2], x[0], x[1]))
+        return pairs
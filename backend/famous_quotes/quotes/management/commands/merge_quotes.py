@@ -0,0 +1,63 @@
+import csv
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quotes.models import Quote
+
+logger = logging.getLogger('fq')
+
+
+def parse_pair(value):
+    try:
+        keep, duplicate = value.split(':')
+        return int(keep), int(duplicate)
+    except ValueError:
+        raise CommandError(f'Expected KEEP_ID:DUPLICATE_ID, got {value}')
+
+
+class Command(BaseCommand):
+    help = 'Merge duplicate quotes into the quotes being kept, e.g. merge_quotes 12:40 12:41 7:9 (or --file pairs.csv)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pairs', nargs='*', help='KEEP_ID:DUPLICATE_ID')
+        parser.add_argument('--file', help='CSV of keep_id,duplicate_id rows')
+
+    def handle(self, *args, **options):
+        pairs = [parse_pair(pair) for pair in options['pairs']]
+        if options['file']:
+            with open(options['file'], newline='') as f:
+                pairs.extend((int(row[0]), int(row[1])) for row in csv.reader(f) if row and row[0].strip().isdigit())
+        if not pairs:
+            raise CommandError('Nothing to merge')
+
+        # one query for every quote involved, to follow redirects from earlier merges
+        ids = {quote_id for pair in pairs for quote_id in pair}
+        redirects = dict(Quote.objects.filter(id__in=ids, redirect_quote__isnull=False).values_list('id', 'redirect_quote'))
+        found = set(Quote.objects.filter(id__in=ids).values_list('id', flat=True))
+
+        merged = 0
+        for keep_id, duplicate_id in pairs:
+            # if the quote being kept has itself been merged away (maybe earlier in this batch), merge into its replacement
+            seen = {keep_id}
+            while keep_id in redirects:
+                keep_id = redirects[keep_id]
+                if keep_id in seen:
+                    break
+                seen.add(keep_id)
+
+            if keep_id not in found or duplicate_id not in found:
+                self.stdout.write(self.style.WARNING(f'Skipping {keep_id}:{duplicate_id} - quote does not exist'))
+                continue
+            if keep_id == duplicate_id or redirects.get(duplicate_id) == keep_id:
+                continue
+
+            Quote(id=keep_id).merge_with(Quote(id=duplicate_id))
+            redirects[duplicate_id] = keep_id
+            for quote_id, target in redirects.items():
+                if target == duplicate_id:
+                    redirects[quote_id] = keep_id
+            merged += 1
+
+        logger.info(f'merge_quotes merged {merged} of {len(pairs)} pairs')
+        self.stdout.write(self.style.SUCCESS(f'Done - merged {merged} quotes'))
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import logging
+import pytz
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from quotes.models import IpThrottle, IpOffence
+
+logger = logging.getLogger('fq')
+
+
+class Command(BaseCommand):
+    help = 'Roll expired IpThrottle rows up into IpOffence (one row per IP) and delete them, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=0, help='Only prune blocks that expired more than this many days ago')
+        parser.add_argument('--no-rollup', action='store_true', help='Delete without keeping the offence counts')
+
+    def handle(self, *args, **options):
+        cutoff = datetime.now(pytz.UTC) - timedelta(days=options['days'])
+        expired = IpThrottle.objects.filter(Q(block_expires__lt=cutoff) | Q(block_expires__isnull=True)).order_by('id')
+
+        total = 0
+        while True:
+            batch = list(expired.values_list('id', 'ip_address', 'block_expires')[:options['batch_size']])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                if not options['no_rollup']:
+                    self.rollup(batch)
+                IpThrottle.objects.filter(id__in=[row[0] for row in batch]).delete()
+
+            total += len(batch)
+            self.stdout.write(f'Pruned {total} IpThrottle rows')
+
+        logger.info(f'prune_ip_throttles removed {total} expired blocks')
+        self.stdout.write(self.style.SUCCESS(f'Done - pruned {total} IpThrottle rows'))
+
+    def rollup(self, batch):
+        summary = {}  # {ip_address: (count, latest expiry)}
+        for _, ip_address, block_expires in batch:
+            count, latest = summary.get(ip_address, (0, None))
+            if latest is None or (block_expires is not None and block_expires > latest):
+                latest = block_expires
+            summary[ip_address] = (count + 1, latest)
+
+        existing = IpOffence.objects.select_for_update().filter(ip_address__in=summary.keys())
+        existing = {offence.ip_address: offence for offence in existing}
+
+        new_offences = []
+        for ip_address, (count, latest) in summary.items():
+            offence = existing.get(ip_address)
+            if offence is None:
+                new_offences.append(IpOffence(ip_address=ip_address, offences=count, last_blocked=latest))
+                continue
+            last_blocked = offence.last_blocked
+            if last_blocked is None or (latest is not None and latest > last_blocked):
+                last_blocked = latest
+            IpOffence.objects.filter(id=offence.id).update(offences=F('offences') + count, last_blocked=last_blocked)
+        IpOffence.objects.bulk_create(new_offences)
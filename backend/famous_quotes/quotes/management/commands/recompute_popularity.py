@@ -0,0 +1,55 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from quotes import versions
+from quotes.models import Category, Quote, Vote
+
+logger = logging.getLogger('fq')
+
+
+def vote_count(**filters):
+    votes = Vote.objects.filter(quote=OuterRef('pk'), **filters).order_by().values('quote').annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(votes, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute Quote.popularity for every quote from its vote totals, one UPDATE per id range. '
+        'With --recount the totals are rebuilt from the Vote table first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of ids covered by each UPDATE')
+        parser.add_argument('--recount', action='store_true', help='Rebuild total_upvotes/total_downvotes/net_votes from Vote')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        batch_size = options['batch_size']
+
+        # walk the table by id range - each UPDATE is short, so the rows aren't locked for long
+        ids = Quote.objects.order_by('id').values_list('id', flat=True)
+        first, last = ids.first(), ids.last()
+        if first is None:
+            self.stdout.write('No quotes to update')
+            return
+
+        total = 0
+        for start in range(first, last + 1, batch_size):
+            quotes = Quote.objects.filter(id__gte=start, id__lt=start + batch_size)
+            with transaction.atomic():
+                if options['recount']:
+                    quotes.update(total_upvotes=vote_count(value__gt=0), total_downvotes=vote_count(value__lt=0))
+                    quotes.update(net_votes=F('total_upvotes') - F('total_downvotes'))
+                total += quotes.update(popularity=Quote.popularity_expression())
+            self.stdout.write(f'Updated {total} quotes')
+
+        # every quote may have changed, so every quote ETag goes and every leaderboard is rebuilt
+        versions.bump('quotes')
+        Category.mark_leaderboards_dirty()
+        logger.info(f'recompute_popularity updated {total} quotes in {time.time() - started:.1f}s')
+        self.stdout.write(self.style.SUCCESS(f'Done - updated {total} quotes'))
@@ -0,0 +1,19 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from quotes import leaderboard
+
+logger = logging.getLogger('fq')
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-category top quote lists (CategoryLeaderboard) for categories whose quotes have changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild every category, e.g. after editing categories in the admin')
+
+    def handle(self, *args, **options):
+        total = leaderboard.refresh(everything=options['all'])
+        logger.info(f'refresh_leaderboards rebuilt {total} categories')
+        self.stdout.write(self.style.SUCCESS(f'Done - rebuilt {total} categories'))
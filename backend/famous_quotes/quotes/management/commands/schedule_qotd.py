@@ -0,0 +1,34 @@
+import datetime
+import logging
+
+from django.core.management.base import BaseCommand
+
+from quotes import qotd
+from quotes.models import Category
+
+logger = logging.getLogger('fq')
+
+
+class Command(BaseCommand):
+    help = 'Pick the quote of the day, for every category and for no category, for the next few days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='How many days ahead to schedule, starting today')
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        categories = [None] + list(Category.objects.all())
+        created = 0
+        missing = 0
+        # a day at a time, so each day's picks can see the ones before it
+        for offset in range(options['days']):
+            date = today + datetime.timedelta(days=offset)
+            for category in categories:
+                result, was_created = qotd.get_or_create(date, category)
+                created += was_created
+                missing += result is None
+
+        if missing:
+            logger.warn(f'schedule_qotd could not find a quote for {missing} category days')
+        logger.info(f'schedule_qotd created {created} quotes of the day')
+        self.stdout.write(self.style.SUCCESS(f'Done - created {created}, {missing} without a suitable quote'))
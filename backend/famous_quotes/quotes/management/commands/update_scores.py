@@ -0,0 +1,58 @@
+from datetime import datetime
+import logging
+import pytz
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from quotes.models import Category, Quote
+from quotes.scoring import SCORERS
+
+logger = logging.getLogger('fq')
+
+
+class Command(BaseCommand):
+    help = 'Update the materialised ranking columns (wilson_score, bayesian_score, hot_score...) for quotes whose votes have changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rescore every quote, e.g. after changing a scorer')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # anything voted on after this gets picked up by the next run
+        started = datetime.now(pytz.UTC)
+
+        queryset = Quote.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(Q(scores_updated_at__isnull=True) | Q(last_voted_at__gte=F('scores_updated_at')))
+
+        scorers = list(SCORERS.values())
+        for scorer in scorers:
+            scorer.prepare(queryset)
+        fields = [scorer.field for scorer in scorers] + ['scores_updated_at']
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(
+                queryset.filter(id__gt=last_id).order_by('id').values_list('id', 'total_upvotes', 'total_downvotes', 'created_at')[:options['batch_size']]
+            )
+            if not batch:
+                break
+
+            quotes = []
+            for quote_id, upvotes, downvotes, created_at in batch:
+                quote = Quote(id=quote_id, scores_updated_at=started)
+                for scorer in scorers:
+                    setattr(quote, scorer.field, scorer.score(upvotes, downvotes, created_at))
+                quotes.append(quote)
+            Quote.objects.bulk_update(quotes, fields)
+            # their place in the score orderings has moved - the refresh may already have run since their votes
+            Category.mark_leaderboards_dirty(quote_ids=[quote.id for quote in quotes])
+
+            total += len(batch)
+            last_id = batch[-1][0]
+            self.stdout.write(f'Scored {total} quotes')
+
+        logger.info(f'update_scores rescored {total} quotes')
+        self.stdout.write(self.style.SUCCESS(f'Done - scored {total} quotes'))
@@ -0,0 +1,66 @@
+import logging
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .jobs import PeriodicJobs
+from .throttling import IpMonitorLive, IpThrottleWriter
+from .throttle_backends import get_backend
+from .prefix_trie import PrefixTrie
+
+logger = logging.getLogger('fq')
+
+
+def throttle_response():
+    return JsonResponse({'message': 'This IP address has been temporarily banned to protect our servers.\n\nIf you are a legitimate website user, please try using the website at a slower pace.'}, status=403)
+
+
+class IpThrottleMiddleware:
+    '''
+    Runs the IP monitor before anything else gets a chance to touch the database
+    (sessions, auth...), so a blocked IP costs nothing more than a backend lookup.
+
+    Limits come from settings.IP_MONITOR_ROUTE_LIMITS - {path prefix: (seconds, count)},
+    matched on the longest prefix. Paths matching no prefix are not monitored.
+    Each prefix gets its own counts, but a block from any of them applies to them all.
+    Requests are also counted per /24 (IPv4) or /64 (IPv6), with a limit of
+    IP_MONITOR_SUBNET_FACTOR x the route's limit, and the whole subnet is blocked if it goes over.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        backend = get_backend(settings.IP_MONITOR_BACKEND)
+        writer = IpThrottleWriter(flush_interval=settings.IP_THROTTLE_FLUSH_SECONDS)
+        subnet_blocks = PrefixTrie()
+        self.monitors = []
+        blocked_ips = None  # only the first monitor needs to load blocks from the db
+        for prefix, (seconds, count) in sorted(settings.IP_MONITOR_ROUTE_LIMITS.items(), key=lambda x: -len(x[0])):
+            monitor = IpMonitorLive(
+                monitor_limit_seconds=seconds,
+                monitor_limit_count=count,
+                backend=backend,
+                blocked_ips=blocked_ips,
+                scope=prefix,
+                writer=writer,
+                subnet_limit_count=count * settings.IP_MONITOR_SUBNET_FACTOR if settings.IP_MONITOR_SUBNET_FACTOR else None,
+                subnet_blocks=subnet_blocks,
+            )
+            self.monitors.append((prefix, monitor))
+            blocked_ips = {}
+
+        # every request goes through here, so this is where the (lazily started) job thread lives
+        self.jobs = PeriodicJobs(settings.PERIODIC_JOBS)
+
+    def get_monitor(self, path):
+        for prefix, monitor in self.monitors:
+            if path.startswith(prefix):
+                return monitor
+        return None
+
+    def __call__(self, request):
+        self.jobs.start()
+        monitor = self.get_monitor(request.path)
+        if monitor is not None and not monitor.add_request(request):
+            return throttle_response()
+        return self.get_response(request)
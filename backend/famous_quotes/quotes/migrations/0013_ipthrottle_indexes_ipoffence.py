@@ -0,0 +1,30 @@
+# Generated by Django 3.2 on 2026-10-18 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0012_auto_20230304_2138'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IpOffence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.CharField(max_length=100, unique=True)),
+                ('offences', models.IntegerField(default=0)),
+                ('last_blocked', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ipthrottle',
+            index=models.Index(fields=['ip_address'], name='quotes_ipth_ip_addr_631b0e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ipthrottle',
+            index=models.Index(fields=['block_expires'], name='quotes_ipth_block_e_0b9d9f_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0013_ipthrottle_indexes_ipoffence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quote',
+            name='bayesian_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='last_voted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='scores_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='wilson_score',
+            field=models.FloatField(default=0),
+        ),
+    ]
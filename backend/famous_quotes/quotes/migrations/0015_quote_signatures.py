@@ -0,0 +1,34 @@
+# Generated by Django 3.2 on 2026-10-18 11:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0014_quote_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteSignature',
+            fields=[
+                ('quote', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='quotes.quote')),
+                ('minhash', models.BinaryField(max_length=256)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuoteBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('signature', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='quotes.quotesignature')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='quotebucket',
+            index=models.Index(fields=['bucket'], name='quotes_quot_bucket_612b72_idx'),
+        ),
+    ]
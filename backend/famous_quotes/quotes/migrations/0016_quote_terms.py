@@ -0,0 +1,27 @@
+# Generated by Django 3.2 on 2026-10-18 11:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0015_quote_signatures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=50)),
+                ('weight', models.FloatField(default=1)),
+                ('quote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quotes.quote')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='quoteterm',
+            index=models.Index(fields=['term', 'quote'], name='quotes_quot_term_69cae9_idx'),
+        ),
+    ]
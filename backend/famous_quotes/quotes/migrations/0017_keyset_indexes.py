@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0016_quote_terms'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['quote', '-created_at', 'id'], name='quotes_comm_quote_i_876aed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['user_session', '-created_at', 'id'], name='quotes_comm_user_se_93437a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['quote', '-created_at', 'id'], name='quotes_vote_quote_i_66025c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['user', '-created_at', 'id'], name='quotes_vote_user_id_8aea1c_idx'),
+        ),
+    ]
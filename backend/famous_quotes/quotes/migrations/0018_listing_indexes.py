@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0017_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['redirect_quote', '-total_upvotes', '-popularity', 'id'], name='quotes_quot_redirec_cbe5b4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['redirect_quote', '-net_votes', 'id'], name='quotes_quot_redirec_58a732_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['redirect_quote', '-created_at', 'id'], name='quotes_quot_redirec_00aec9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['redirect_quote', '-wilson_score', 'id'], name='quotes_quot_redirec_ea77db_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['redirect_quote', '-popularity', '-total_upvotes'], name='quotes_quot_redirec_82cd03_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['quote', 'session_id', 'created_at'], name='quotes_vote_quote_i_a1f53c_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 12:23
+
+from django.db import migrations, models
+import quotes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0019_category_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ipthrottle',
+            name='block_expires',
+            field=models.DateTimeField(blank=True, default=quotes.models.default_block_expires, null=True),
+        ),
+    ]
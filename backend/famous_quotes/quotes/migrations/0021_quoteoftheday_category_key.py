@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def fill_category_key(apps, schema_editor):
+    QuoteOfTheDay = apps.get_model('quotes', 'QuoteOfTheDay')
+    QuoteOfTheDay.objects.filter(category__isnull=False).update(category_key=models.F('category_id'))
+    # any-category days that got two rows keep the first, which is the one that was served
+    for row in QuoteOfTheDay.objects.filter(category__isnull=True).values('date').annotate(first=Min('id')):
+        QuoteOfTheDay.objects.filter(category__isnull=True, date=row['date']).exclude(id=row['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0020_ipthrottle_block_expires_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quoteoftheday',
+            name='category_key',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_category_key, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='quoteoftheday',
+            unique_together={('category_key', 'date')},
+        ),
+    ]
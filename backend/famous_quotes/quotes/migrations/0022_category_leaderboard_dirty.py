@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0021_quoteoftheday_category_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='leaderboard_dirty',
+            field=models.BooleanField(default=False),
+        ),
+    ]
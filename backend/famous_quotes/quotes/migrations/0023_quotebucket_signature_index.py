@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotes', '0022_category_leaderboard_dirty'),
+    ]
+
+    operations = [
+        # the new index first, so lookups are never left without one
+        migrations.AddIndex(
+            model_name='quotebucket',
+            index=models.Index(fields=['bucket', 'signature'], name='quotes_quot_bucket_c36349_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='quotebucket',
+            name='quotes_quot_bucket_612b72_idx',
+        ),
+    ]
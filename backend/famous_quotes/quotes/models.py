@@ -3,9 +3,13 @@ import logging
 import pytz
 
 from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 
+from .scoring import SCORERS
 from .utils import generate_random_code
+from . import versions
 import pdb
 
 logger = logging.getLogger('fq')
@@ -29,10 +33,41 @@ class UserSession(models.Model):
 class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     category = models.CharField(max_length=50, null=False, blank=False, unique=True)
+    # when the CategoryLeaderboard rows were last rebuilt, see leaderboard.py. None = never, or not to be served
+    leaderboard_updated_at = models.DateTimeField(null=True, blank=True)
+    # something besides a vote (which the refresh finds by itself) has changed it since then
+    leaderboard_dirty = models.BooleanField(default=False)
 
     def __str__(self):
         return self.category
 
+    @classmethod
+    def get_for_leaderboards(cls, quote_ids=None, category_ids=None):
+        categories = cls.objects.all()
+        if quote_ids is not None:
+            # a subquery rather than a join, so MySQL runs one UPDATE (which waits for refresh_category's
+            # lock) rather than reading the ids first without a lock
+            categories = categories.filter(id__in=Quote.categories.through.objects.filter(quote_id__in=quote_ids).values('category_id'))
+        if category_ids is not None:
+            categories = categories.filter(id__in=category_ids)
+        return categories
+
+    @classmethod
+    def mark_leaderboards_dirty(cls, quote_ids=None, category_ids=None):
+        '''
+        Have the next refresh rebuild the leaderboards of these categories (or of the categories these
+        quotes are in, or of every category). They are still served in the meantime.
+        '''
+        return cls.get_for_leaderboards(quote_ids, category_ids).update(leaderboard_dirty=True)
+
+    @classmethod
+    def invalidate_leaderboards(cls, quote_ids=None, category_ids=None):
+        '''
+        Stop serving the leaderboards of these categories until they are next refreshed - for changes
+        that would make them wrong rather than just out of date, like a quote leaving a category.
+        '''
+        return cls.get_for_leaderboards(quote_ids, category_ids).update(leaderboard_updated_at=None)
+
 
 class Quote(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -47,6 +82,13 @@ class Quote(models.Model):
     net_votes = models.IntegerField(default=0)
     popularity = models.FloatField(default=0.5)
 
+    # alternative rankings, see scoring.py - set when the quote is added, kept up to date by the update_scores command
+    wilson_score = models.FloatField(default=0)
+    bayesian_score = models.FloatField(default=0)
+    hot_score = models.FloatField(default=0)
+    last_voted_at = models.DateTimeField(null=True, blank=True)
+    scores_updated_at = models.DateTimeField(null=True, blank=True)
+
     duplicate_votes = models.IntegerField(default=0)
     offensive_votes = models.IntegerField(default=0)
     misattribution_votes = models.IntegerField(default=0)
@@ -60,29 +102,38 @@ class Quote(models.Model):
     def merge_with(self, other_quote):
         if type(other_quote) == int:
             other_quote = Quote.objects.get(pk=other_quote)
-        
-        # need to take the quotes off the old one, and update the vote table
-        with transaction.atomic():
-            # note: up/down votes for self get updated automatically when the vote gets saved
-
-            other_quote.total_upvotes = 0
-            other_quote.total_downvotes = 0
-
-            for category in other_quote.categories.all():
-                self.categories.add(category.id)
-            
-            votes = Vote.objects.filter(quote=other_quote)
-            for vote in votes:
-                vote.quote = self
-                vote.save()
-
-            # most importantly - set up the redirect!
-            other_quote.redirect_quote = self.id
-
-            self.save()
-            other_quote.save()
+        if other_quote.id == self.id:
+            raise ValueError(f'Cannot merge quote {self.id} with itself')
 
-            logger.info(f'Quote {self.id} successfully merged with quote {other_quote.id}!')
+        # a fixed number of queries however many votes there are - nothing is loaded vote by vote
+        with transaction.atomic():
+            # lock both rows, always in the same order, so concurrent merges can't deadlock
+            list(Quote.objects.select_for_update().filter(pk__in=[self.id, other_quote.id]).order_by('id').values_list('id'))
+
+            self.categories.add(*other_quote.categories.values_list('id', flat=True))
+
+            votes = Vote.objects.filter(quote_id=other_quote.id)
+            moved = votes.aggregate(up=Count('id', filter=Q(value__gt=0)), down=Count('id', filter=Q(value__lt=0)))
+            votes.update(quote_id=self.id)
+            if moved['up'] or moved['down']:
+                Quote.apply_votes(self.id, moved['up'], moved['down'])
+            Category.mark_leaderboards_dirty(quote_ids=[self.id, other_quote.id])
+
+            # most importantly - set up the redirect! (and move any that pointed at the old quote)
+            Quote.objects.filter(redirect_quote=other_quote.id).update(redirect_quote=self.id)
+            Quote.objects.filter(pk=other_quote.id).update(
+                total_upvotes=0,
+                total_downvotes=0,
+                net_votes=0,
+                popularity=0.5,
+                redirect_quote=self.id,
+                last_voted_at=datetime.now(pytz.UTC),
+            )
+            versions.bump(f'quote:{other_quote.id}')
+
+        self.refresh_from_db(fields=['total_upvotes', 'total_downvotes', 'net_votes', 'popularity', 'last_voted_at'])
+        other_quote.refresh_from_db(fields=['total_upvotes', 'total_downvotes', 'net_votes', 'popularity', 'redirect_quote', 'last_voted_at'])
+        logger.info(f'Quote {self.id} successfully merged with quote {other_quote.id}! ({moved["up"]} upvotes, {moved["down"]} downvotes moved)')
 
 
     def update_popularity(self):
@@ -107,6 +158,47 @@ class Quote(models.Model):
         # instead - move n_votes from 20 to 19. these means both lines have dx = 9 and dy = 0.2
 
 
+    @staticmethod
+    def popularity_expression(up_delta=0, down_delta=0):
+        '''
+        SQL version of update_popularity, for the vote counts a row will have once up_delta and
+        down_delta have been added. Totals are compared via lookups so this works in an UPDATE.
+        '''
+        upvotes = F('total_upvotes') + up_delta
+        total = F('total_upvotes') + F('total_downvotes') + (up_delta + down_delta)
+        popularity = Cast(upvotes, models.FloatField()) / Cast(total, models.FloatField())
+        factor = Value(0.6) + Value(0.4 / 18) * (total - 1)
+        return Case(
+            When(total_upvotes__lte=Value(-(up_delta + down_delta)) - F('total_downvotes'), then=Value(0.5)),
+            When(total_upvotes__gte=Value(20 - (up_delta + down_delta)) - F('total_downvotes'), then=popularity),
+            default=(popularity - Value(0.5)) * factor + Value(0.5),
+            output_field=models.FloatField(),
+        )
+
+    @classmethod
+    def apply_vote(cls, quote_id, vote_value):
+        return cls.apply_votes(quote_id, 1 if vote_value > 0 else 0, 1 if vote_value < 0 else 0)
+
+    @classmethod
+    def apply_votes(cls, quote_id, up, down):
+        '''
+        Add up/down votes to the quote's totals in a single UPDATE, so concurrent votes can't
+        overwrite each other and the row is only locked for as long as the UPDATE takes.
+        Returns the number of rows updated (0 if the quote doesn't exist).
+        '''
+        # an UPDATE doesn't send post_save, so bump the version here. the leaderboard refresh finds
+        # the quote's categories through last_voted_at, so nothing else is written per vote
+        versions.bump(f'quote:{quote_id}')
+        return cls.objects.filter(pk=quote_id).update(
+            # popularity must come first - MySQL evaluates SET left to right, so any later
+            # assignment would see the new totals rather than the old ones
+            popularity=cls.popularity_expression(up, down),
+            total_upvotes=F('total_upvotes') + up,
+            total_downvotes=F('total_downvotes') + down,
+            net_votes=F('net_votes') + (up - down),
+            last_voted_at=datetime.now(pytz.UTC),  # not Now() - CURRENT_TIMESTAMP only has whole seconds
+        )
+
     def update_votes(self, vote_value):
         if vote_value > 0:
             self.total_upvotes += 1
@@ -128,7 +220,76 @@ class Quote(models.Model):
 
     class Meta:
         ordering = ['-popularity', '-total_upvotes']
-        indexes = [models.Index(fields=['author'])]
+        indexes = [
+            models.Index(fields=['author']),
+            # only the listings audit_queries covers get one - every vote rewrites the vote columns, so each
+            # index on them costs every vote. ending in id matches the keyset pagination cursor, and listings
+            # always filter on redirect_quote IS NULL, so that goes first and the rest come back in index order
+            models.Index(fields=['redirect_quote', '-total_upvotes', '-popularity', 'id']),
+            models.Index(fields=['redirect_quote', '-net_votes', 'id']),
+            models.Index(fields=['redirect_quote', '-created_at', 'id']),
+            models.Index(fields=['redirect_quote', '-wilson_score', 'id']),
+            # Meta.ordering, used by the home screen (its -popularity prefix) and quote of the day
+            models.Index(fields=['redirect_quote', '-popularity', '-total_upvotes']),
+        ]
+
+    def save(self, *args, **kwargs):
+
+        # score new quotes straight away rather than leave them at 0 until update_scores next runs.
+        # scores_updated_at stays empty, so that run still rescores them from the saved created_at
+        if self._state.adding:
+            created_at = self.created_at or datetime.now(pytz.UTC)
+            for scorer in SCORERS.values():
+                setattr(self, scorer.field, scorer.score(self.total_upvotes, self.total_downvotes, created_at))
+
+        super().save(*args, **kwargs)
+
+
+class QuoteSignature(models.Model):
+    '''MinHash signature of a quote, for finding near-duplicates - see dedupe.py'''
+    quote = models.OneToOneField(Quote, on_delete=models.CASCADE, primary_key=True)
+    minhash = models.BinaryField(max_length=256)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Signature for quote {self.quote_id}'
+
+
+class QuoteBucket(models.Model):
+    '''One LSH band of a QuoteSignature. Quotes sharing a bucket are duplicate candidates'''
+    signature = models.ForeignKey(QuoteSignature, on_delete=models.CASCADE, related_name='buckets')
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        # covers dedupe.find_similar's lookup and grouping, without reading the rows
+        indexes = [models.Index(fields=['bucket', 'signature'])]
+
+
+class QuoteTerm(models.Model):
+    '''Inverted search index - one row per (quote, stemmed term). See search.py'''
+    quote = models.ForeignKey(Quote, on_delete=models.CASCADE)
+    term = models.CharField(max_length=50)
+    weight = models.FloatField(default=1)
+
+    class Meta:
+        indexes = [models.Index(fields=['term', 'quote'])]
+
+    def __str__(self):
+        return f'{self.term} - quote {self.quote_id}'
+
+
+class CategoryLeaderboard(models.Model):
+    '''The top quotes in a category for one sort order, by rank. See leaderboard.py'''
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    sort_key = models.CharField(max_length=20)
+    rank = models.PositiveSmallIntegerField()
+    quote = models.ForeignKey(Quote, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ['category', 'sort_key', 'rank']
+
+    def __str__(self):
+        return f'{self.category_id} {self.sort_key} #{self.rank} - quote {self.quote_id}'
 
 
 class QuoteList(models.Model):
@@ -175,6 +336,11 @@ class Vote(models.Model):
         indexes = [
             models.Index(fields=['user']), 
             models.Index(fields=['quote']),
+            # for paging through a quote's / user's votes, newest first
+            models.Index(fields=['quote', '-created_at', 'id']),
+            models.Index(fields=['user', '-created_at', 'id']),
+            # covers the duplicate vote check in VoteView
+            models.Index(fields=['quote', 'session_id', 'created_at']),
         ]
     
     def __str__(self):
@@ -189,10 +355,14 @@ class Vote(models.Model):
 
         # when saving the vote, update the quote data
         with transaction.atomic():
-            self.quote.update_votes(self.value)
-            self.quote.save()
+            if not Quote.apply_vote(self.quote_id, self.value):
+                raise Quote.DoesNotExist(f'Quote {self.quote_id} does not exist')
             super().save(*args, **kwargs)
 
+        # keep an already-loaded quote in step, without going back to the db for it
+        if Vote.quote.is_cached(self):
+            self.quote.update_votes(self.value)
+
 
 class Analytic(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -222,7 +392,11 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['user_session', '-created_at']
-        indexes = [models.Index(fields=['user_session', 'quote'])]
+        indexes = [
+            models.Index(fields=['user_session', 'quote']),
+            models.Index(fields=['quote', '-created_at', 'id']),
+            models.Index(fields=['user_session', '-created_at', 'id']),
+        ]
 
     def __str__(self):
         return f'{str(self.user.email)} - {self.created_at.isoformat()}: {self.comment[:20]}'
@@ -232,9 +406,16 @@ class QuoteOfTheDay(models.Model):
     category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.CASCADE)
     date = models.DateField()
     quote = models.ForeignKey(Quote, on_delete=models.CASCADE)
+    # the category id, or 0 for the any-category quote. A unique index lets any number of NULLs
+    # through, so it goes on this rather than on category - that way there is only ever one row per day
+    category_key = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.category_key = self.category_id or 0
+        super().save(*args, **kwargs)
 
     class Meta:
-        unique_together = ['category', 'date']
+        unique_together = ['category_key', 'date']
         indexes = [models.Index(fields=['date'])]
 
 
@@ -251,10 +432,31 @@ class IpMonitor(models.Model):
         indexes = [models.Index(fields=['datetime', 'ip_address'])]
 
 
+def default_block_expires():
+    # a callable, so the default is worked out per row rather than once at import
+    return datetime.now(pytz.UTC) + timedelta(days=1)
+
+
 class IpThrottle(models.Model):
     ip_address = models.CharField(max_length=100, null=False, blank=False)
-    block_expires = models.DateTimeField(null=True, blank=True, default=datetime.now(pytz.UTC)+timedelta(days=1))
+    block_expires = models.DateTimeField(null=True, blank=True, default=default_block_expires)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f'{self.ip_address} - blocked until {self.block_expires.isoformat()}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ip_address']),
+            models.Index(fields=['block_expires']),
+        ]
+
+
+class IpOffence(models.Model):
+    '''Expired IpThrottle rows rolled up to one row per IP - see manage.py prune_ip_throttles'''
+    ip_address = models.CharField(max_length=100, null=False, blank=False, unique=True)
+    offences = models.IntegerField(null=False, blank=False, default=0)
+    last_blocked = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.ip_address} - {self.offences} offences'
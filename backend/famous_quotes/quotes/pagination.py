@@ -0,0 +1,105 @@
+'''
+Keyset (cursor) pagination. Rather than LIMIT/OFFSET - which reads and throws away every row
+before the page - each page carries on from the sort values of the last row of the one before,
+so with an index on the sort columns every page costs the same as the first.
+
+The ordering always ends in id, so rows are totally ordered and nothing is skipped or repeated
+when several rows share the same sort values. The cursor handed to the client is opaque.
+'''
+
+from datetime import datetime
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_ordering(ordering):
+    '''Add id as the final tie-breaker - oldest first, which is the order ties have always come back in'''
+    ordering = list(ordering)
+    if ordering[-1].lstrip('-') != 'id':
+        ordering.append('id')
+    return ordering
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def get_fields(queryset, ordering):
+    '''The model field (or annotation's output field) behind each entry of ordering'''
+    annotations = queryset.query.annotations
+    return [
+        annotations[name].output_field if name in annotations else queryset.model._meta.get_field(name)
+        for name in (field.lstrip('-') for field in ordering)
+    ]
+
+
+def decode_cursor(cursor, fields):
+    '''
+    The values in cursor, each converted by the matching field in fields. The client can send
+    anything, so every value is checked here rather than left to blow up in the query.
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise InvalidCursor(f'Cursor does not match the ordering: {cursor}')
+    try:
+        values = [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError):
+        raise InvalidCursor(f'Cursor values do not fit the ordering: {cursor}')
+    if any(value is None for value in values):
+        raise InvalidCursor(f'Cursor values do not fit the ordering: {cursor}')
+    return values
+
+
+def after(ordering, values):
+    '''
+    Filter for the rows that come after values in ordering, i.e. for (-a, -b, -id):
+    a < A or (a = A and b < B) or (a = A and b = B and id < ID)
+    '''
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = {f.lstrip('-'): value for f, value in zip(ordering[:i], values[:i])}
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+    return condition
+
+
+def paginate(queryset, ordering, number, cursor=None):
+    '''
+    Return (list of up to number objects, cursor for the next page or None if this is the last).
+    Raises InvalidCursor for a cursor that can't be decoded or doesn't fit the ordering.
+    '''
+    ordering = get_ordering(ordering)
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(after(ordering, decode_cursor(cursor, get_fields(queryset, ordering))))
+
+    # one extra row tells us whether there's another page without a COUNT
+    page = list(queryset[:number + 1])
+    if len(page) <= number:
+        return page, None
+    page = page[:number]
+    return page, get_cursor(page[-1], ordering)
+
+
+def get_names(ordering):
+    '''The columns a cursor for ordering is made of'''
+    return [field.lstrip('-') for field in get_ordering(ordering)]
+
+
+def get_cursor(obj, ordering):
+    '''The cursor for the page that follows obj - a model instance, or a row from values()'''
+    if isinstance(obj, dict):
+        return encode_cursor([obj[name] for name in get_names(ordering)])
+    return encode_cursor([getattr(obj, name) for name in get_names(ordering)])
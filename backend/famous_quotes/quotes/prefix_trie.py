@@ -0,0 +1,104 @@
+KEY_BITS = 128  # IPs are packed into IPv6 space, see utils.pack_ip
+
+
+class Node:
+    __slots__ = ('prefix', 'length', 'value', 'children')
+
+    def __init__(self, prefix, length, value=None):
+        self.prefix = prefix
+        self.length = length
+        self.value = value
+        self.children = [None, None]
+
+
+def mask(length):
+    return ((1 << length) - 1) << (KEY_BITS - length)
+
+
+def bit(key, index):
+    return (key >> (KEY_BITS - 1 - index)) & 1
+
+
+class PrefixTrie:
+    '''
+    Path-compressed binary (radix) trie of network prefixes -> values.
+    Lookups and inserts walk at most one node per branching bit, so cost is bounded by
+    the prefix length rather than by the number of networks stored.
+    A value of None means "no entry", so None can't be stored.
+    '''
+
+    def __init__(self):
+        self.root = Node(0, 0)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, network, length, value):
+        network &= mask(length)
+        node = self.root
+        while True:
+            if node.length == length:
+                if node.value is None:
+                    self.size += 1
+                node.value = value
+                return
+
+            branch = bit(network, node.length)
+            child = node.children[branch]
+            if child is None:
+                node.children[branch] = Node(network, length, value)
+                self.size += 1
+                return
+
+            # how many leading bits do the child and the new network share?
+            common = min(KEY_BITS - (child.prefix ^ network).bit_length(), child.length, length)
+            if common == child.length:
+                node = child
+                continue
+
+            # split the edge to the child at the point they diverge
+            middle = Node(network & mask(common), common)
+            middle.children[bit(child.prefix, common)] = child
+            if common == length:
+                middle.value = value
+            else:
+                middle.children[bit(network, common)] = Node(network, length, value)
+            node.children[branch] = middle
+            self.size += 1
+            return
+
+    def longest_match(self, key):
+        '''Return (network, length, value) for the most specific prefix containing key, or None'''
+        best = None
+        node = self.root
+        while node is not None:
+            if node.value is not None:
+                best = (node.prefix, node.length, node.value)
+            if node.length == KEY_BITS:
+                break
+            child = node.children[bit(key, node.length)]
+            if child is None or (key ^ child.prefix) >> (KEY_BITS - child.length):
+                break
+            node = child
+        return best
+
+    def remove(self, network, length):
+        # leave the node in place - the structure stays valid, it just carries no value
+        network &= mask(length)
+        node = self.root
+        while node is not None and node.length < length:
+            node = node.children[bit(network, node.length)]
+            if node is not None and (network ^ node.prefix) & mask(node.length):
+                return
+        if node is not None and node.length == length and node.prefix == network and node.value is not None:
+            node.value = None
+            self.size -= 1
+
+    def items(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                yield node.prefix, node.length, node.value
+            stack.extend(child for child in node.children if child is not None)
@@ -0,0 +1,110 @@
+'''
+Quote of the day. The schedule_qotd command picks the quotes for the coming days ahead of
+time, so normally the view only has to look one up - and after the first lookup in a process,
+not even that: the answer for each (date, category) is kept in memory, checked against the
+version counters (see versions.py) of the quote and of everything else it is built from, so it
+is dropped as soon as anything behind it changes.
+'''
+
+from datetime import timedelta
+import logging
+import threading
+
+from django.db import IntegrityError, transaction
+
+from quotes import versions
+from quotes.models import Quote, QuoteOfTheDay
+from quotes.serializers import QuoteSerializer
+
+logger = logging.getLogger('fq')
+
+# try not to repeat a quote within this many days, settling for shorter gaps if we run out
+WINDOWS = [180, 90, 45, 30, 14, 7]
+
+# {(date, lower case category name or ''): (versions, serialized quote)} - by name so the view's ETag
+# can be worked out from the request without looking the category up
+answers = {}
+lock = threading.Lock()
+
+
+def pick_quote(date, category=None):
+    '''The id of the best quote not used recently for category (None = any), or None if there isn't one'''
+    quotes = Quote.objects.filter(redirect_quote__isnull=True)
+    if category:
+        quotes = quotes.filter(categories=category)
+
+    for days in WINDOWS:
+        recent = QuoteOfTheDay.objects.filter(category=category, date__gte=date - timedelta(days=days)).values('quote_id')
+        # LIMIT 1 - only the best one is needed
+        quote_id = quotes.exclude(id__in=recent).order_by('-popularity', '-total_upvotes').values_list('id', flat=True).first()
+        if quote_id is not None:
+            return quote_id
+    return None
+
+
+def get_or_create(date, category=None):
+    '''Return (QuoteOfTheDay for date and category or None if no quote is suitable, whether it was created now)'''
+    existing = QuoteOfTheDay.objects.filter(date=date, category=category).select_related('quote').first()
+    if existing:
+        return existing, False
+
+    quote_id = pick_quote(date, category)
+    if quote_id is None:
+        return None, False
+
+    try:
+        with transaction.atomic():
+            return QuoteOfTheDay.objects.create(date=date, category=category, quote_id=quote_id), True
+    except IntegrityError:
+        # someone else got there first - theirs wins (with or without a category, see QuoteOfTheDay.category_key)
+        return QuoteOfTheDay.objects.filter(date=date, category=category).first(), False
+
+
+def get_key(date, category_name=''):
+    return (date, (category_name or '').lower())
+
+
+# the version counters every remembered answer depends on: which quotes were picked, and anything
+# that rewrites quotes or categories in bulk (recompute_popularity, a category being renamed...)
+VERSION_NAMES = ['qotd', 'quotes', 'categories']
+
+
+def get_names(quote_id):
+    return VERSION_NAMES + [f'quote:{quote_id}']
+
+
+def get_cached(date, category_name=''):
+    '''The serialized quote of the day this process already has, if it's still current, else None. No queries'''
+    answer = answers.get(get_key(date, category_name))
+    if not answer or versions.get_versions(get_names(answer[1]['id'])) != answer[0]:
+        return None
+    return answer[1]
+
+
+def get(date, category=None):
+    '''Return (serialized quote of the day or None, whether it was created now)'''
+    category_name = category.category if category else ''
+    cached = get_cached(date, category_name)
+    if cached is not None:
+        return cached, False
+
+    # versions read before the data, so a change in between leaves the entry already out of date
+    current = versions.get_versions(VERSION_NAMES)
+    qotd, created = get_or_create(date, category)
+    if qotd is None:
+        return None, False
+    current.update(versions.get_versions([f'quote:{qotd.quote_id}']))
+    data = QuoteSerializer(qotd.quote).data
+
+    def remember():
+        if created:
+            # our own insert bumped 'qotd' - the row is ours, so it's the version after that which it belongs to
+            current.update(versions.get_versions(['qotd']))
+        with lock:
+            # nothing from before today will be asked for again
+            for old in [x for x in answers if x[0] < date]:
+                del answers[old]
+            answers[get_key(date, category_name)] = (current, data)
+    # only once it's committed, so a rolled back row is never remembered
+    transaction.on_commit(remember)
+    return data, created
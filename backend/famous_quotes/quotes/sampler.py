@@ -0,0 +1,83 @@
+'''
+Random sampling without ORDER BY RAND(), which has to read and sort every matching row on
+every call. Instead we keep every quote id in memory and probe: pick random ids, ask the db
+which of them pass the caller's filters (a primary key lookup), and try again with a wider net
+if too few did. Every id is equally likely to be picked, so the result is still a uniform
+sample of whatever the queryset matches.
+'''
+
+from array import array
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('fq')
+
+
+def get_id(obj):
+    # a model instance, or a row from values()
+    return obj['id'] if isinstance(obj, dict) else obj.id
+
+
+class RandomSampler:
+    '''
+    Holds a dense array of the model's ids. New rows are picked up on every call with one
+    indexed query for ids above the highest we know about, and the whole array is reloaded
+    every reload_seconds so deleted rows drop out.
+
+    If the filters are so narrow that probing keeps missing (e.g. a small category), we fall
+    back to fetching just the matching ids and sampling those in Python.
+    '''
+
+    # how many ids to probe per id wanted, on each successive attempt
+    OVERSAMPLE = [4, 16, 64]
+
+    def __init__(self, model, reload_seconds=3600):
+        self.model = model
+        self.reload_seconds = reload_seconds
+        self.ids = array('q')
+        self.max_id = 0
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock:
+            if self.loaded_at is None or time.time() - self.loaded_at > self.reload_seconds:
+                self.ids = array('q', self.model.objects.order_by('id').values_list('id', flat=True).iterator())
+                self.max_id = self.ids[-1] if self.ids else 0
+                self.loaded_at = time.time()
+                return
+
+            new_ids = list(self.model.objects.filter(id__gt=self.max_id).order_by('id').values_list('id', flat=True))
+            if new_ids:
+                self.ids.extend(new_ids)
+                self.max_id = new_ids[-1]
+
+    def sample(self, queryset, k):
+        '''Up to k distinct random objects (or values() rows, which must include id) from queryset, in random order'''
+        self.refresh()
+        ids = self.ids
+        queryset = queryset.order_by()
+
+        found = {}
+        for oversample in self.OVERSAMPLE:
+            size = min(len(ids), (k - len(found)) * oversample)
+            if not size:
+                break
+            candidates = set(random.sample(ids, size)) - found.keys()
+            found.update((get_id(obj), obj) for obj in queryset.filter(id__in=candidates))
+            if len(found) >= k or size == len(ids):
+                # got enough, or probed everything there is
+                return self.pick(found, k)
+
+        logger.info(f'RandomSampler probing missed for {self.model.__name__}, falling back to fetching matching ids')
+        matching = set(queryset.values_list('id', flat=True)) - found.keys()
+        wanted = random.sample(sorted(matching), min(len(matching), k - len(found)))
+        found.update((get_id(obj), obj) for obj in queryset.filter(id__in=wanted))
+        return self.pick(found, k)
+
+    def pick(self, found, k):
+        objects = list(found.values())
+        random.shuffle(objects)
+        return objects[:k]
@@ -0,0 +1,113 @@
+from datetime import datetime
+import math
+import pytz
+
+from django.conf import settings
+from django.db.models import Count, Sum
+
+# hot scores are measured from here, so they stay small enough to be readable
+EPOCH = datetime(2022, 1, 1, tzinfo=pytz.UTC)
+
+
+class Scorer:
+    '''
+    A way of ranking quotes. Each scorer's result is stored in its own column on Quote (field)
+    by the update_scores command, so sorting on it is not a calculation per request. To add one,
+    subclass this, add the column and register it in SCORERS - and an index on it only if
+    audit_queries shows the listing needs one.
+
+    A score may only depend on the quote's own votes and created_at, because update_scores only
+    rescores quotes whose votes have changed - anything that moves with the rest of the table
+    would leave the scores from different runs incomparable.
+    '''
+    name = None
+    field = None
+
+    def prepare(self, queryset):
+        '''Called once before each run'''
+        pass
+
+    def score(self, upvotes, downvotes, created_at):
+        raise NotImplementedError
+
+
+class WilsonScorer(Scorer):
+    '''
+    Lower bound of the Wilson score interval for the fraction of upvotes - "what is the worst
+    this quote's approval is likely to be?". Few votes means a wide interval and a low score,
+    so 1/1 ranks below 90/100.
+    '''
+    name = 'wilson'
+    field = 'wilson_score'
+
+    def __init__(self, z=1.96):  # 95% confidence
+        self.z = z
+
+    def score(self, upvotes, downvotes, created_at):
+        n = upvotes + downvotes
+        if n == 0:
+            return 0.0
+        z2 = self.z * self.z
+        p = upvotes / n
+        return (p + z2 / (2 * n) - self.z * math.sqrt((p * (1 - p) + z2 / (4 * n)) / n)) / (1 + z2 / n)
+
+
+class BayesianScorer(Scorer):
+    '''
+    Fraction of upvotes, starting from prior_weight imaginary votes at the site-wide average.
+    A quote needs a good number of votes before it can move far from the average.
+    The priors are worked out from the table unless given - the registered scorer takes them
+    from settings, as they have to stay put between runs.
+    '''
+    name = 'bayesian'
+    field = 'bayesian_score'
+
+    def __init__(self, prior_mean=None, prior_weight=None):
+        self.prior_mean = prior_mean
+        self.prior_weight = prior_weight
+        self.mean = prior_mean if prior_mean is not None else 0.5
+        self.weight = prior_weight if prior_weight is not None else 1
+
+    def prepare(self, queryset):
+        if self.prior_mean is not None and self.prior_weight is not None:
+            return
+        totals = queryset.model.objects.filter(redirect_quote__isnull=True).aggregate(
+            upvotes=Sum('total_upvotes'),
+            downvotes=Sum('total_downvotes'),
+            quotes=Count('id'),
+        )
+        votes = (totals['upvotes'] or 0) + (totals['downvotes'] or 0)
+        if self.prior_mean is None:
+            self.mean = totals['upvotes'] / votes if votes else 0.5
+        if self.prior_weight is None:
+            self.weight = max(1, votes / totals['quotes']) if totals['quotes'] else 1
+
+    def score(self, upvotes, downvotes, created_at):
+        return (self.weight * self.mean + upvotes) / (self.weight + upvotes + downvotes)
+
+
+class HotScorer(Scorer):
+    '''
+    Net votes on a log scale plus the age of the quote, so newer quotes outrank older ones
+    unless the older ones have many more votes (10x the net votes = timescale seconds newer).
+    Because time only enters through created_at, the order never goes stale - a quote only
+    needs rescoring when its votes change.
+    '''
+    name = 'hot'
+    field = 'hot_score'
+
+    def __init__(self, timescale=45000):
+        self.timescale = timescale
+
+    def score(self, upvotes, downvotes, created_at):
+        net = upvotes - downvotes
+        order = math.log10(max(abs(net), 1))
+        sign = 1 if net > 0 else -1 if net < 0 else 0
+        return round(sign * order + (created_at - EPOCH).total_seconds() / self.timescale, 7)
+
+
+SCORERS = {scorer.name: scorer for scorer in [
+    WilsonScorer(),
+    BayesianScorer(prior_mean=settings.BAYESIAN_PRIOR_MEAN, prior_weight=settings.BAYESIAN_PRIOR_WEIGHT),
+    HotScorer(),
+]}
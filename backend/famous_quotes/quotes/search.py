@@ -0,0 +1,117 @@
+'''
+A small inverted index for quote search. Every quote's text, author and context are split into
+stemmed terms and stored in QuoteTerm with a weight, so a search is an indexed lookup on the
+query terms rather than a LIKE '%...%' scan of every quote. Results are ranked by tf-idf:
+matching a rare word counts for more than matching a common one, and an author match counts
+for more than a word in the context.
+'''
+
+from collections import Counter
+import math
+import re
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Sum, Value, When
+
+from quotes.models import Quote, QuoteTerm
+
+# how much a term is worth depending on where it appears
+FIELD_WEIGHTS = {'quote': 1.0, 'author': 2.0, 'context': 0.5}
+MAX_TERM_LENGTH = 50
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in', 'into', 'is', 'it',
+    'no', 'not', 'of', 'on', 'or', 'so', 'such', 'that', 'the', 'their', 'then', 'there', 'these',
+    'they', 'this', 'to', 'was', 'will', 'with',
+}
+
+# longest first, so 'ingly' is tried before 'ly'
+SUFFIXES = ['ational', 'ization', 'fulness', 'iveness', 'ousness', 'ations', 'ingly', 'ation', 'ments', 'ment', 'ness', 'edly', 'ing', 'ful', 'ous', 'ed', 'ly']
+
+
+def stem(word):
+    '''
+    Cheap suffix-stripping stemmer - not Porter, but it maps the common inflections
+    (love/loves/loved/loving, happy/happiness...) onto one term, which is all search needs.
+    The same function runs over quotes and queries, so it only has to be consistent.
+    '''
+    if len(word) <= 3:
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        word = word[:-3] + 'y'
+    elif word.endswith('sses'):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith('ss') and not word.endswith('us'):
+        word = word[:-1]
+
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            # running -> runn -> run
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'lsz':
+                word = word[:-1]
+            break
+
+    # love / loving -> lov, happy / happiness -> happi
+    if word.endswith('e') and len(word) > 3:
+        word = word[:-1]
+    if word.endswith('y') and len(word) > 3:
+        word = word[:-1] + 'i'
+    return word
+
+
+def tokenise(text):
+    words = re.findall(r'\w+', (text or '').lower())
+    return [stem(word)[:MAX_TERM_LENGTH] for word in words if word not in STOP_WORDS and len(word) > 1]
+
+
+def get_terms(quote, author='', context=''):
+    '''{term: weight} for one quote'''
+    weights = Counter()
+    for field, text in [('quote', quote), ('author', author), ('context', context)]:
+        for term, count in Counter(tokenise(text)).items():
+            # repeats count, but with diminishing returns
+            weights[term] += FIELD_WEIGHTS[field] * (1 + math.log(count))
+    return weights
+
+
+def index_quote(quote):
+    '''Store (or replace) the search terms for a saved quote'''
+    with transaction.atomic():
+        QuoteTerm.objects.filter(quote_id=quote.id).delete()
+        QuoteTerm.objects.bulk_create([
+            QuoteTerm(quote_id=quote.id, term=term, weight=weight)
+            for term, weight in get_terms(quote.quote, quote.author, quote.context).items()
+        ])
+
+
+def search(queryset, query):
+    '''
+    Restrict a Quote queryset to quotes matching any term of query, annotated with relevance
+    (higher is better). Costs two small indexed queries up front for the term statistics.
+    '''
+    # nothing matches, but keep the annotation so callers can still order by relevance
+    no_results = queryset.annotate(relevance=Value(0.0, output_field=FloatField())).none()
+
+    terms = set(tokenise(query))
+    if not terms:
+        return no_results
+
+    # the highest id stands in for the number of quotes - COUNT(*) would scan the whole table
+    total = Quote.objects.aggregate(total=Max('id'))['total'] or 1
+    document_frequency = dict(
+        QuoteTerm.objects.filter(term__in=terms).values('term').annotate(n=Count('id')).values_list('term', 'n')
+    )
+    if not document_frequency:
+        return no_results
+
+    # inverse document frequency - rarer terms are worth more
+    idf = {term: math.log(1 + total / n) for term, n in document_frequency.items()}
+    relevance = Sum(
+        Case(
+            *[When(quoteterm__term=term, then=F('quoteterm__weight') * Value(weight)) for term, weight in idf.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
+    return queryset.filter(quoteterm__term__in=idf.keys()).annotate(relevance=relevance)
@@ -0,0 +1,85 @@
+'''
+Bump the version counters (see versions.py) whenever something a read endpoint returns changes,
+and mark the category leaderboards (see leaderboard.py) the change puts out of date
+'''
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from quotes import versions
+from quotes.models import Category, Quote, QuoteList, QuoteOfTheDay
+
+
+@receiver(pre_delete, sender=Quote)
+def quote_deleting(sender, instance, **kwargs):
+    # while it is still linked to its categories. its leaderboard rows go with it (on_delete), so
+    # the rest just move up a place until the refresh
+    Category.mark_leaderboards_dirty(quote_ids=[instance.id])
+
+
+@receiver([post_save, post_delete], sender=Quote)
+def quote_changed(sender, instance, **kwargs):
+    versions.bump(f'quote:{instance.id}')
+    if kwargs['signal'] is post_save:
+        Category.mark_leaderboards_dirty(quote_ids=[instance.id])
+    else:
+        # its category links went with it (see category_index.py)
+        versions.bump('category_links', 'category_links:removed')
+
+
+@receiver(m2m_changed, sender=Quote.categories.through)
+def quote_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    # for the CategoryIndex - added links can be loaded incrementally, removed ones can't
+    if action == 'post_add':
+        versions.bump('category_links')
+    else:
+        versions.bump('category_links', 'category_links:removed')
+    # a quote joining a category only has to be picked up by the next refresh, but one leaving it
+    # mustn't be served from that category's leaderboard any more
+    update = Category.mark_leaderboards_dirty if action == 'post_add' else Category.invalidate_leaderboards
+    if not reverse:
+        versions.bump(f'quote:{instance.id}')
+        # after a remove the quote is no longer linked to the categories it left, so go by pk_set.
+        # a clear doesn't say which they were
+        if pk_set:
+            update(category_ids=pk_set)
+        else:
+            update()
+    elif pk_set:
+        versions.bump(*[f'quote:{quote_id}' for quote_id in pk_set])
+        update(category_ids=[instance.id])
+    else:
+        # category.quote_set.clear() doesn't say which quotes it touched
+        versions.bump('quotes')
+        update(category_ids=[instance.id])
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    versions.bump('categories')
+    if kwargs['signal'] is post_delete:
+        versions.bump('category_links', 'category_links:removed')
+
+
+@receiver([post_save, post_delete], sender=QuoteList)
+def quotelist_changed(sender, instance, **kwargs):
+    versions.bump(f'quotelist:{instance.external_id}')
+
+
+@receiver(m2m_changed, sender=QuoteList.quotes.through)
+def quotelist_quotes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        versions.bump(f'quotelist:{instance.external_id}')
+    elif pk_set:
+        versions.bump(*[f'quotelist:{x}' for x in QuoteList.objects.filter(id__in=pk_set).values_list('external_id', flat=True)])
+    else:
+        versions.bump('quotes')
+
+
+@receiver([post_save, post_delete], sender=QuoteOfTheDay)
+def qotd_changed(sender, instance, **kwargs):
+    versions.bump('qotd')
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import math
+
+
+class Window:
+    '''
+    Ring buffer of bucket counts for one key. Every non-zero bucket lies in [start, latest],
+    and latest - start is always less than the ring size, so a bucket's slot is just
+    (period // bucket_seconds) % size.
+    '''
+    __slots__ = ('counts', 'start', 'latest', 'total')
+
+    def __init__(self, size, period):
+        self.counts = [0] * size
+        self.start = period
+        self.latest = period
+        self.total = 0
+
+
+class SlidingWindowCounter:
+    '''
+    Counts events per key over a sliding window of fixed-width time buckets.
+
+    * add() and total() are O(1) amortised - each bucket is cleared at most once,
+      and the running total is updated as buckets are added and cleared
+    * keys are kept in least-recently-touched order, so prune() only ever looks at
+      keys that have actually gone stale, however many keys there are
+    '''
+
+    def __init__(self, window_seconds, bucket_seconds=5):
+        self.bucket_seconds = bucket_seconds
+        self.size = math.ceil(window_seconds / bucket_seconds) + 1
+        self.windows = OrderedDict()
+
+    def __len__(self):
+        return len(self.windows)
+
+    def __contains__(self, key):
+        return key in self.windows
+
+    def first_bucket(self, since):
+        # earliest bucket that starts at or after since
+        return -(-since // self.bucket_seconds) * self.bucket_seconds
+
+    def expire(self, window, since):
+        # clear every bucket that starts before since
+        since = self.first_bucket(since)
+        if since > window.latest:
+            window.counts = [0] * self.size
+            window.total = 0
+            window.start = window.latest = since
+            return
+        while window.start < since:
+            slot = (window.start // self.bucket_seconds) % self.size
+            window.total -= window.counts[slot]
+            window.counts[slot] = 0
+            window.start += self.bucket_seconds
+
+    def advance(self, window, period):
+        # move latest forward to period, clearing slots that are about to be reused
+        oldest_allowed = period - (self.size - 1) * self.bucket_seconds
+        if oldest_allowed > window.latest:
+            window.counts = [0] * self.size
+            window.total = 0
+            window.start = period
+        elif window.start < oldest_allowed:
+            self.expire(window, oldest_allowed)
+        window.latest = period
+
+    def add(self, key, period, since, count=1):
+        '''Add count at period and return the key's total over the buckets starting >= since'''
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = Window(self.size, period)
+        else:
+            self.windows.move_to_end(key)
+
+        self.expire(window, since)
+        if period > window.latest:
+            self.advance(window, period)
+
+        if period >= window.start:
+            window.counts[(period // self.bucket_seconds) % self.size] += count
+            window.total += count
+        # else - too old to count towards the window, so ignore it
+        return window.total
+
+    def total(self, key, since):
+        window = self.windows.get(key)
+        if window is None:
+            return 0
+        self.expire(window, since)
+        return window.total
+
+    def prune(self, since):
+        '''Forget every key that has had nothing since before since'''
+        while self.windows:
+            key, window = next(iter(self.windows.items()))
+            if window.latest >= since:
+                break
+            del self.windows[key]
+
+    def buckets(self, key):
+        '''Yield (period, count) for the non-zero buckets of key, oldest first'''
+        window = self.windows.get(key)
+        if window is None:
+            return
+        for period in range(window.start, window.latest + 1, self.bucket_seconds):
+            count = window.counts[(period // self.bucket_seconds) % self.size]
+            if count:
+                yield period, count
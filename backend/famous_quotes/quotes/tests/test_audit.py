@@ -0,0 +1,27 @@
+from io import StringIO
+
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from quotes.management.commands.audit_queries import explain
+from quotes.models import Quote
+
+
+class AuditQueriesTest(TestCase):
+
+    def test_explain_flags_scans_and_sorts(self):
+        self.assertEqual(explain('SELECT id FROM quotes_quote WHERE id = 1'), [])
+        problems = explain('SELECT id FROM quotes_quote WHERE quote = \'x\' ORDER BY context')
+        self.assertIn('full scan of quotes_quote', problems)
+        self.assertTrue(any('order by' in x for x in problems))
+
+    def test_audit_queries(self):
+        output = StringIO()
+        call_command('audit_queries', quotes=200, votes=200, stdout=output)
+        self.assertIn('quotes default: ', output.getvalue())
+        self.assertIn('vote duplicate check: ', output.getvalue())
+        # the home screen's pools are built, not just read from the cache
+        self.assertNotIn('home screen: 0 queries', output.getvalue())
+        # everything it made is rolled back
+        self.assertEqual(Quote.objects.count(), 0)
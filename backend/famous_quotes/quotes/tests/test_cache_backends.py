@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import TestCase
+
+from quotes.cache_backends import FileCache, TieredCache
+
+
+def make_cache(shared=None, **options):
+    shared = shared or {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-test'}
+    return TieredCache('', {'OPTIONS': dict(options, SHARED=shared)})
+
+
+class TieredCacheTest(TestCase):
+
+    def setUp(self):
+        # two workers sharing one store
+        self.worker1 = make_cache(LOCAL_TIMEOUT=10, LOCAL_MAX_ENTRIES=2)
+        self.worker2 = make_cache(LOCAL_TIMEOUT=10, LOCAL_MAX_ENTRIES=2)
+        self.worker1.clear()
+
+    def test_tiers(self):
+        self.assertIsNone(self.worker1.get('key'))
+        self.worker1.set('key', {'a': 1})
+        self.assertEqual(self.worker1.get('key'), {'a': 1})
+        self.assertEqual(self.worker2.get('key'), {'a': 1})
+        self.assertEqual(self.worker2.get('key'), {'a': 1})
+
+        self.assertEqual(self.worker1.get_stats()['local_hits'], 1)
+        self.assertEqual(self.worker1.get_stats()['misses'], 1)
+        self.assertEqual(self.worker2.get_stats()['shared_hits'], 1)
+        self.assertEqual(self.worker2.get_stats()['local_hits'], 1)
+
+        # mutating what came back doesn't change the cached copy
+        self.worker1.get('key')['a'] = 2
+        self.assertEqual(self.worker1.get('key'), {'a': 1})
+
+    @mock.patch('quotes.cache_backends.time.monotonic')
+    def test_local_copies_expire(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.worker1.set('key', 1)
+        self.worker2.get('key')
+        self.worker1.delete('key')
+        self.assertIsNone(self.worker1.get('key'))
+
+        # the other worker's copy lasts at most LOCAL_TIMEOUT
+        self.assertEqual(self.worker2.get('key'), 1)
+        mock_monotonic.return_value = 111
+        self.assertIsNone(self.worker2.get('key'))
+
+    def test_lru_and_get_many(self):
+        for key in ['a', 'b', 'c']:
+            self.worker1.set(key, key)
+        self.assertEqual(len(self.worker1.local), 2)
+        self.assertEqual(self.worker1.get_many(['a', 'b', 'c', 'd']), {'a': 'a', 'b': 'b', 'c': 'c'})
+        self.assertEqual(self.worker1.get_stats()['shared_hits'], 1)
+
+    def test_add_is_shared(self):
+        self.assertTrue(self.worker1.add('lock', 1, 10))
+        self.assertFalse(self.worker2.add('lock', 1, 10))
+        self.worker1.delete('lock')
+        self.assertTrue(self.worker2.add('lock', 1, 10))
+
+        self.worker1.set('count', 1)
+        self.assertEqual(self.worker1.incr('count'), 2)
+        self.assertEqual(self.worker1.get('count'), 2)
+
+    def test_file_store(self):
+        with tempfile.TemporaryDirectory() as location:
+            shared = {'BACKEND': 'quotes.cache_backends.FileCache', 'LOCATION': location}
+            worker1 = make_cache(shared)
+            worker2 = make_cache(shared)
+            worker1.set('key', [1, 2, 3], 60)
+            self.assertEqual(worker2.get('key'), [1, 2, 3])
+            self.assertTrue(worker1.add('lock', 1, 10))
+            self.assertFalse(worker2.add('lock', 1, 10))
+
+    def test_file_add_is_atomic(self):
+        with tempfile.TemporaryDirectory() as location:
+            workers = [FileCache(location, {}) for _ in range(16)]
+            start = threading.Barrier(len(workers))
+            def add(worker):
+                start.wait()
+                return worker.add('lock', 1, 10)
+            with ThreadPoolExecutor(len(workers)) as executor:
+                self.assertEqual(sum(executor.map(add, workers)), 1)
+
+            workers[0].set('count', 0)
+            def incr(worker):
+                for _ in range(10):
+                    worker.incr('count')
+            with ThreadPoolExecutor(4) as executor:
+                list(executor.map(incr, workers[:4]))
+            self.assertEqual(workers[0].get('count'), 40)
+
+            # clear() leaves the lock file alone
+            workers[0].clear()
+            self.assertTrue(workers[0].add('lock', 1, 10))
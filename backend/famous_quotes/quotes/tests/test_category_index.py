@@ -0,0 +1,67 @@
+from django.test import TestCase, Client
+
+from quotes.category_index import CategoryIndex, get_ids
+from quotes.models import Category, Quote
+
+from ..constants import *
+
+
+class CategoryIndexTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.funny = Category.objects.create(category='Funny')
+        self.travel = Category.objects.create(category='Travel')
+        self.career = Category.objects.create(category='Career')
+        self.both = Quote.objects.create(quote='quote1', author='author1')
+        self.both.categories.set([self.funny, self.travel])
+        self.funny_only = Quote.objects.create(quote='quote2', author='author2')
+        self.funny_only.categories.set([self.funny])
+        self.career_only = Quote.objects.create(quote='quote3', author='author3')
+        self.career_only.categories.set([self.career])
+        self.index = CategoryIndex()
+
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sorted(x['id'] for x in response.json()['data'])
+
+    def test_get_ids(self):
+        self.assertEqual(get_ids(0), [])
+        self.assertEqual(get_ids((1 << 3) | (1 << 70) | 1), [0, 3, 70])
+        ids = list(range(0, 1000000, 199))
+        bitmap = 0
+        for i in ids:
+            bitmap |= 1 << i
+        self.assertEqual(get_ids(bitmap), ids)
+
+    def test_match(self):
+        self.assertEqual(self.index.match_all(['Funny', 'Travel']), [self.both.id])
+        self.assertEqual(self.index.match_all(['Funny', 'Nonsense']), [])
+        self.assertEqual(self.index.match_any(['Travel', 'Career']), sorted([self.both.id, self.career_only.id]))
+
+        # too many to be worth an id list
+        self.assertIsNone(CategoryIndex(max_ids=1).match_any(['Funny']))
+
+    def test_changes_are_picked_up(self):
+        self.index.match_all(['Funny'])
+        quote = Quote.objects.create(quote='quote4', author='author4')
+        quote.categories.set([self.funny, self.travel])
+        with self.assertNumQueries(2):
+            # new links, and the category names
+            self.assertEqual(self.index.match_all(['Funny', 'Travel']), [self.both.id, quote.id])
+        with self.assertNumQueries(1):
+            # nothing changed - just the category names
+            self.assertEqual(self.index.match_all(['Funny', 'Travel']), [self.both.id, quote.id])
+
+        # removals trigger a rebuild
+        self.both.categories.remove(self.travel)
+        self.assertEqual(self.index.match_all(['Funny', 'Travel']), [quote.id])
+        quote.delete()
+        self.assertEqual(self.index.match_all(['Funny']), [self.both.id, self.funny_only.id])
+
+    def test_quote_view(self):
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?categories=Funny,Travel'), [self.both.id])
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?categories=Funny'), sorted([self.both.id, self.funny_only.id]))
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?categories_any=Travel,Career'), sorted([self.both.id, self.career_only.id]))
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?categories=Funny&categories_any=Travel,Career'), [self.both.id])
@@ -0,0 +1,103 @@
+from io import StringIO
+
+from django.test import TestCase, Client
+from django.core.management import call_command
+
+from quotes import dedupe
+from quotes.models import Quote, QuoteSignature, QuoteBucket
+
+from ..constants import *
+
+QUOTE = 'The only way to do great work is to love what you do.'
+NEAR_DUPLICATE = 'the only way to do great work, is to love what you do!!'
+SIMILAR = 'The only way to do great work is to love the work you do.'
+DIFFERENT = 'Be yourself; everyone else is already taken.'
+
+
+class DedupeTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+
+    def create_user_and_login(self, email):
+        self.client.post(f"{USERS_URL}", data={'email': email, 'password1': 'StrongPassword', 'password2': 'StrongPassword'})
+        self.client.post(LOGIN_URL, data={'email': email, 'password': 'StrongPassword'})
+
+    def test_normalise(self):
+        self.assertEqual(dedupe.normalise(QUOTE), dedupe.normalise(NEAR_DUPLICATE))
+
+    def test_similarity(self):
+        signature = dedupe.get_signature(QUOTE, 'Steve Jobs')
+        self.assertEqual(signature, dedupe.get_signature(NEAR_DUPLICATE, 'steve jobs'))
+        self.assertEqual(dedupe.similarity(signature, dedupe.get_signature(NEAR_DUPLICATE, 'Steve Jobs')), 1.0)
+        self.assertGreater(dedupe.similarity(signature, dedupe.get_signature(SIMILAR, 'Steve Jobs')), 0.5)
+        self.assertLess(dedupe.similarity(signature, dedupe.get_signature(DIFFERENT, 'Oscar Wilde')), 0.2)
+
+        # identical signatures always share every bucket
+        self.assertEqual(dedupe.get_buckets(signature), dedupe.get_buckets(dedupe.get_signature(NEAR_DUPLICATE, 'Steve Jobs')))
+        self.assertEqual(dedupe.unpack_signature(dedupe.pack_signature(signature)), signature)
+
+    def test_find_similar(self):
+        quote1 = Quote.objects.create(quote=QUOTE, author='Steve Jobs')
+        quote2 = Quote.objects.create(quote=DIFFERENT, author='Oscar Wilde')
+        dedupe.index_quote(quote1)
+        dedupe.index_quote(quote2)
+        self.assertEqual(QuoteBucket.objects.count(), 2 * dedupe.BANDS)
+
+        with self.assertNumQueries(2):
+            matches = dedupe.find_similar(NEAR_DUPLICATE, 'Steve Jobs')
+        self.assertEqual([x['id'] for x in matches], [quote1.id])
+        self.assertEqual(matches[0]['similarity'], 1.0)
+        self.assertEqual(dedupe.find_similar(NEAR_DUPLICATE, 'Steve Jobs', exclude=quote1.id), [])
+
+        # merged-away quotes aren't offered
+        Quote.objects.filter(id=quote1.id).update(redirect_quote=quote2.id)
+        self.assertEqual(dedupe.find_similar(NEAR_DUPLICATE, 'Steve Jobs'), [])
+
+    def test_find_similar_ranks_before_limiting(self):
+        # a crowd of quotes sharing one bucket with the query, and the real duplicate added last
+        signature = dedupe.get_signature(QUOTE, 'Steve Jobs')
+        bucket = dedupe.get_buckets(signature)[0]
+        Quote.objects.bulk_create([Quote(quote=f'{DIFFERENT} {i}', author='Oscar Wilde') for i in range(dedupe.MAX_CANDIDATES + 10)])
+        for quote in Quote.objects.filter(author='Oscar Wilde'):
+            quote_signature = QuoteSignature.objects.create(quote=quote, minhash=dedupe.pack_signature(dedupe.get_signature(quote.quote, quote.author)))
+            QuoteBucket.objects.create(signature=quote_signature, bucket=bucket)
+        duplicate = Quote.objects.create(quote=NEAR_DUPLICATE, author='Steve Jobs')
+        dedupe.index_quote(duplicate)
+
+        with self.assertNumQueries(2):
+            matches = dedupe.find_similar(QUOTE, 'Steve Jobs')
+        self.assertEqual([x['id'] for x in matches], [duplicate.id])
+
+    def test_create_quote_warns_about_duplicates(self):
+        self.create_user_and_login('email@email.com')
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(QUOTES_URL, data={'quote': QUOTE, 'author': 'Steve Jobs'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['possible_duplicates'], [])
+        quote_id = response.json()['data']['id']
+        # indexed once the quote is committed, not inside its transaction
+        self.assertFalse(QuoteSignature.objects.filter(quote_id=quote_id).exists())
+        for callback in callbacks:
+            callback()
+        self.assertTrue(QuoteSignature.objects.filter(quote_id=quote_id).exists())
+
+        response = self.client.post(QUOTES_URL, data={'quote': NEAR_DUPLICATE, 'author': 'Steve Jobs'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([x['id'] for x in response.json()['possible_duplicates']], [quote_id])
+
+    def test_find_duplicate_quotes_command(self):
+        quote1 = Quote.objects.create(quote=QUOTE, author='Steve Jobs', total_upvotes=1)
+        quote2 = Quote.objects.create(quote=DIFFERENT, author='Oscar Wilde')
+        quote3 = Quote.objects.create(quote=NEAR_DUPLICATE, author='Steve Jobs', total_upvotes=5)
+
+        output = StringIO()
+        call_command('find_duplicate_quotes', stdout=output)
+        self.assertEqual(QuoteSignature.objects.count(), 3)
+        self.assertIn(f'{quote3.id}:{quote1.id} 1.00', output.getvalue())
+        self.assertNotIn(f'{quote2.id}', output.getvalue().split('Done')[0].split('Indexed 3 quotes')[1])
+
+        # nothing new to index the second time round
+        output = StringIO()
+        call_command('find_duplicate_quotes', stdout=output)
+        self.assertIn('Indexed 0 quotes', output.getvalue())
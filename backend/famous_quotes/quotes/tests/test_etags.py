@@ -0,0 +1,127 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, Client, override_settings
+
+from quotes import qotd, versions, views
+from quotes.cache_backends import TieredCache
+from quotes.models import Category, Quote, QuoteList, Vote
+
+from ..constants import *
+
+
+class ETagTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        qotd.answers.clear()
+        views.quotelist_quotes.clear()
+        self.client = Client()
+        self.category = Category.objects.create(category='Funny')
+        self.quote1 = Quote.objects.create(quote='quote1', author='author1')
+        self.quote2 = Quote.objects.create(quote='quote2', author='author2')
+
+    def tearDown(self):
+        cache.clear()
+
+    def get(self, url, etag=None):
+        if etag:
+            return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return self.client.get(url)
+
+    def test_versions(self):
+        first = versions.get_versions(['a'])['a']
+        self.assertEqual(versions.get_versions(['a'])['a'], first)
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump('a', 'never-read')
+        # bumped straight away and again on commit
+        self.assertEqual(versions.get_versions(['a'])['a'], first + 2)
+        self.assertNotEqual(versions.get_etag(['a']), versions.get_etag(['a'], 'other'))
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'quotes.cache_backends.TieredCache', 'OPTIONS': {'SHARED': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'etag-shared'}}},
+        'versions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'etag-shared'},
+    })
+    def test_versions_shared_between_workers(self):
+        # another worker's connections to the same shared store
+        other_default = TieredCache('', {'OPTIONS': {'SHARED': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'etag-shared'}}})
+        other_versions = LocMemCache('etag-shared', {})
+
+        etag = versions.get_etag(['quote:1'])
+        other_default.set('payload', 'old')
+        self.assertEqual(cache.get('payload'), 'old')
+
+        # the other worker changes things
+        other_versions.incr(versions.key('quote:1'))
+        other_default.set('payload', 'new')
+
+        # our local tier still has the old payload for a while, but the version has moved on at once
+        self.assertEqual(cache.get('payload'), 'old')
+        self.assertNotEqual(versions.get_etag(['quote:1']), etag)
+
+    def test_categories(self):
+        response = self.get(CATEGORIES_URL)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.get(CATEGORIES_URL, etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category='Travel')
+        response = self.get(CATEGORIES_URL, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 2)
+
+    def test_quotes_by_ids(self):
+        url = f'{QUOTES_URL}?ids={self.quote1.id},{self.quote2.id}'
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+        # a vote on one of them changes it
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(quote=self.quote2, session_id='session', value=1)
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+
+        # a vote on some other quote doesn't
+        etag = response['ETag']
+        quote3 = Quote.objects.create(quote='quote3', author='author3')
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(quote=quote3, session_id='session', value=1)
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+        # listings don't get one
+        self.assertFalse(self.get(QUOTES_URL).has_header('ETag'))
+
+    def test_quotelist_by_eid(self):
+        user = User.objects.create_user('user', 'email@email.com', 'StrongPassword')
+        with self.captureOnCommitCallbacks(execute=True):
+            quotelist = QuoteList.objects.create(name='list', user=user)
+            quotelist.quotes.add(self.quote1)
+        url = f'{QUOTELIST_URL}?eid={quotelist.external_id}'
+        etag = self.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(url, etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            quotelist.quotes.add(self.quote2)
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+        # and a change to a quote on the list, which the list's own version doesn't cover
+        etag = self.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(quote=self.quote2, session_id='session', value=1)
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_qotd(self):
+        # picked and remembered (once committed) by the first request
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.get(QOTD_URL)
+        self.assertEqual(response.status_code, 200)
+        etag = self.get(QOTD_URL)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(QOTD_URL, etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(quote_id=response.json()['quote']['id'], session_id='session', value=1)
+        self.assertEqual(self.get(QOTD_URL, etag).status_code, 200)
@@ -0,0 +1,64 @@
+from unittest import mock
+
+from django.http import JsonResponse
+from django.test import TestCase, Client, override_settings
+
+from quotes import fast_json
+from quotes.models import Category, Quote
+from quotes.serializers import QuoteSerializer
+
+from ..constants import *
+
+
+def encode_upper(data):
+    return b'UPPER'
+
+
+class FastJsonTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.funny = Category.objects.create(category='Funny')
+        self.travel = Category.objects.create(category='Travel')
+        quote1 = Quote.objects.create(quote='Café "quote" \U0001F600', author='author1', context=None, popularity=0.1 + 0.2)
+        quote1.categories.set([self.travel, self.funny])
+        quote2 = Quote.objects.create(quote='quote2', author='author2', context='context', total_upvotes=3, net_votes=-1)
+        quote2.categories.set([self.funny])
+        Quote.objects.create(quote='quote3', author='author3')
+
+    def expected(self, quotes):
+        return JsonResponse({'message': 'OK', 'data': [QuoteSerializer(quote).data for quote in quotes]}).content
+
+    def test_same_bytes(self):
+        queryset = Quote.objects.order_by('id')
+        expected = self.expected(queryset)
+
+        with self.assertNumQueries(2):
+            data = fast_json.from_values(queryset)
+        self.assertEqual(fast_json.json_response({'message': 'OK', 'data': data}).content, expected)
+
+        rows = list(fast_json.get_values(queryset, ['created_at']))
+        with self.assertNumQueries(1):
+            data = fast_json.from_rows(rows)
+        response = fast_json.json_response({'message': 'OK', 'data': data}, status=201)
+        self.assertEqual(response.content, expected)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(fast_json.from_values(Quote.objects.none()), [])
+            self.assertEqual(fast_json.from_rows([]), [])
+
+    def test_quote_view_builds_no_models(self):
+        with mock.patch.object(Quote, 'from_db', side_effect=AssertionError('built a Quote')):
+            for url in [f'{QUOTES_URL}?n=2&s=newest', f'{QUOTES_URL}?n=2&o=1', f'{QUOTES_URL}?s=random']:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            cursor = self.client.get(f'{QUOTES_URL}?n=2').json()['next']
+            response = self.client.get(f'{QUOTES_URL}?n=2&c={cursor}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['data']), 1)
+
+    @override_settings(FAST_JSON_ENCODER='quotes.tests.test_fast_json.encode_upper')
+    def test_pluggable_encoder(self):
+        self.assertEqual(fast_json.json_response({'a': 1}).content, b'UPPER')
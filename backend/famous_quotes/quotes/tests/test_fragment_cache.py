@@ -0,0 +1,74 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, Client
+
+from quotes.fragment_cache import FragmentCache
+from quotes.models import Quote
+
+from ..constants import *
+
+
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.fragments = FragmentCache('test', fresh_seconds=60, stale_seconds=600)
+        self.builds = 0
+
+    def tearDown(self):
+        # don't leave home screen pools behind for other tests
+        cache.clear()
+
+    def build(self):
+        self.builds += 1
+        return self.builds
+
+    @mock.patch('quotes.fragment_cache.time.time')
+    def test_fresh_then_stale(self, mock_time):
+        mock_time.return_value = 1000
+        self.assertEqual(self.fragments.get('value', self.build), 1)
+        self.assertEqual(self.fragments.get('value', self.build), 1)
+
+        # stale - whoever notices first rebuilds it...
+        mock_time.return_value = 1100
+        self.assertEqual(self.fragments.get('value', self.build), 2)
+        self.assertEqual(self.builds, 2)
+
+        # ...and while someone holds the lock, everyone else gets the stale copy
+        mock_time.return_value = 1200
+        self.assertTrue(self.fragments.lock('value'))
+        self.assertEqual(self.fragments.get('value', self.build), 2)
+        self.assertEqual(self.builds, 2)
+
+    @mock.patch('quotes.fragment_cache.time.time')
+    def test_failed_rebuild_serves_stale(self, mock_time):
+        mock_time.return_value = 1000
+        self.assertEqual(self.fragments.get('value', self.build), 1)
+
+        def fail():
+            raise ValueError('db went away')
+        mock_time.return_value = 1100
+        self.assertEqual(self.fragments.get('value', fail), 1)
+        # the lock was released, so the next request tries again
+        self.assertEqual(self.fragments.get('value', self.build), 2)
+
+    def test_missing_waits_for_the_builder(self):
+        self.fragments.wait_seconds = 0.1
+        self.assertTrue(self.fragments.lock('value'))
+        # nobody finishes, so in the end we build it ourselves
+        self.assertEqual(self.fragments.get('value', self.build), 1)
+
+    def test_home_screen_pools(self):
+        for i in range(30):
+            Quote.objects.create(quote=f'quote{i}', author=f'author{i}', popularity=i / 30)
+
+        self.client.get(HOME_SCREEN_URL)
+        with self.assertNumQueries(0):
+            # everything from the cache, but still a fresh random pick
+            data = self.client.get(HOME_SCREEN_URL).json()['data']
+        self.assertEqual(len(data['top']), 4)
+        self.assertEqual(len(data['random']), 2)
+        for quote in data['random']:
+            self.assertGreater(quote['popularity'], 0.5)
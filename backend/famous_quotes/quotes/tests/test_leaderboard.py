@@ -0,0 +1,150 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.core.management import call_command
+
+from quotes import leaderboard
+from quotes.jobs import PeriodicJobs
+from quotes.models import Category, CategoryLeaderboard, Quote, Vote
+
+from ..constants import *
+
+
+class LeaderboardTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.funny = Category.objects.create(category='Funny')
+        self.travel = Category.objects.create(category='Travel')
+        self.quotes = []
+        for i in range(6):
+            quote = Quote.objects.create(quote=f'quote{i}', author=f'author{i}', total_upvotes=i, popularity=i / 10)
+            quote.categories.add(self.funny if i % 2 else self.travel)
+            self.quotes.append(quote)
+
+    def refresh(self, *args):
+        output = StringIO()
+        call_command('refresh_leaderboards', *args, stdout=output)
+        return output.getvalue()
+
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [x['id'] for x in response.json()['data']]
+
+    def test_refresh_is_incremental(self):
+        self.assertIn('rebuilt 2 categories', self.refresh())
+        self.assertEqual(CategoryLeaderboard.objects.filter(category=self.funny, sort_key='popularity').count(), 3)
+        self.assertIn('rebuilt 0 categories', self.refresh())
+
+        # a vote only touches the quote's own category
+        Vote.objects.create(quote=self.quotes[0], session_id='session', value=1)
+        self.assertIn('rebuilt 1 categories', self.refresh())
+        self.assertIn('rebuilt 2 categories', self.refresh('--all'))
+
+    def test_get_top(self):
+        self.assertEqual(leaderboard.get_top(['Funny'], ['-popularity'], 2), {})
+        self.refresh()
+
+        with self.assertNumQueries(2):
+            top = leaderboard.get_top(['Funny', 'Travel'], ['-popularity'], 2)
+        self.assertEqual([x['id'] for x in top['Funny']], [self.quotes[5].id, self.quotes[3].id, self.quotes[1].id])
+        self.assertEqual([x['id'] for x in top['Travel'][:2]], [self.quotes[4].id, self.quotes[2].id])
+        self.assertEqual(top['Funny'][0]['popularity'], self.quotes[5].popularity)
+        self.assertEqual(leaderboard.get_top(['Funny'], ['popularity'], 2), {})
+
+        # redirected since the last refresh
+        Quote.objects.filter(id=self.quotes[5].id).update(redirect_quote=self.quotes[3].id)
+        self.assertEqual([x['id'] for x in leaderboard.get_top(['Funny'], ['-popularity'], 2)['Funny']], [self.quotes[3].id, self.quotes[1].id])
+
+    def test_quote_view_uses_leaderboard(self):
+        expected = [self.quotes[5].id, self.quotes[3].id]
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?categories=Funny&n=2'), expected)
+        self.refresh()
+        with self.assertNumQueries(3):
+            response = self.client.get(f'{QUOTES_URL}?categories=Funny&n=2')
+        self.assertEqual([x['id'] for x in response.json()['data']], expected)
+
+        # and the next page carries on from it
+        response = self.client.get(f'{QUOTES_URL}?categories=Funny&n=2&c={response.json()["next"]}')
+        self.assertEqual([x['id'] for x in response.json()['data']], [self.quotes[1].id])
+        self.assertIsNone(response.json()['next'])
+
+    def page_through(self, url):
+        ids = []
+        cursor = ''
+        while True:
+            response = self.client.get(f'{url}&c={cursor}' if cursor else url).json()
+            ids.extend(x['id'] for x in response['data'])
+            cursor = response['next']
+            if not cursor:
+                return ids
+
+    def test_votes_after_refresh(self):
+        self.refresh()
+        self.funny.refresh_from_db()
+        self.assertIsNotNone(self.funny.leaderboard_updated_at)
+
+        # quote1 shoots to the top, quote3 drops, and a new quote joins
+        for _ in range(10):
+            Vote.objects.create(quote=self.quotes[1], session_id='session', value=1)
+        Vote.objects.create(quote=self.quotes[3], session_id='session', value=-1)
+        new = Quote.objects.create(quote='quote6', author='author6', total_upvotes=4)
+        new.categories.add(self.funny)
+
+        # the leaderboard is still served as it was until the next refresh
+        self.funny.refresh_from_db()
+        self.assertIsNotNone(self.funny.leaderboard_updated_at)
+        self.assertTrue(self.funny.leaderboard_dirty)
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?categories=Funny&n=2'), [self.quotes[5].id, self.quotes[3].id])
+
+        # which picks all of it up, and then agrees with the pages after it
+        self.assertIn('rebuilt 1 categories', self.refresh())
+        expected = list(Quote.objects.filter(categories=self.funny).order_by('-total_upvotes', '-popularity', 'id').values_list('id', flat=True))
+        self.assertEqual(expected[0], self.quotes[1].id)
+        self.assertEqual(self.page_through(f'{QUOTES_URL}?categories=Funny&n=2'), expected)
+        self.funny.refresh_from_db()
+        self.assertFalse(self.funny.leaderboard_dirty)
+
+        # the travel leaderboard wasn't touched
+        self.travel.refresh_from_db()
+        self.assertIsNotNone(self.travel.leaderboard_updated_at)
+
+    def test_votes_write_nothing_to_categories(self):
+        self.refresh()
+        with self.assertNumQueries(4):  # savepoint, UPDATE quote, INSERT vote, release
+            Vote.objects.create(quote=self.quotes[1], session_id='session', value=1)
+        self.assertIn('rebuilt 1 categories', self.refresh())
+
+    def test_quote_leaving_category_not_served(self):
+        self.refresh()
+        self.quotes[5].categories.remove(self.funny)
+        self.funny.refresh_from_db()
+        self.assertIsNone(self.funny.leaderboard_updated_at)
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?categories=Funny&n=2'), [self.quotes[3].id, self.quotes[1].id])
+
+
+class PeriodicJobsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_each_job_runs_once_per_interval(self):
+        Category.objects.create(category='Funny')
+        worker1 = PeriodicJobs({'refresh_leaderboards': 60})
+        worker2 = PeriodicJobs({'refresh_leaderboards': 60})
+        self.assertEqual(worker1.flush(), ['refresh_leaderboards'])
+        self.assertEqual(worker2.flush(), [])
+        self.assertIsNotNone(Category.objects.get().leaderboard_updated_at)
+
+    @mock.patch('quotes.flusher.threading.Thread')
+    def test_no_jobs_no_thread(self, mock_thread):
+        PeriodicJobs({}).start()
+        mock_thread.assert_not_called()
+        PeriodicJobs({'refresh_leaderboards': 60}).start()
+        mock_thread.assert_called_once()
@@ -0,0 +1,98 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, Client
+
+from quotes import pagination
+from quotes.models import Quote, Vote, Comment, UserSession
+
+from ..constants import *
+
+
+class PaginationTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        # plenty of ties, so the id tie-breaker has to do its job
+        self.quotes = [
+            Quote.objects.create(quote=f'quote{i}', author=f'author{i}', total_upvotes=i % 3, popularity=0.5)
+            for i in range(10)
+        ]
+
+    def get_pages(self, url):
+        ids = []
+        cursor = None
+        while True:
+            response = self.client.get(f'{url}&c={cursor}' if cursor else url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(x['id'] for x in response.json()['data'])
+            cursor = response.json()['next']
+            if not cursor:
+                return ids
+
+    def test_cursor(self):
+        fields = pagination.get_fields(Quote.objects.all(), ['-total_upvotes', '-popularity', 'id'])
+        cursor = pagination.encode_cursor([3, 0.5, 12])
+        self.assertEqual(pagination.decode_cursor(cursor, fields), [3, 0.5, 12])
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.decode_cursor(cursor, fields[:2])
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.decode_cursor('not-a-cursor', fields)
+        self.assertEqual(pagination.get_ordering(['-popularity']), ['-popularity', 'id'])
+
+    def test_quote_pages_match_full_ordering(self):
+        expected = list(Quote.objects.order_by('-total_upvotes', '-popularity', 'id').values_list('id', flat=True))
+        self.assertEqual(self.get_pages(f'{QUOTES_URL}?n=3'), expected)
+
+        expected = list(Quote.objects.order_by('-created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(self.get_pages(f'{QUOTES_URL}?n=4&s=newest'), expected)
+
+    def test_offset_still_works(self):
+        response = self.client.get(f'{QUOTES_URL}?n=3&o=3')
+        expected = list(Quote.objects.order_by('-total_upvotes', '-popularity', 'id').values_list('id', flat=True))[3:6]
+        self.assertEqual([x['id'] for x in response.json()['data']], expected)
+        self.assertIsNone(response.json()['next'])
+
+    def test_bad_cursor(self):
+        response = self.client.get(f'{QUOTES_URL}?c=rubbish')
+        self.assertEqual(response.status_code, 400)
+
+        # a cursor from one sort order makes no sense for another
+        cursor = self.client.get(f'{QUOTES_URL}?n=3').json()['next']
+        response = self.client.get(f'{QUOTES_URL}?s=newest&c={cursor}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_crafted_cursors(self):
+        quote = self.quotes[0]
+        bad = {
+            # the default ordering is (-total_upvotes, -popularity, id)
+            f'{QUOTES_URL}?n=3&c=': [['abc', 'x', 1], [{}, 1, 1], [None, 1, 1], [1, 0.5, [1]]],
+            f'{QUOTES_URL}?n=3&s=newest&c=': [['notadate', 1], [{}, 1], [1, 1]],
+            f'{VOTES_URL}?quote={quote.id}&n=2&c=': [['notadate', 1], ['2023-01-01T00:00:00+00:00', 'x'], [[], 1]],
+            f'{COMMENTS_URL}?quote={quote.id}&n=2&c=': [['notadate', 1], ['2023-01-01T00:00:00+00:00', {}], [None, 1]],
+        }
+        for url, cursors in bad.items():
+            for values in cursors:
+                response = self.client.get(url + pagination.encode_cursor(values))
+                self.assertEqual(response.status_code, 400, (url, values))
+                self.assertEqual(response.json()['message'], 'Cursor value invalid')
+
+    def test_vote_and_comment_pages(self):
+        quote = self.quotes[0]
+        for i in range(5):
+            Vote.objects.create(quote=quote, session_id=f'session{i}', value=1)
+        session = UserSession.objects.create(user=User.objects.create_user('user', 'email@email.com', 'StrongPassword'))
+        for i in range(5):
+            Comment.objects.create(quote=quote, user_session=session, comment=f'comment{i}')
+
+        # without n or c everything comes back as before
+        response = self.client.get(f'{VOTES_URL}?quote={quote.id}')
+        self.assertEqual(len(response.json()['data']), 5)
+        self.assertNotIn('next', response.json())
+
+        expected = list(Vote.objects.order_by('-created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(self.get_pages(f'{VOTES_URL}?quote={quote.id}&n=2'), expected)
+
+        expected = list(Comment.objects.order_by('-created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(self.get_pages(f'{COMMENTS_URL}?quote={quote.id}&n=2'), expected)
+
+        response = self.client.get(f'{VOTES_URL}?quote={quote.id}&n=abc')
+        self.assertEqual(response.status_code, 400)
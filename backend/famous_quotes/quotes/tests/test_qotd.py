@@ -1,8 +1,13 @@
 from datetime import datetime, timedelta
+from io import StringIO
 import pdb
+from unittest import mock
 
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase, Client
 
+from quotes import qotd
 from quotes.models import Quote, Category, QuoteOfTheDay
 
 from ..constants import *
@@ -12,6 +17,12 @@ class QotdTest(TestCase):
 
     def setUp(self):
         self.client = Client()
+        qotd.answers.clear()
+        cache.clear()
+
+    def tearDown(self):
+        qotd.answers.clear()
+        cache.clear()
 
     def create_user(self, email):
         response = self.client.post(f"{USERS_URL}", data={'email': email, 'password1': 'StrongPassword', 'password2': 'StrongPassword'})
@@ -164,3 +175,82 @@ class QotdTest(TestCase):
         QuoteOfTheDay.objects.create(date=today+timedelta(days=-1), quote=quote1)
         response = self.client.get(f"{QOTD_URL}")
         self.assertEqual(response.json()['quote']['id'], quote2.id)
+
+    def test_schedule(self):
+        category = Category.objects.create(category='love')
+        for n, popularity in enumerate([1.0, 0.8, 0.6]):
+            quote = Quote.objects.create(quote=f'quote{n}', author=f'author{n}', popularity=popularity)
+            quote.categories.set([category.id])
+
+        call_command('schedule_qotd', days=3, stdout=StringIO())
+        # three days each for no category and 'love', no repeats within either
+        self.assertEqual(QuoteOfTheDay.objects.count(), 6)
+        self.assertEqual(len(set(QuoteOfTheDay.objects.filter(category=category).values_list('quote_id', flat=True))), 3)
+
+        # running it again doesn't change anything
+        call_command('schedule_qotd', days=3, stdout=StringIO())
+        self.assertEqual(QuoteOfTheDay.objects.count(), 6)
+
+        today = QuoteOfTheDay.objects.get(category=category, date=datetime.now().date())
+        response = self.client.get(f"{QOTD_URL}?category=love")
+        self.assertEqual(response.json()['quote']['id'], today.quote_id)
+        self.assertNotIn('message', response.json())
+
+    def test_answers_kept_in_memory(self):
+        quote = self.create_quote_with_number(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(QOTD_URL)
+        with self.assertNumQueries(0):
+            response = qotd.get(datetime.now().date())
+        self.assertEqual(response, (self.client.get(QOTD_URL).json()['quote'], False))
+
+        # a change to the quote drops it
+        with self.captureOnCommitCallbacks(execute=True):
+            quote.author = 'someone else'
+            quote.save()
+        self.assertEqual(self.client.get(QOTD_URL).json()['quote']['author'], 'someone else')
+
+    def test_renamed_category_not_served_from_memory(self):
+        quote = self.create_quote_with_number(1)
+        category = Category.objects.create(category='love')
+        quote.categories.add(category)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(QOTD_URL)
+        self.assertEqual(self.client.get(QOTD_URL).json()['quote']['categories'][0]['category'], 'love')
+
+        # only the category row changes - nothing the quote's own version covers
+        with self.captureOnCommitCallbacks(execute=True):
+            category.category = 'romance'
+            category.save()
+        self.assertEqual(self.client.get(QOTD_URL).json()['quote']['categories'][0]['category'], 'romance')
+
+    def test_lost_race(self):
+        quote1 = self.create_quote_with_number(1)
+        quote2 = self.create_quote_with_number(2)
+        category = Category.objects.create(category='love')
+        quote1.categories.set([category.id])
+        quote2.categories.set([category.id])
+        today = datetime.now().date()
+
+        # another worker creates the row between our lookup and our insert
+        def pick_quote(date, category=None):
+            QuoteOfTheDay.objects.create(date=date, category=category, quote=quote2)
+            return quote1.id
+        with mock.patch('quotes.qotd.pick_quote', pick_quote):
+            result, created = qotd.get_or_create(today, category)
+        self.assertFalse(created)
+        self.assertEqual(result.quote_id, quote2.id)
+
+    def test_lost_race_without_category(self):
+        quote1 = self.create_quote_with_number(1)
+        quote2 = self.create_quote_with_number(2)
+        today = datetime.now().date()
+
+        def pick_quote(date, category=None):
+            QuoteOfTheDay.objects.create(date=date, quote=quote2)
+            return quote1.id
+        with mock.patch('quotes.qotd.pick_quote', pick_quote):
+            result, created = qotd.get_or_create(today)
+        self.assertFalse(created)
+        self.assertEqual(result.quote_id, quote2.id)
+        self.assertEqual(QuoteOfTheDay.objects.filter(date=today).count(), 1)
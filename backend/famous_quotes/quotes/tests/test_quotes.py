@@ -1,6 +1,8 @@
+from io import StringIO
 from unicodedata import category
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.db.utils import IntegrityError
 
 from quotes.models import Quote, Category, Vote
@@ -344,6 +346,57 @@ class QuoteTest(TestCase):
         self.assertEqual(quote1.popularity, 1.0)
         self.assertEqual(quote2.popularity, 0.0)
 
+    def test_popularity_expression_matches_python(self):
+        quote = Quote.objects.create(quote='quote1', author='author1')
+        for upvotes, downvotes in [(0, 0), (1, 0), (0, 1), (3, 2), (7, 12), (19, 0), (15, 10), (40, 3)]:
+            Quote.objects.filter(pk=quote.pk).update(total_upvotes=upvotes, total_downvotes=downvotes)
+            Quote.objects.filter(pk=quote.pk).update(popularity=Quote.popularity_expression())
+
+            expected = Quote(total_upvotes=upvotes, total_downvotes=downvotes)
+            expected.update_popularity()
+            quote.refresh_from_db()
+            self.assertAlmostEqual(quote.popularity, expected.popularity)
+
+    def test_vote_is_one_update(self):
+        quote = Quote.objects.create(quote='quote1', author='author1')
+        for value in [1, 1, -1]:
+            with self.assertNumQueries(4):  # savepoint, UPDATE quote, INSERT vote, release
+                Vote(quote_id=quote.id, value=value).save()
+
+        expected = Quote()
+        for value in [1, 1, -1]:
+            expected.update_votes(value)
+        quote.refresh_from_db()
+        self.assertEqual((quote.total_upvotes, quote.total_downvotes, quote.net_votes), (2, 1, 1))
+        self.assertAlmostEqual(quote.popularity, expected.popularity)
+
+    def test_vote_for_missing_quote(self):
+        with self.assertRaises(Quote.DoesNotExist):
+            Vote(quote_id=12345, value=1).save()
+        self.assertEqual(Vote.objects.count(), 0)
+
+    def test_recompute_popularity(self):
+        quote1 = Quote.objects.create(quote='quote1', author='author1')
+        quote2 = Quote.objects.create(quote='quote2', author='author2')
+        for value in [1, 1, -1]:
+            Vote.objects.create(quote=quote1, value=value)
+        Vote.objects.create(quote=quote2, value=-1)
+        expected = {}
+        for quote in Quote.objects.all():
+            expected[quote.id] = (quote.total_upvotes, quote.total_downvotes, quote.net_votes, quote.popularity)
+
+        # scramble popularity only - the totals are left alone without --recount
+        Quote.objects.update(popularity=0.0)
+        call_command('recompute_popularity', batch_size=1, stdout=StringIO())
+        for quote in Quote.objects.all():
+            self.assertAlmostEqual(quote.popularity, expected[quote.id][3])
+
+        Quote.objects.update(total_upvotes=100, total_downvotes=0, net_votes=100, popularity=1.0)
+        call_command('recompute_popularity', recount=True, stdout=StringIO())
+        for quote in Quote.objects.all():
+            self.assertEqual((quote.total_upvotes, quote.total_downvotes, quote.net_votes), expected[quote.id][:3])
+            self.assertAlmostEqual(quote.popularity, expected[quote.id][3])
+
     def test_merge(self):
         quote1 = Quote.objects.create(quote='quote1', author='author1')
         quote2 = Quote.objects.create(quote='quote2', author='author2')
@@ -371,6 +424,42 @@ class QuoteTest(TestCase):
         self.assertEqual(Vote.objects.filter(quote=quote1, value=-1).count(), 1)
         self.assertEqual(Vote.objects.filter(quote=quote2).count(), 0)
 
+    def test_merge_query_count_independent_of_votes(self):
+        quote1 = Quote.objects.create(quote='quote1', author='author1')
+        quote2 = Quote.objects.create(quote='quote2', author='author2')
+        quote2.categories.add(*[Category.objects.create(category=f'cat{i}') for i in range(5)])
+        for i in range(50):
+            Vote.objects.create(quote=quote2, value=1 if i % 5 else -1)
+
+        # (categories.add checks for existing rows itself because of the m2m_changed receiver in signals.py,
+        # which also marks the category leaderboards dirty, as does the merge itself)
+        with self.assertNumQueries(15):
+            quote1.merge_with(quote2)
+
+        self.assertEqual((quote1.total_upvotes, quote1.total_downvotes, quote1.net_votes), (40, 10, 30))
+        self.assertEqual(quote1.categories.count(), 5)
+        self.assertEqual(quote2.redirect_quote, quote1.id)
+        self.assertEqual((quote2.total_upvotes, quote2.total_downvotes, quote2.net_votes), (0, 0, 0))
+        with self.assertRaises(ValueError):
+            quote1.merge_with(quote1)
+
+    def test_merge_quotes_command(self):
+        quote1 = Quote.objects.create(quote='quote1', author='author1')
+        quote2 = Quote.objects.create(quote='quote2', author='author2')
+        quote3 = Quote.objects.create(quote='quote3', author='author3')
+        Vote.objects.create(quote=quote2, value=1)
+        Vote.objects.create(quote=quote3, value=-1)
+
+        # quote2 is merged away first, so quote3 ends up in quote1 too
+        call_command('merge_quotes', f'{quote1.id}:{quote2.id}', f'{quote2.id}:{quote3.id}', '999:1', stdout=StringIO())
+        quote1.refresh_from_db()
+        self.assertEqual((quote1.total_upvotes, quote1.total_downvotes), (1, 1))
+        self.assertEqual(Vote.objects.filter(quote=quote1).count(), 2)
+        self.assertListEqual(
+            list(Quote.objects.filter(redirect_quote__isnull=False).order_by('id').values_list('redirect_quote', flat=True)),
+            [quote1.id, quote1.id],
+        )
+
 
     def test_quotes_with_redirect(self):
         quote1 = Quote.objects.create(quote='quote1', author='author1')
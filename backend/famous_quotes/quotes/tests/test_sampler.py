@@ -0,0 +1,50 @@
+from django.test import TestCase, Client
+
+from quotes.models import Quote, Category
+from quotes.sampler import RandomSampler
+
+from ..constants import *
+
+
+class RandomSamplerTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.quotes = [Quote.objects.create(quote=f'quote{i}', author=f'author{i}', popularity=i / 20) for i in range(20)]
+        self.sampler = RandomSampler(Quote)
+
+    def test_sample_honours_filters(self):
+        queryset = Quote.objects.filter(popularity__gt=0.5, redirect_quote__isnull=True)
+        Quote.objects.filter(id=self.quotes[-1].id).update(redirect_quote=self.quotes[0].id)
+        for _ in range(10):
+            quotes = self.sampler.sample(queryset, 3)
+            self.assertEqual(len(quotes), 3)
+            self.assertEqual(len(set(x.id for x in quotes)), 3)
+            for quote in quotes:
+                self.assertGreater(quote.popularity, 0.5)
+                self.assertNotEqual(quote.id, self.quotes[-1].id)
+
+        # asking for more than there are just gives all of them
+        self.assertEqual(len(self.sampler.sample(queryset, 20)), 8)
+        self.assertEqual(self.sampler.sample(queryset.filter(popularity__gt=2), 2), [])
+
+    def test_new_quotes_are_picked_up(self):
+        self.sampler.sample(Quote.objects.all(), 1)
+        quote = Quote.objects.create(quote='new', author='new')
+        with self.assertNumQueries(2):
+            # one to look for new ids, one to fetch the sample
+            self.assertEqual(len(self.sampler.sample(Quote.objects.all(), 2)), 2)
+        self.assertIn(quote.id, self.sampler.ids)
+        self.assertEqual(self.sampler.sample(Quote.objects.filter(id=quote.id), 1), [quote])
+
+    def test_narrow_filter_falls_back(self):
+        category = Category.objects.create(category='Rare')
+        self.quotes[7].categories.add(category)
+        for _ in range(5):
+            self.assertEqual(self.sampler.sample(Quote.objects.filter(categories=category), 2), [self.quotes[7]])
+
+    def test_random_sort(self):
+        response = self.client.get(f'{QUOTES_URL}?s=random&n=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 5)
+        self.assertIsNone(response.json()['next'])
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+from io import StringIO
+import pytz
+
+from django.conf import settings
+from django.test import TestCase, Client
+from django.core.management import call_command
+
+from quotes.models import Quote, Vote
+from quotes.scoring import WilsonScorer, BayesianScorer, HotScorer
+
+from ..constants import *
+
+
+class ScorerTest(TestCase):
+
+    def test_wilson(self):
+        scorer = WilsonScorer()
+        self.assertEqual(scorer.score(0, 0, None), 0)
+        # one upvote is less convincing than 90 out of 100
+        self.assertLess(scorer.score(1, 0, None), scorer.score(90, 10, None))
+        self.assertAlmostEqual(scorer.score(90, 10, None), 0.8256, places=4)
+        self.assertLess(scorer.score(0, 5, None), scorer.score(5, 5, None))
+
+    def test_bayesian(self):
+        scorer = BayesianScorer(prior_mean=0.5, prior_weight=10)
+        self.assertEqual(scorer.score(0, 0, None), 0.5)
+        self.assertAlmostEqual(scorer.score(10, 0, None), 0.75)
+        self.assertAlmostEqual(scorer.score(1000, 0, None), 1005 / 1010)
+
+    def test_bayesian_priors_from_table(self):
+        Quote.objects.create(quote='quote1', author='author1', total_upvotes=6, total_downvotes=2)
+        Quote.objects.create(quote='quote2', author='author2', total_upvotes=0, total_downvotes=0)
+        scorer = BayesianScorer()
+        scorer.prepare(Quote.objects.all())
+        self.assertEqual(scorer.mean, 0.75)
+        self.assertEqual(scorer.weight, 4)
+
+    def test_hot(self):
+        scorer = HotScorer()
+        now = datetime.now(pytz.UTC)
+        # newer wins on equal votes, and it takes 10x the votes to make up for timescale seconds
+        self.assertGreater(scorer.score(5, 0, now), scorer.score(5, 0, now - timedelta(hours=1)))
+        self.assertAlmostEqual(
+            scorer.score(100, 0, now - timedelta(seconds=45000)),
+            scorer.score(10, 0, now),
+            places=5,
+        )
+        self.assertLess(scorer.score(0, 10, now), scorer.score(0, 0, now))
+
+
+class UpdateScoresTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+
+    def test_only_changed_quotes_rescored(self):
+        quote1 = Quote.objects.create(quote='quote1', author='author1')
+        quote2 = Quote.objects.create(quote='quote2', author='author2')
+        call_command('update_scores', stdout=StringIO())
+        quote1.refresh_from_db()
+        self.assertIsNotNone(quote1.scores_updated_at)
+        self.assertGreater(quote1.hot_score, 0)
+
+        Vote.objects.create(quote=quote2, value=1)
+        output = StringIO()
+        call_command('update_scores', stdout=output)
+        self.assertIn('scored 1 quotes', output.getvalue())
+        quote2.refresh_from_db()
+        self.assertGreater(quote2.wilson_score, 0)
+
+        output = StringIO()
+        call_command('update_scores', all=True, stdout=output)
+        self.assertIn('scored 2 quotes', output.getvalue())
+
+    def test_new_quote_scored_on_create(self):
+        old_quote = Quote.objects.create(quote='quote1', author='author1', total_upvotes=5)
+        Quote.objects.filter(id=old_quote.id).update(created_at=datetime.now(pytz.UTC) - timedelta(days=30))
+        call_command('update_scores', stdout=StringIO())
+
+        # ranked among the rest straight away, not at 0 until update_scores next runs
+        quote = Quote.objects.create(quote='quote2', author='author2')
+        quote.refresh_from_db()
+        self.assertEqual(quote.bayesian_score, settings.BAYESIAN_PRIOR_MEAN)
+        self.assertGreater(quote.hot_score, 0)
+        response = self.client.get(f'{QUOTES_URL}?s=hot')
+        self.assertEqual(response.json()['data'][0]['id'], quote.id)
+
+        # and still rescored by the next run
+        self.assertIsNone(quote.scores_updated_at)
+        output = StringIO()
+        call_command('update_scores', stdout=output)
+        self.assertIn('scored 1 quotes', output.getvalue())
+        hot_score = quote.hot_score
+        quote.refresh_from_db()
+        self.assertAlmostEqual(quote.hot_score, hot_score, places=3)
+
+    def test_bayesian_scores_comparable_between_runs(self):
+        quote1 = Quote.objects.create(quote='quote1', author='author1', total_upvotes=3, total_downvotes=1)
+        quote2 = Quote.objects.create(quote='quote2', author='author2')
+        call_command('update_scores', stdout=StringIO())
+        quote1.refresh_from_db()
+        score = quote1.bayesian_score
+
+        # lots of downvotes elsewhere don't change quote1's score, whether or not it is rescored
+        Quote.objects.filter(id=quote2.id).update(total_downvotes=1000, last_voted_at=datetime.now(pytz.UTC))
+        call_command('update_scores', stdout=StringIO())
+        call_command('update_scores', all=True, stdout=StringIO())
+        quote1.refresh_from_db()
+        self.assertEqual(quote1.bayesian_score, score)
+
+    def test_sort_by_score(self):
+        quote1 = Quote.objects.create(quote='quote1', author='author1')
+        quote2 = Quote.objects.create(quote='quote2', author='author2')
+        quote3 = Quote.objects.create(quote='quote3', author='author3')
+        Vote.objects.create(quote=quote1, value=1)
+        for _ in range(20):
+            Vote.objects.create(quote=quote2, value=1)
+        Vote.objects.create(quote=quote2, value=-1)
+        Vote.objects.create(quote=quote3, value=-1)
+        call_command('update_scores', stdout=StringIO())
+
+        response = self.client.get(f'{QUOTES_URL}?s=wilson')
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual([x['id'] for x in response.json()['data']], [quote2.id, quote1.id, quote3.id])
+
+        response = self.client.get(f'{QUOTES_URL}?s=hot')
+        self.assertEqual(response.json()['data'][0]['id'], quote2.id)
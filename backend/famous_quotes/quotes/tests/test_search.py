@@ -0,0 +1,56 @@
+from io import StringIO
+
+from django.test import TestCase, Client
+from django.core.management import call_command
+
+from quotes import search
+from quotes.models import Quote, QuoteTerm
+
+from ..constants import *
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.love = Quote.objects.create(quote='Love all, trust a few, do wrong to none.', author='William Shakespeare')
+        self.loving = Quote.objects.create(quote='Loving someone deeply gives you courage.', author='Lao Tzu', popularity=0.9)
+        self.world = Quote.objects.create(quote='Be the change you wish to see in the world.', author='Mahatma Gandhi', context='Love it')
+        self.redirected = Quote.objects.create(quote='Love loves lovers.', author='Nobody', redirect_quote=self.love.id)
+        call_command('build_search_index', stdout=StringIO())
+
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [x['id'] for x in response.json()['data']]
+
+    def test_stem(self):
+        self.assertEqual(search.stem('love'), search.stem('loving'))
+        self.assertEqual(search.stem('loves'), search.stem('loved'))
+        self.assertEqual(search.stem('happy'), search.stem('happiness'))
+        self.assertEqual(search.stem('running'), search.stem('runs'))
+        self.assertEqual(search.tokenise('The Love of it!'), ['lov'])
+
+    def test_ranked_results(self):
+        # a match in the context is worth less, ties go to the more popular quote,
+        # and redirected quotes are left out as usual
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=loved'), [self.loving.id, self.love.id, self.world.id])
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=shakespeare'), [self.love.id])
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=the'), [])
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=zebra'), [])
+
+        # a rare term counts for more than a common one
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=love%20courage')[0], self.loving.id)
+
+    def test_search_with_other_filters_and_sort(self):
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=love&author=tzu'), [self.loving.id])
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=love&s=popularity')[-1], self.loving.id)
+
+    def test_index_is_incremental(self):
+        self.assertEqual(QuoteTerm.objects.filter(quote=self.love).count(), 9)
+        quote = Quote.objects.create(quote='Courage is grace under pressure.', author='Ernest Hemingway')
+        output = StringIO()
+        call_command('build_search_index', stdout=output)
+        self.assertIn('indexed 1 quotes', output.getvalue())
+        self.assertEqual(self.get_ids(f'{QUOTES_URL}?q=courageous')[0], self.loving.id)
+        self.assertIn(quote.id, self.get_ids(f'{QUOTES_URL}?q=courage'))
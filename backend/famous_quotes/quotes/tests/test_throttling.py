@@ -1,10 +1,23 @@
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import json
+import os
+import tempfile
+import time
 from unittest import mock
 
-from django.test import TestCase, Client
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpRequest, HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
 
 from ..throttling import *
+from ..middleware import IpThrottleMiddleware
+from ..throttle_backends import LocalMemoryBackend, MmapBackend, RedisBackend, get_backend
+from ..sliding_window import SlidingWindowCounter
+from ..prefix_trie import PrefixTrie
+from ..utils import pack_ip, get_subnet, parse_cidr, format_cidr
 from ..constants import *
 
 
@@ -35,15 +48,31 @@ class IpRequestTest(TestCase):
 
     def test_str(self):
 
-        request1 = IpRequest('ip1', datetime(2023,1,1,12,34,56), 2)
-        self.assertEqual(str(request1), 'IP: (ip1) @ 2023-01-01T12:34:56 (x2)')
+        request1 = IpRequest('ip1', datetime(2023,1,1,12,34,56, tzinfo=pytz.UTC), 2)
+        self.assertEqual(str(request1), 'IP: (ip1) @ 2023-01-01T12:34:56+00:00 (x2)')
 
     def test_repr(self):
 
-        request1 = IpRequest('ip1', datetime(2023,1,1,12,34,56), 2)
-        self.assertEqual(repr(request1), 'IP: (ip1) @ 2023-01-01T12:34:56 (x2)')
+        request1 = IpRequest('ip1', datetime(2023,1,1,12,34,56, tzinfo=pytz.UTC), 2)
+        self.assertEqual(repr(request1), 'IP: (ip1) @ 2023-01-01T12:34:56+00:00 (x2)')
 
-    # not sure how to test the two methods because I would need to use a Django request...
+    def test_ip_is_packed(self):
+        self.assertEqual(IpRequest('1.2.3.4').ip, 0xffff01020304)
+        self.assertEqual(IpRequest('1.2.3.4').ip_address, '1.2.3.4')
+        self.assertEqual(IpRequest('2001:db8::1').ip_address, '2001:db8::1')
+        self.assertEqual(IpRequest('::ffff:1.2.3.4').ip, IpRequest('1.2.3.4').ip)
+        self.assertEqual(IpRequest('not-an-ip').ip, 'not-an-ip')
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(IpRequest('ip1'), '__dict__'))
+
+    def test_from_django(self):
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '1.2.3.4'
+        self.assertEqual(IpRequest().from_django(request).ip_address, '1.2.3.4')
+
+        request.META['HTTP_X_FORWARDED_FOR'] = '5.6.7.8,1.2.3.4'
+        self.assertEqual(IpRequest().from_django(request).ip_address, '5.6.7.8')
 
 
 class IpMonitorLiveTest(TestCase):
@@ -58,11 +87,9 @@ class IpMonitorLiveTest(TestCase):
         for second in range(5):
             self.assertEqual(dt, monitor.get_period(dt+timedelta(seconds=second)))
 
-    # def test_convert_request(self):
-    #     pass
-    
     def test_block_requests(self):
-        monitor = IpMonitorLive(blocked_ips={'ip1','ip3'})
+        expires = datetime.now(pytz.UTC) + timedelta(minutes=1)
+        monitor = IpMonitorLive(blocked_ips={'ip1': expires, 'ip3': expires})
         for i in range(5):
             request = IpRequest(f'ip{i}')
             result = monitor.block_request(request)
@@ -71,6 +98,11 @@ class IpMonitorLiveTest(TestCase):
             else:
                 self.assertFalse(result)
 
+    def test_expired_block_does_not_block(self):
+        monitor = IpMonitorLive(blocked_ips={'ip1': datetime.now(pytz.UTC) - timedelta(seconds=1)})
+        self.assertFalse(monitor.block_request(IpRequest('ip1')))
+        self.assertNotIn('ip1', monitor.blocked_ips)
+
     def test_add_request(self):
         request1 = IpRequest('ip1')
         request2 = IpRequest('ip2')
@@ -81,42 +113,15 @@ class IpMonitorLiveTest(TestCase):
         monitor.add_request(request2)
         monitor.add_request(request1)
         self.assertEqual(monitor.count, 4)
-        self.assertEqual(monitor.requests[request1].count, 3)
-        self.assertEqual(monitor.requests[request2].count, 1)
-    
-    @mock.patch('quotes.throttling.IpMonitorLive.remove_old_requests')
-    def test_total_up_requests(self, mock_remove):
-        # mock removing old requests as we don't want it to actually run, otherwise it deletes all the requests...
-        request1 = IpRequest('ip1', datetime(2023,1,1,12,34,56))
-        request2 = IpRequest('ip2', datetime(2023,1,1,12,34,56))
-        request3 = IpRequest('ip1', datetime(2023,1,1,12,56,56))
-        request4 = IpRequest('ip2', datetime(2023,1,1,12,56,56))
-        monitor = IpMonitorLive()
+        self.assertEqual(monitor.backend.requests[''].total('ip1', 0), 3)
+        self.assertEqual(monitor.backend.requests[''].total('ip2', 0), 1)
 
-        for i in range(1):
-            monitor.add_request(request1)
-        for i in range(2):
-            monitor.add_request(request2)
-        for i in range(3):
-            monitor.add_request(request3)
-        for i in range(4):
-            monitor.add_request(request4)
-        self.assertEqual(monitor.count, 1+2+3+4)
-        
-        result = monitor.total_up_requests_by_ip_address()
-        self.assertIn('ip1', result.keys())
-        self.assertIn('ip2', result.keys())
-        self.assertNotIn('ip3', result.keys())
-        self.assertEqual(result['ip1'], 1+3)
-        self.assertEqual(result['ip2'], 2+4)
-
-    @mock.patch('quotes.throttling.IpMonitorLive.remove_old_requests')
-    def test_block_ips(self, mock_remove):
-        # mock removing old requests as we don't want it to actually run, otherwise it deletes all the requests...
+    def test_block_ips(self):
         monitor = IpMonitorLive(monitor_limit_count=60, monitor_limit_seconds=120)
-        request1 = IpRequest('ip1', datetime(2023,1,1,12,34))
-        request2 = IpRequest('ip1', datetime(2023,1,1,12,35))
-        request3 = IpRequest('ip1', datetime(2023,1,1,12,36))
+        now = datetime.now(pytz.UTC)
+        request1 = IpRequest('ip1', now-timedelta(minutes=1, seconds=30))
+        request2 = IpRequest('ip1', now-timedelta(minutes=1))
+        request3 = IpRequest('ip1', now)
 
         self.assertEqual(IpThrottle.objects.count(), 0)
 
@@ -137,19 +142,17 @@ class IpMonitorLiveTest(TestCase):
 
     def test_remove_old_requests(self):
         monitor = IpMonitorLive(commit_after_number=100, monitor_limit_seconds=5)
-        now = datetime(2023,1,1,12,34,56)
+        now = datetime.now(pytz.UTC)
         for second in range(10):
-            request = IpRequest('ip1', dt=now-timedelta(seconds=second))
-            monitor.add_request(request)
-        
-        self.assertEqual(monitor.count, 10)
-        self.assertEqual(len(monitor.requests), 3)  # with buckets of 5s each, 46-56 will fall into 3 different buckets
+            monitor.add_request(IpRequest('ip1', dt=now-timedelta(seconds=second)))
+        monitor.add_request(IpRequest('ip2', dt=now))
+
+        self.assertEqual(monitor.count, 11)
+        self.assertEqual(len(monitor.backend.requests['']), 2)
         monitor.remove_old_requests(now)
-        self.assertEqual(monitor.count, 2)  # only the 55s+ bucket should remain, which has 55 & 56 entries
-        self.assertEqual(len(monitor.requests), 1)
-        for request in monitor.requests:
-            self.assertGreaterEqual(monitor.requests[request].datetime, now-timedelta(seconds=5))
-        
+        self.assertEqual(len(monitor.backend.requests['']), 2)
+        monitor.remove_old_requests(now+timedelta(seconds=10))
+        self.assertEqual(len(monitor.backend.requests['']), 0)
 
     def test_add_request_blocks_as_expected(self):
         now = datetime.now(pytz.UTC)
@@ -187,9 +190,10 @@ class IpMonitorLiveTest(TestCase):
 
     def test_dump(self):
         monitor = IpMonitorLive(monitor_limit_count=60, monitor_limit_seconds=120)
-        request1a = IpRequest('ip1', datetime(2023,1,1,12,34,56))
-        request1b = IpRequest('ip1', datetime(2023,1,1,12,56,56))
-        request2a = IpRequest('ip2', datetime(2023,1,1,12,34,56))
+        now = datetime.now(pytz.UTC)
+        request1a = IpRequest('ip1', now-timedelta(seconds=30))
+        request1b = IpRequest('ip1', now)
+        request2a = IpRequest('ip2', now-timedelta(seconds=30))
 
         monitor.add_request(request1a)
         monitor.add_request(request1a)
@@ -198,11 +202,13 @@ class IpMonitorLiveTest(TestCase):
         monitor.add_request(request1b)
         monitor.add_request(request2a)
 
+        period_a = monitor.get_period(now-timedelta(seconds=30)).isoformat()
+        period_b = monitor.get_period(now).isoformat()
         self.assertEqual(monitor.dump(), {
             'requests': [
-                'IP: (ip1) @ 2023-01-01T12:34:55 (x3)', 
-                'IP: (ip1) @ 2023-01-01T12:56:55 (x2)', 
-                'IP: (ip2) @ 2023-01-01T12:34:55 (x1)'
+                f'IP: (ip1) @ {period_a} (x3)', 
+                f'IP: (ip1) @ {period_b} (x2)', 
+                f'IP: (ip2) @ {period_a} (x1)'
             ], 
             'count': 6, 
             'icount': 6, 
@@ -211,18 +217,467 @@ class IpMonitorLiveTest(TestCase):
 
     def test_remove_old_blocks(self):
         now = datetime.now(pytz.UTC)
-        monitor = IpMonitorLive(monitor_limit_seconds=5)
-        monitor.blocked_ips = {
+        monitor = IpMonitorLive(monitor_limit_seconds=5, blocked_ips={
             'ip1': now-timedelta(seconds=10),
             'ip2': now-timedelta(seconds=3),
             'ip3': now+timedelta(seconds=4),
-        }
-        monitor.remove_old_blocks()
+        })
+        monitor.remove_old_requests()
 
         self.assertEqual(len(monitor.blocked_ips), 1)
         self.assertIn('ip3', monitor.blocked_ips)
 
-        
+    def test_add_django_request(self):
+        monitor = IpMonitorLive(monitor_limit_count=2, blocked_ips={})
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '1.2.3.4'
+        self.assertTrue(monitor.add_request(request))
+        self.assertTrue(monitor.add_request(request))
+        self.assertTrue(monitor.add_request(request))  # this one trips the block
+        self.assertFalse(monitor.add_request(request))
+        self.assertIn('1.2.3.4', monitor.blocked_ips)
+        self.assertEqual(monitor.backend.requests[''].total(pack_ip('1.2.3.4'), 0), 3)
+
+    def test_blocks_shared_between_monitors(self):
+        # two monitors on one backend behave like two gunicorn workers sharing state
+        backend = LocalMemoryBackend()
+        monitor1 = IpMonitorLive(monitor_limit_count=10, backend=backend, blocked_ips={})
+        monitor2 = IpMonitorLive(monitor_limit_count=10, backend=backend, blocked_ips={})
+        for i in range(6):
+            monitor1.add_request(IpRequest('ip1'))
+            monitor2.add_request(IpRequest('ip1'))
+        self.assertFalse(monitor1.add_request(IpRequest('ip1')))
+        self.assertFalse(monitor2.add_request(IpRequest('ip1')))
+
+    def test_scopes_counted_apart(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for backend in [LocalMemoryBackend(), MmapBackend(os.path.join(tmpdir, 'ipmon.mmap'), counter_slots=64, block_slots=16)]:
+                login = IpMonitorLive(monitor_limit_count=3, backend=backend, scope='/api/login/', blocked_ips={})
+                api = IpMonitorLive(monitor_limit_count=3, backend=backend, scope='/api/', blocked_ips={})
+                for i in range(3):
+                    login.add_request(IpRequest('1.2.3.4'))
+                    api.add_request(IpRequest('1.2.3.4'))
+                self.assertEqual(backend.get_blocks(), {})
+                login.add_request(IpRequest('1.2.3.4'))
+                self.assertIn('1.2.3.4', backend.get_blocks())
+
+    def test_network_block_covers_subnet(self):
+        expires = datetime.now(pytz.UTC) + timedelta(minutes=5)
+        monitor = IpMonitorLive(blocked_ips={'1.2.3.0/24': expires, '2001:db8::/32': expires})
+        self.assertFalse(monitor.add_request(IpRequest('1.2.3.4')))
+        self.assertFalse(monitor.add_request(IpRequest('1.2.3.250')))
+        self.assertFalse(monitor.add_request(IpRequest('2001:db8:1::1')))
+        self.assertTrue(monitor.add_request(IpRequest('1.2.4.1')))
+        self.assertTrue(monitor.add_request(IpRequest('ip1')))
+
+    def test_subnet_limit_blocks_network(self):
+        # no single address is over the limit, but the /24 is
+        monitor = IpMonitorLive(monitor_limit_count=5, subnet_limit_count=8, blocked_ips={})
+        for i in range(9):
+            self.assertTrue(monitor.add_request(IpRequest(f'10.0.0.{i}')))
+        self.assertIn('10.0.0.0/24', monitor.blocked_ips)
+        self.assertFalse(monitor.add_request(IpRequest('10.0.0.200')))
+        self.assertTrue(monitor.add_request(IpRequest('10.0.1.1')))
+
+    def test_subnet_block_shared_between_workers(self):
+        # two workers mapping the same file, each with its own trie
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'monitor.mmap')
+            monitor1 = IpMonitorLive(monitor_limit_count=5, subnet_limit_count=8, backend=MmapBackend(path), blocked_ips={})
+            monitor2 = IpMonitorLive(monitor_limit_count=5, subnet_limit_count=8, backend=MmapBackend(path), blocked_ips={})
+            for i in range(9):
+                monitor1.add_request(IpRequest(f'10.0.0.{i}'))
+            self.assertEqual(len(monitor2.subnet_blocks), 0)
+            self.assertFalse(monitor2.add_request(IpRequest('10.0.0.200')))
+            self.assertTrue(monitor2.add_request(IpRequest('10.0.1.1')))
+
+            # and it lifts when it expires
+            monitor2.backend.block('10.0.0.0/24', datetime.now(pytz.UTC) - timedelta(seconds=1))
+            monitor1.subnet_blocks = PrefixTrie()
+            self.assertTrue(monitor1.add_request(IpRequest('10.0.0.201')))
+
+
+class IpThrottleWriterTest(TestCase):
+
+    def setUp(self):
+        IpThrottle.objects.all().delete()
+
+    def test_repeat_offenders_blocked_for_longer(self):
+        monitor = IpMonitorLive(monitor_limit_count=1, blocked_ips={})
+        expected = [5, 60, 120]
+        for i, seconds in enumerate(expected):
+            # previous offences are looked up in the db the first time only, then it's just the insert
+            with self.assertNumQueries(3 if i == 0 else 1):
+                monitor.block_ip('ip1')
+            duration = monitor.backend.get_block('ip1') - datetime.now(pytz.UTC)
+            self.assertAlmostEqual(duration.total_seconds(), seconds, delta=2)
+        self.assertEqual(IpThrottle.objects.filter(ip_address='ip1').count(), 3)
+
+    def test_block_duration_capped(self):
+        IpOffence.objects.create(ip_address='ip1', offences=100)
+        monitor = IpMonitorLive(monitor_limit_count=1, blocked_ips={})
+        monitor.block_ip('ip1')
+        duration = monitor.backend.get_block('ip1') - datetime.now(pytz.UTC)
+        self.assertAlmostEqual(duration.total_seconds(), MAX_BLOCK_SECONDS, delta=2)
+
+    def test_escalation_shared_between_workers(self):
+        # wherever the next request lands, the block gets longer
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'monitor.mmap')
+            monitors = [IpMonitorLive(monitor_limit_count=1, backend=MmapBackend(path), blocked_ips={}) for _ in range(2)]
+            for monitor, seconds in zip(monitors + monitors, [5, 60, 120, 240]):
+                monitor.block_ip('ip1')
+                duration = monitor.backend.get_block('ip1') - datetime.now(pytz.UTC)
+                self.assertAlmostEqual(duration.total_seconds(), seconds, delta=2)
+            self.assertEqual(monitors[0].offence_count('ip1'), 4)
+
+    def test_offence_counts_expire(self):
+        backend = LocalMemoryBackend()
+        self.assertIsNone(backend.get_offences('ip1'))
+        self.assertEqual(backend.add_offence('ip1', 3, 60), 4)
+        self.assertEqual(backend.add_offence('ip1', 3, 60), 5)
+        backend.prune(0, datetime.now(pytz.UTC) + timedelta(seconds=61))
+        self.assertIsNone(backend.get_offences('ip1'))
+        self.assertEqual(backend.offences, {})
+
+    def test_failed_flush_kept(self):
+        writer = IpThrottleWriter(flush_interval=60)
+        writer.pending.append(IpThrottle(ip_address='ip1', block_expires=datetime.now(pytz.UTC)))
+        with mock.patch('quotes.throttling.IpThrottle.objects.bulk_create', side_effect=Exception('db down')):
+            self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(IpThrottle.objects.filter(ip_address='ip1').count(), 1)
+
+    def test_offences_looked_up_in_db(self):
+        IpThrottle.objects.create(ip_address='ip1')
+        IpThrottle.objects.create(ip_address='ip1')
+        IpThrottle.objects.create(ip_address='ip2')
+        with self.assertNumQueries(1):  # just the live blocks
+            monitor = IpMonitorLive()
+        self.assertEqual(monitor.writer.offence_count('ip1'), 2)
+        self.assertEqual(monitor.writer.offence_count('ip2'), 1)
+        self.assertEqual(monitor.writer.offence_count('ip3'), 0)
+
+    @mock.patch('quotes.flusher.threading.Thread')
+    def test_blocks_queued_until_flush(self, mock_thread):
+        writer = IpThrottleWriter(flush_interval=60)
+        monitor = IpMonitorLive(monitor_limit_count=1, blocked_ips={}, writer=writer)
+        with self.assertNumQueries(4):  # previous offences for ip1 and ip2 - nothing is written
+            monitor.block_ip('ip1')
+            monitor.block_ip('ip2')
+            monitor.block_ip('ip1')
+        self.assertTrue(monitor.block_request(IpRequest('ip1')))
+        self.assertEqual(IpThrottle.objects.count(), 0)
+        mock_thread.return_value.start.assert_called_once()
+
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(IpThrottle.objects.count(), 3)
+        self.assertEqual(writer.flush(), 0)
+
+
+class PruneIpThrottlesTest(TestCase):
+
+    def setUp(self):
+        IpThrottle.objects.all().delete()
+
+    def test_expired_blocks_rolled_up(self):
+        now = datetime.now(pytz.UTC)
+        for _ in range(3):
+            IpThrottle.objects.create(ip_address='ip1', block_expires=now-timedelta(days=1))
+        IpThrottle.objects.create(ip_address='ip2', block_expires=now-timedelta(days=1))
+        IpThrottle.objects.create(ip_address='ip2', block_expires=now+timedelta(days=1))  # still live
+        IpOffence.objects.create(ip_address='ip2', offences=4)
+
+        call_command('prune_ip_throttles', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(list(IpThrottle.objects.values_list('ip_address', flat=True)), ['ip2'])
+        self.assertEqual(IpOffence.objects.get(ip_address='ip1').offences, 3)
+        self.assertEqual(IpOffence.objects.get(ip_address='ip2').offences, 5)
+
+        # offence counts survive pruning
+        writer = IpThrottleWriter()
+        self.assertEqual(writer.offence_count('ip1'), 3)
+        self.assertEqual(writer.offence_count('ip2'), 6)
+
+    def test_no_rollup(self):
+        IpThrottle.objects.create(ip_address='ip1', block_expires=datetime.now(pytz.UTC)-timedelta(days=1))
+        call_command('prune_ip_throttles', no_rollup=True, stdout=StringIO())
+        self.assertEqual(IpThrottle.objects.count(), 0)
+        self.assertEqual(IpOffence.objects.count(), 0)
+
+
+class BenchmarkThrottleTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.baseline = os.path.join(self.tmpdir.name, 'baseline.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def benchmark(self, **options):
+        stdout = StringIO()
+        options = {'requests': 2000, 'django_requests': 100, 'ips': 200, **options}
+        call_command('benchmark_throttle', baseline=self.baseline, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_save_and_compare(self):
+        output = self.benchmark(save=True)
+        self.assertIn('monitor: requests=2000', output)
+        self.assertIn('django: requests=100', output)
+        with open(self.baseline) as f:
+            results = json.load(f)['results']
+        self.assertGreater(results['monitor']['rejected'], 0)  # heavy hitters and pre-blocked ips
+        self.assertGreater(results['django']['rejected'], 0)
+
+        # nothing is left behind in the db
+        self.assertEqual(IpThrottle.objects.count(), 0)
+
+        self.assertIn('No regressions', self.benchmark(tolerance=100))
+
+    def test_django_uses_chosen_backend(self):
+        with mock.patch('quotes.middleware.get_backend', wraps=get_backend) as mock_get_backend:
+            output = self.benchmark(backend='mmap', save=True)
+        self.assertIn('django: requests=100', output)
+        configs = [call.args[0] for call in mock_get_backend.call_args_list]
+        self.assertTrue(configs)
+        for config in configs:
+            self.assertEqual(config['BACKEND'], 'quotes.throttle_backends.MmapBackend')
+        # a fresh file each run, never the site's own
+        self.assertEqual(len({config['OPTIONS']['path'] for config in configs}), len(configs))
+
+    def test_regression_fails(self):
+        with open(self.baseline, 'w') as f:
+            json.dump({'options': {}, 'results': {'monitor': {'ops_per_sec': 1e12}}}, f)
+        with self.assertRaises(CommandError):
+            self.benchmark(django_requests=0)
+
+
+class SlidingWindowCounterTest(TestCase):
+
+    def test_total_is_over_window(self):
+        counter = SlidingWindowCounter(30)
+        self.assertEqual(counter.add('ip1', 1000, 975), 1)
+        self.assertEqual(counter.add('ip1', 1000, 975), 2)
+        self.assertEqual(counter.add('ip1', 1005, 975), 3)
+        self.assertEqual(counter.add('ip2', 1005, 975), 1)
+
+        # the 1000 bucket drops out once the window starts after it
+        self.assertEqual(counter.total('ip1', 1001), 1)
+        self.assertEqual(counter.add('ip1', 1010, 1001), 2)
+
+    def test_requests_older_than_window_are_ignored(self):
+        counter = SlidingWindowCounter(30)
+        self.assertEqual(counter.add('ip1', 1000, 1000), 1)
+        self.assertEqual(counter.add('ip1', 995, 1000), 1)
+
+    def test_ring_reuses_slots(self):
+        counter = SlidingWindowCounter(10)  # 3 slots
+        for period in range(1000, 1100, 5):
+            total = counter.add('ip1', period, period - 10)
+        self.assertEqual(total, 3)
+        self.assertEqual(list(counter.buckets('ip1')), [(1085, 1), (1090, 1), (1095, 1)])
+
+        # a long gap clears everything
+        self.assertEqual(counter.add('ip1', 5000, 4990), 1)
+        self.assertEqual(list(counter.buckets('ip1')), [(5000, 1)])
+
+    def test_prune_only_removes_stale_keys(self):
+        counter = SlidingWindowCounter(30)
+        counter.add('ip1', 1000, 975)
+        counter.add('ip2', 1050, 1025)
+        counter.prune(1010)
+        self.assertNotIn('ip1', counter)
+        self.assertIn('ip2', counter)
+        self.assertEqual(len(counter), 1)
+
+
+class PrefixTrieTest(TestCase):
+
+    def test_longest_match(self):
+        trie = PrefixTrie()
+        trie.insert(*parse_cidr('10.0.0.0/8'), 'a')
+        trie.insert(*parse_cidr('10.1.0.0/16'), 'b')
+        trie.insert(*parse_cidr('10.1.2.0/24'), 'c')
+        self.assertEqual(len(trie), 3)
+        self.assertEqual(trie.longest_match(pack_ip('10.1.2.3'))[2], 'c')
+        self.assertEqual(trie.longest_match(pack_ip('10.1.3.3'))[2], 'b')
+        self.assertEqual(trie.longest_match(pack_ip('10.2.0.1'))[2], 'a')
+        self.assertIsNone(trie.longest_match(pack_ip('11.0.0.1')))
+        self.assertEqual(trie.longest_match(pack_ip('10.1.2.3'))[:2], parse_cidr('10.1.2.0/24'))
+
+    def test_insert_splits_edges(self):
+        # inserting the shorter prefix after the longer ones forces a split
+        trie = PrefixTrie()
+        trie.insert(*parse_cidr('192.168.1.0/24'), 1)
+        trie.insert(*parse_cidr('192.168.2.0/24'), 2)
+        trie.insert(*parse_cidr('192.168.0.0/16'), 3)
+        self.assertEqual(trie.longest_match(pack_ip('192.168.1.9'))[2], 1)
+        self.assertEqual(trie.longest_match(pack_ip('192.168.2.9'))[2], 2)
+        self.assertEqual(trie.longest_match(pack_ip('192.168.3.9'))[2], 3)
+        self.assertEqual(sorted(value for _, _, value in trie.items()), [1, 2, 3])
+
+    def test_remove(self):
+        trie = PrefixTrie()
+        trie.insert(*parse_cidr('10.0.0.0/8'), 'a')
+        trie.insert(*parse_cidr('10.1.0.0/16'), 'b')
+        trie.remove(*parse_cidr('10.1.0.0/16'))
+        trie.remove(*parse_cidr('172.16.0.0/12'))  # not there - no-op
+        self.assertEqual(len(trie), 1)
+        self.assertEqual(trie.longest_match(pack_ip('10.1.2.3'))[2], 'a')
+
+    def test_subnet_helpers(self):
+        self.assertEqual(format_cidr(*get_subnet(pack_ip('1.2.3.4'))), '1.2.3.0/24')
+        self.assertEqual(format_cidr(*get_subnet(pack_ip('2001:db8:1:2:3::4'))), '2001:db8:1:2::/64')
+        self.assertEqual(parse_cidr('1.2.3.4/24'), get_subnet(pack_ip('1.2.3.4')))
+
+
+class MmapBackendTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'ipmon.mmap')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_add_is_shared_between_instances(self):
+        backend1 = MmapBackend(self.path, counter_slots=64, block_slots=16)
+        backend2 = MmapBackend(self.path, counter_slots=64, block_slots=16)
+        period = int(time.time()) // 5 * 5
+
+        self.assertEqual(backend1.add('ip1', period, period - 30, 35), 1)
+        self.assertEqual(backend2.add('ip1', period, period - 30, 35), 2)
+        self.assertEqual(backend1.add('ip1', period - 5, period - 30, 35), 3)
+        self.assertEqual(backend2.add('ip2', period, period - 30, 35), 1)
+
+        # older buckets fall out of the window
+        self.assertEqual(backend1.add('ip1', period, period, 35), 3)
+
+    def test_blocks_are_shared_between_instances(self):
+        backend1 = MmapBackend(self.path, counter_slots=64, block_slots=16)
+        backend2 = MmapBackend(self.path, counter_slots=64, block_slots=16)
+        expires = datetime.now(pytz.UTC).replace(microsecond=0) + timedelta(minutes=1)
+
+        backend1.block('ip1', expires)
+        self.assertEqual(backend2.get_block('ip1'), expires)
+        self.assertIsNone(backend2.get_block('ip2'))
+        self.assertEqual(backend2.get_blocks(), {'ip1': expires})
+
+        backend2.unblock('ip1')
+        self.assertIsNone(backend1.get_block('ip1'))
+
+    def test_full_table_overwrites_rather_than_fails(self):
+        backend = MmapBackend(self.path, counter_slots=8, block_slots=4)
+        period = int(time.time()) // 5 * 5
+        for i in range(50):
+            self.assertEqual(backend.add(f'ip{i}', period, period, 35), 1)
+
+
+class FakeRedis:
+    '''Just enough of a redis-py client for RedisBackend, with a clock the test moves'''
+
+    def __init__(self):
+        self.now = 0
+        self.data = {}  # {key: (value, expires at or None)}
+
+    def get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= self.now:
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and self.get(key) is not None:
+            return None
+        self.data[key] = (str(value).encode('utf-8'), None if ex is None else self.now + ex)
+        return True
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self.data[key] = (str(value).encode('utf-8'), self.data.get(key, (None, None))[1])
+        return value
+
+    def expire(self, key, ttl):
+        if self.get(key) is not None:
+            self.data[key] = (self.data[key][0], self.now + ttl)
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        prefix = match.rstrip('*')
+        return [key.encode('utf-8') for key in list(self.data) if key.startswith(prefix) and self.get(key) is not None]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class RedisBackendTest(TestCase):
+
+    def setUp(self):
+        self.client = FakeRedis()
+        self.backend = RedisBackend(client=self.client)
+
+    def test_counts_expire(self):
+        period = int(time.time()) // 5 * 5
+        self.assertEqual(self.backend.add('ip1', period, period - 30, 35), 1)
+        self.assertEqual(self.backend.add('ip1', period, period - 30, 35), 2)
+        self.assertEqual(self.backend.add('ip1', period - 5, period - 30, 35), 3)
+        self.assertEqual(self.backend.add('ip2', period, period - 30, 35), 1)
+
+        self.client.now += 36
+        self.assertEqual(self.backend.add('ip1', period, period - 30, 35), 1)
+
+    def test_blocks_expire(self):
+        expires = datetime.now(pytz.UTC).replace(microsecond=0) + timedelta(minutes=1)
+        self.backend.block('ip1', expires)
+        self.backend.block('ip2', expires)
+        self.assertEqual(self.backend.get_block('ip1'), expires)
+        self.assertIsNone(self.backend.get_block('ip3'))
+        self.assertEqual(self.backend.get_blocks(), {'ip1': expires, 'ip2': expires})
+
+        self.backend.unblock('ip2')
+        self.assertEqual(self.backend.get_blocks(), {'ip1': expires})
+
+        self.client.now += 61
+        self.assertIsNone(self.backend.get_block('ip1'))
+        self.assertEqual(self.backend.get_blocks(), {})
+
+    def test_offences_expire(self):
+        self.assertIsNone(self.backend.get_offences('ip1'))
+        self.assertEqual(self.backend.add_offence('ip1', 2, 100), 3)
+        self.assertEqual(self.backend.add_offence('ip1', 2, 100), 4)
+        self.assertEqual(self.backend.get_offences('ip1'), 4)
+
+        self.client.now += 101
+        self.assertIsNone(self.backend.get_offences('ip1'))
+
+    def test_monitor(self):
+        monitor = IpMonitorLive(monitor_limit_count=2, blocked_ips={}, backend=self.backend)
+        for i in range(3):
+            self.assertTrue(monitor.add('ip1', time.time()))
+        self.assertTrue(monitor.is_blocked('ip1'))
+        self.assertFalse(monitor.add('ip1', time.time()))
+        self.assertIsNotNone(self.backend.get_offences('ip1'))
+
 
 class ThrottleTest(TestCase):
 
@@ -242,3 +697,49 @@ class ThrottleTest(TestCase):
             for _ in range(100):
                 executor.submit(self.send_get)
         
+
+
+@override_settings(
+    IP_MONITOR_BACKEND={'BACKEND': 'quotes.throttle_backends.LocalMemoryBackend'},
+    IP_MONITOR_ROUTE_LIMITS={'/api/': (30, 5), '/api/login/': (30, 2)},
+)
+class IpThrottleMiddlewareTest(TestCase):
+
+    def setUp(self):
+        IpThrottle.objects.all().delete()
+        self.factory = RequestFactory()
+        self.calls = []
+        self.middleware = IpThrottleMiddleware(self.get_response)
+
+    def get_response(self, request):
+        self.calls.append(request.path)
+        return HttpResponse('OK')
+
+    def send(self, path, ip='1.2.3.4'):
+        return self.middleware(self.factory.get(path, REMOTE_ADDR=ip))
+
+    def test_blocked_ip_never_reaches_view(self):
+        for _ in range(3):
+            self.assertEqual(self.send('/api/login/').status_code, 200)
+        self.assertEqual(len(self.calls), 3)
+
+        # blocked on every api route, not just the one that tripped the limit
+        self.assertEqual(self.send('/api/login/').status_code, 403)
+        self.assertEqual(self.send('/api/logout/').status_code, 403)
+        self.assertEqual(len(self.calls), 3)
+
+        # other IPs unaffected
+        self.assertEqual(self.send('/api/logout/', ip='5.6.7.8').status_code, 200)
+
+    def test_longest_prefix_wins(self):
+        # login allows 2, the rest of the api allows 5 - and they are counted separately
+        for _ in range(5):
+            self.assertEqual(self.send('/api/quotes/').status_code, 200)
+        for _ in range(2):
+            self.assertEqual(self.send('/api/login/').status_code, 200)
+        self.assertEqual(IpThrottle.objects.count(), 0)
+
+    def test_unmatched_routes_not_monitored(self):
+        for _ in range(20):
+            self.assertEqual(self.send('/quote/123/').status_code, 200)
+        self.assertEqual(IpThrottle.objects.count(), 0)
@@ -1,10 +1,13 @@
 from datetime import datetime
+from threading import Thread
+from unittest import mock
 import pytz
 
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
 
 from quotes.models import Quote, Category, Vote
+from quotes.vote_buffer import VoteBuffer
 
 import pdb
 
@@ -301,3 +304,99 @@ class VoteTest(TestCase):
         response = self.client.get(f'{VOTES_URL}')
         self.assertEqual(response.status_code, 400)
         self.assertIn('filter by quote or by user', response.json()['message'].lower())
+
+
+@mock.patch('quotes.flusher.threading.Thread')
+class VoteBufferTest(TestCase):
+
+    def setUp(self):
+        self.buffer = VoteBuffer(flush_interval=60)
+        self.quote1 = Quote.objects.create(quote='quote1', author='author1')
+        self.quote2 = Quote.objects.create(quote='quote2', author='author2')
+
+    def test_flush_applies_summed_votes(self, mock_thread):
+        with self.assertNumQueries(5):  # just checking the quotes exist
+            for value in [1, 1, 1, -1]:
+                self.buffer.add(Vote(quote_id=self.quote1.id, value=value))
+            self.buffer.add(Vote(quote_id=self.quote2.id, value=-1))
+        self.assertEqual(Vote.objects.count(), 0)
+        mock_thread.return_value.start.assert_called_once()
+
+        # one UPDATE per quote and one INSERT, whatever the number of votes
+        with self.assertNumQueries(5):  # savepoint, 2x UPDATE, INSERT, release
+            self.assertEqual(self.buffer.flush(), 5)
+
+        self.quote1.refresh_from_db()
+        self.quote2.refresh_from_db()
+        expected = Quote()
+        for value in [1, 1, 1, -1]:
+            expected.update_votes(value)
+        self.assertEqual((self.quote1.total_upvotes, self.quote1.total_downvotes, self.quote1.net_votes), (3, 1, 2))
+        self.assertAlmostEqual(self.quote1.popularity, expected.popularity)
+        self.assertEqual((self.quote2.total_upvotes, self.quote2.total_downvotes, self.quote2.popularity), (0, 1, 0.2))
+        self.assertEqual(Vote.objects.count(), 5)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_votes_for_missing_quotes(self, mock_thread):
+        self.buffer.add(Vote(quote_id=self.quote1.id, value=1))
+        with self.assertRaises(Quote.DoesNotExist):
+            self.buffer.add(Vote(quote_id=12345, value=1))
+
+        # deleted after the vote was accepted
+        quote3 = Quote.objects.create(quote='quote3', author='author3')
+        self.buffer.add(Vote(quote_id=quote3.id, value=1))
+        quote3.delete()
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Vote.objects.filter(quote=self.quote1).count(), 1)
+
+        with mock.patch('quotes.views.vote_buffer', self.buffer):
+            response = Client().post(VOTES_URL, data={'quote_id': 12345, 'value': 1})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_flush_kept(self, mock_thread):
+        self.buffer.add(Vote(quote_id=self.quote1.id, session_id='session', value=1))
+        with mock.patch('quotes.vote_buffer.Vote.objects.bulk_create', side_effect=Exception('db down')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertTrue(self.buffer.contains(self.quote1.id, 'session'))
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.total_upvotes, 0)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertFalse(self.buffer.contains(self.quote1.id, 'session'))
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.total_upvotes, 1)
+
+    def test_keys_kept_until_committed(self, mock_thread):
+        self.buffer.add(Vote(quote_id=self.quote1.id, session_id='session', value=1))
+        seen = []
+        original = Vote.objects.bulk_create
+        def bulk_create(*args, **kwargs):
+            # mid-flush, before the commit
+            seen.append(self.buffer.contains(self.quote1.id, 'session'))
+            return original(*args, **kwargs)
+        with mock.patch('quotes.vote_buffer.Vote.objects.bulk_create', side_effect=bulk_create):
+            self.buffer.flush()
+        self.assertEqual(seen, [True])
+        self.assertFalse(self.buffer.contains(self.quote1.id, 'session'))
+
+    def test_thread_started_once(self, mock_thread):
+        threads = [Thread(target=self.buffer.start) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mock_thread.assert_called_once()
+
+    def test_pending_votes_count_as_recent(self, mock_thread):
+        client = Client()
+        with mock.patch('quotes.views.vote_buffer', self.buffer):
+            response = client.post(VOTES_URL, data={'quote_id': self.quote1.id, 'value': 1})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()['data']['quote'], self.quote1.id)
+            self.assertNotIn('id', response.json()['data'])
+            response = client.post(VOTES_URL, data={'quote_id': self.quote1.id, 'value': 1})
+            self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.quote1.refresh_from_db()
+        self.assertEqual(self.quote1.total_upvotes, 1)
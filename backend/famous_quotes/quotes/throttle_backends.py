@@ -0,0 +1,394 @@
+from contextlib import contextmanager
+from datetime import datetime
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import pytz
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from quotes.sliding_window import SlidingWindowCounter
+from quotes.utils import unpack_ip
+
+logger = logging.getLogger('fq')
+
+
+class BaseThrottleBackend:
+    '''
+    Storage for the state that IpMonitorLive needs to share between workers.
+    Every gunicorn worker has its own IpMonitorLive, so unless the counts and blocks
+    live somewhere shared, an abuser gets N x the request budget and a block applied
+    in one worker is invisible to the others.
+
+    Periods are integer epoch-seconds marking the start of a 5s bucket.
+    Block expiries are tz-aware datetimes.
+    '''
+
+    def add(self, ip_address, period, since, ttl, scope=''):
+        '''
+        Atomically count one request for ip_address in the bucket starting at period and
+        return the total number of requests for ip_address in all buckets starting >= since.
+        The bucket should expire ttl seconds after it is created. Counts in different scopes
+        are kept apart - scope is passed separately so callers don't build a key per request.
+        '''
+        raise NotImplementedError
+
+    def block(self, ip_address, expires):
+        raise NotImplementedError
+
+    def get_block(self, ip_address):
+        '''Return the block expiry for this ip_address, or None if not blocked'''
+        raise NotImplementedError
+
+    def unblock(self, ip_address):
+        raise NotImplementedError
+
+    def get_blocks(self):
+        '''Return {ip_address: expiry} for every block currently held'''
+        raise NotImplementedError
+
+    def get_offences(self, ip_address):
+        '''Return how many times ip_address has been blocked, or None if the backend doesn't know'''
+        raise NotImplementedError
+
+    def add_offence(self, ip_address, initial, ttl):
+        '''
+        Atomically count one more block for ip_address - on top of initial if the backend
+        doesn't have a count for it yet - keep it for ttl seconds, and return the new count.
+        '''
+        raise NotImplementedError
+
+    def configure(self, window_seconds):
+        '''Called by every IpMonitorLive using this backend with its monitor_limit_seconds'''
+        pass
+
+    def prune(self, since, now):
+        '''Housekeeping - drop buckets older than since and blocks that expired before now'''
+        pass
+
+    def dump(self):
+        return []
+
+
+class LocalMemoryBackend(BaseThrottleBackend):
+    '''Per-process storage. Fine for a single worker (and for tests), but not shared.'''
+
+    def __init__(self, window_seconds=0):
+        self.window_seconds = window_seconds
+        self.requests = {}  # {scope: SlidingWindowCounter}
+        self.blocked_ips = {}  # {ip_address: expiry}
+        self.offences = {}  # {ip_address: (count, expires epoch s)}
+
+    def configure(self, window_seconds):
+        # a ring bigger than a monitor's window still gives the right totals, so one
+        # counter sized for the longest window can be shared by every monitor
+        if window_seconds > self.window_seconds:
+            self.window_seconds = window_seconds
+            self.requests = {}
+
+    def add(self, ip_address, period, since, ttl, scope=''):
+        requests = self.requests.get(scope)
+        if requests is None:
+            requests = self.requests[scope] = SlidingWindowCounter(self.window_seconds)
+        return requests.add(ip_address, period, since)
+
+    def block(self, ip_address, expires):
+        self.blocked_ips[ip_address] = expires
+
+    def get_block(self, ip_address):
+        return self.blocked_ips.get(ip_address)
+
+    def unblock(self, ip_address):
+        self.blocked_ips.pop(ip_address, None)
+
+    def get_blocks(self):
+        return dict(self.blocked_ips)
+
+    def get_offences(self, ip_address):
+        entry = self.offences.get(ip_address)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def add_offence(self, ip_address, initial, ttl):
+        count = self.get_offences(ip_address)
+        count = (initial if count is None else count) + 1
+        self.offences[ip_address] = (count, time.time() + ttl)
+        return count
+
+    def prune(self, since, now):
+        # other monitors sharing this backend may have longer windows
+        since = min(since, math.ceil(now.timestamp()) - self.window_seconds)
+        for requests in self.requests.values():
+            requests.prune(since)
+        for ip_address in [ip for ip, dt in self.blocked_ips.items() if dt < now]:
+            del self.blocked_ips[ip_address]
+        for ip_address in [ip for ip, (count, expires) in self.offences.items() if expires < now.timestamp()]:
+            del self.offences[ip_address]
+
+    def dump(self):
+        output = []
+        for scope, requests in self.requests.items():
+            prefix = f'{scope}|' if scope else ''
+            for ip_address in requests.windows:
+                for period, count in requests.buckets(ip_address):
+                    output.append(f'IP: ({prefix}{unpack_ip(ip_address)}) @ {datetime.fromtimestamp(period, pytz.UTC).isoformat()} (x{count})')
+        return output
+
+
+def hash_key(*parts):
+    # 64-bit key for the mmap table. 0 is reserved to mean "empty slot"
+    digest = hashlib.blake2b('|'.join(str(p) for p in parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class MmapBackend(BaseThrottleBackend):
+    '''
+    Shared-memory storage - a pair of fixed-size, open-addressed hash tables in a
+    memory-mapped file. Every worker on the host maps the same file, and each operation
+    takes an exclusive flock so increment-and-expire is atomic across processes.
+
+    Slots are never deleted, only marked stale by their expiry, and probing is bounded,
+    so the file never grows. If a probe window is full of live slots the one closest
+    to expiring is overwritten, i.e. under extreme load we forget the oldest data
+    rather than fail the request.
+    '''
+
+    MAGIC = b'FQIPMON1'
+    HEADER = struct.Struct('<8sII')  # magic, counter slots, block slots
+    COUNTER = struct.Struct('<Qqq')  # key hash, expires (epoch s), count
+    BLOCK = struct.Struct('<Qq64s')  # key hash, expires (epoch s), ip address
+    MAX_PROBE = 32
+
+    def __init__(self, path=None, counter_slots=65536, block_slots=4096):
+        import fcntl  # POSIX only - import here so the module still loads elsewhere
+        self._fcntl = fcntl
+
+        self.path = path or os.path.join(tempfile.gettempdir(), 'fq_ip_monitor.mmap')
+        self.counter_slots = counter_slots
+        self.block_slots = block_slots
+        self.counter_offset = self.HEADER.size
+        self.block_offset = self.counter_offset + counter_slots * self.COUNTER.size
+        size = self.block_offset + block_slots * self.BLOCK.size
+
+        self._lock = threading.Lock()  # flock does not serialise threads sharing one fd
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+            self.mm = mmap.mmap(self.fd, size)
+            magic, n_counters, n_blocks = self.HEADER.unpack_from(self.mm, 0)
+            if magic != self.MAGIC or n_counters != counter_slots or n_blocks != block_slots:
+                # new file, or laid out differently by an older config - start afresh
+                self.mm[:] = bytes(size)
+                self.HEADER.pack_into(self.mm, 0, self.MAGIC, counter_slots, block_slots)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self._fcntl.flock(self.fd, self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self.fd, self._fcntl.LOCK_UN)
+
+    def _find(self, table, key, now, insert=False):
+        '''
+        Return the offset of the slot holding key. If insert, return a reusable slot when
+        key is not present. Returns None if the key is not found (and not inserting).
+        '''
+        if table == 'counter':
+            offset, slots, record = self.counter_offset, self.counter_slots, self.COUNTER
+        else:
+            offset, slots, record = self.block_offset, self.block_slots, self.BLOCK
+
+        start = key % slots
+        reusable = None
+        oldest = None
+        for i in range(min(self.MAX_PROBE, slots)):
+            slot_offset = offset + ((start + i) % slots) * record.size
+            slot_key, expires = struct.unpack_from('<Qq', self.mm, slot_offset)
+            if slot_key == key and expires >= now:
+                return slot_offset
+            if slot_key == 0:
+                # nothing has ever been stored beyond here
+                return (reusable or slot_offset) if insert else None
+            if expires < now:
+                reusable = reusable or slot_offset
+            elif oldest is None or expires < oldest[0]:
+                oldest = (expires, slot_offset)
+
+        if not insert:
+            return None
+        return reusable or oldest[1]
+
+    def add(self, ip_address, period, since, ttl, scope=''):
+        now = int(time.time())
+        with self._locked():
+            key = hash_key('r', scope, ip_address, period)
+            slot_offset = self._find('counter', key, now, insert=True)
+            slot_key, expires, count = self.COUNTER.unpack_from(self.mm, slot_offset)
+            if slot_key == key and expires >= now:
+                self.COUNTER.pack_into(self.mm, slot_offset, key, expires, count + 1)
+            else:
+                self.COUNTER.pack_into(self.mm, slot_offset, key, now + ttl, 1)
+
+            total = 0
+            for p in range(since - since % 5, max(period, now) + 1, 5):
+                if p < since:
+                    continue
+                slot_offset = self._find('counter', hash_key('r', scope, ip_address, p), now)
+                if slot_offset is not None:
+                    total += self.COUNTER.unpack_from(self.mm, slot_offset)[2]
+            return total
+
+    def block(self, ip_address, expires):
+        now = int(time.time())
+        key = hash_key('b', ip_address)
+        with self._locked():
+            slot_offset = self._find('block', key, now, insert=True)
+            self.BLOCK.pack_into(self.mm, slot_offset, key, int(expires.timestamp()), ip_address.encode('utf-8')[:64])
+
+    def get_block(self, ip_address):
+        now = int(time.time())
+        with self._locked():
+            slot_offset = self._find('block', hash_key('b', ip_address), now)
+            if slot_offset is None:
+                return None
+            expires = self.BLOCK.unpack_from(self.mm, slot_offset)[1]
+        return datetime.fromtimestamp(expires, pytz.UTC)
+
+    def unblock(self, ip_address):
+        now = int(time.time())
+        key = hash_key('b', ip_address)
+        with self._locked():
+            slot_offset = self._find('block', key, now)
+            if slot_offset is not None:
+                # leave the key in place (so probe chains stay intact) but mark it expired
+                self.BLOCK.pack_into(self.mm, slot_offset, key, 0, b'')
+
+    def get_blocks(self):
+        now = int(time.time())
+        blocks = {}
+        with self._locked():
+            for i in range(self.block_slots):
+                slot_key, expires, ip_address = self.BLOCK.unpack_from(self.mm, self.block_offset + i * self.BLOCK.size)
+                if slot_key and expires >= now:
+                    blocks[ip_address.rstrip(b'\x00').decode('utf-8')] = datetime.fromtimestamp(expires, pytz.UTC)
+        return blocks
+
+    # offence counts share the counter table, under their own keys
+
+    def get_offences(self, ip_address):
+        now = int(time.time())
+        with self._locked():
+            slot_offset = self._find('counter', hash_key('o', ip_address), now)
+            if slot_offset is None:
+                return None
+            return self.COUNTER.unpack_from(self.mm, slot_offset)[2]
+
+    def add_offence(self, ip_address, initial, ttl):
+        now = int(time.time())
+        key = hash_key('o', ip_address)
+        with self._locked():
+            slot_offset = self._find('counter', key, now, insert=True)
+            slot_key, expires, count = self.COUNTER.unpack_from(self.mm, slot_offset)
+            if slot_key != key or expires < now:
+                count = initial
+            self.COUNTER.pack_into(self.mm, slot_offset, key, now + ttl, count + 1)
+            return count + 1
+
+
+class RedisBackend(BaseThrottleBackend):
+    '''
+    Storage in Redis, or anything that speaks its protocol (KeyDB, Dragonfly, a local
+    stand-in...). Pass either a url or an already-constructed redis-py compatible client.
+    INCR + EXPIRE + MGET go in one MULTI so the count and the window total are consistent.
+    '''
+
+    def __init__(self, url='redis://localhost:6379/0', client=None, prefix='fq:ipmon:'):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured('RedisBackend requires the redis package (or pass client=...)')
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def request_key(self, ip_address, period, scope=''):
+        return f'{self.prefix}r:{scope}:{ip_address}:{period}'
+
+    def block_key(self, ip_address):
+        return f'{self.prefix}b:{ip_address}'
+
+    def offence_key(self, ip_address):
+        return f'{self.prefix}o:{ip_address}'
+
+    def add(self, ip_address, period, since, ttl, scope=''):
+        key = self.request_key(ip_address, period, scope)
+        latest = max(period, int(time.time()))
+        window = [self.request_key(ip_address, p, scope) for p in range(since - since % 5, latest + 1, 5) if p >= since]
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incr(key)
+        pipe.expire(key, ttl)  # only garbage collection - window membership is decided by period
+        pipe.mget(window)
+        results = pipe.execute()
+        return sum(int(count) for count in results[-1] if count is not None)
+
+    def block(self, ip_address, expires):
+        ttl = max(1, int((expires - datetime.now(pytz.UTC)).total_seconds()))
+        self.client.set(self.block_key(ip_address), int(expires.timestamp()), ex=ttl)
+
+    def get_block(self, ip_address):
+        expires = self.client.get(self.block_key(ip_address))
+        if expires is None:
+            return None
+        return datetime.fromtimestamp(int(expires), pytz.UTC)
+
+    def unblock(self, ip_address):
+        self.client.delete(self.block_key(ip_address))
+
+    def get_blocks(self):
+        blocks = {}
+        offset = len(self.block_key(''))
+        for key in self.client.scan_iter(match=self.block_key('*')):
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            expires = self.client.get(key)
+            if expires is not None:
+                blocks[key[offset:]] = datetime.fromtimestamp(int(expires), pytz.UTC)
+        return blocks
+
+    def get_offences(self, ip_address):
+        count = self.client.get(self.offence_key(ip_address))
+        return None if count is None else int(count)
+
+    def add_offence(self, ip_address, initial, ttl):
+        key = self.offence_key(ip_address)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(key, initial, ex=ttl, nx=True)
+        pipe.incr(key)
+        pipe.expire(key, ttl)
+        return int(pipe.execute()[1])
+
+
+def get_backend(config=None):
+    '''
+    Build a backend from a settings-style dict, e.g.
+    {'BACKEND': 'quotes.throttle_backends.MmapBackend', 'OPTIONS': {'path': '/dev/shm/fq'}}
+    '''
+    if not config:
+        return LocalMemoryBackend()
+    try:
+        backend_class = import_string(config['BACKEND'])
+    except (KeyError, ImportError) as e:
+        raise ImproperlyConfigured(f'Could not load IP monitor backend: {e}')
+    return backend_class(**config.get('OPTIONS', {}))
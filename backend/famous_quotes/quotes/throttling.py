@@ -1,26 +1,27 @@
 from datetime import datetime, timedelta
 import logging
+import math
+import threading
+import time
 import pytz
 
 from django.http import HttpRequest
 
-from quotes.models import IpMonitor, IpThrottle
+from quotes.flusher import PeriodicFlusher
+from quotes.models import IpMonitor, IpOffence, IpThrottle
+from quotes.throttle_backends import LocalMemoryBackend
+from quotes.prefix_trie import PrefixTrie
+from quotes.utils import get_client_ip, pack_ip, unpack_ip, get_subnet, parse_cidr, format_cidr
 
 import pdb
 
 logger = logging.getLogger('fq')
 
-
-def values_equal(value1, value2):
-
-    if value1 is None and value2 is None:
-        return True
-
-    if value1 is not None and value2 is not None:
-        return value1 == value2    
-
-    # one is None and the other isn't
-    return False
+PERIOD_SECONDS = 5
+# how long the backend remembers an IP's offence count - after that it comes from the db again
+OFFENCE_TTL_SECONDS = 24 * 3600
+# longest block a repeat offender can get, however many offences they have
+MAX_BLOCK_SECONDS = 30 * 24 * 3600
 
 
 class IpMonitorLive:
@@ -32,154 +33,280 @@ class IpMonitorLive:
     * if a request comes in for a blocked IP address, must return blank/401 response
     * must be able to monitor all requests over the last X minutes
     * if more than Y requests occur in the last X minutes, should add IP address to block list
+
+    The request counts and blocks are held by a backend (see throttle_backends.py) so that
+    gunicorn workers can share them. The default backend is per-process.
+    Blocks are shared by every monitor on a backend; counts are kept per scope.
     '''
 
     def __init__(
         self, 
         count=0, 
         icount=0, 
-        requests=None, 
         commit_after_number=10, 
         blocked_ips=None,
         monitor_limit_seconds=30,
         monitor_limit_count=30,
+        backend=None,
+        scope='',
+        writer=None,
+        subnet_limit_count=None,
+        subnet_blocks=None,
     ):
         self.count = count
         self.icount = icount
         self.commit_after_number = commit_after_number
-        self.requests = requests or {}
-        self.blocked_ips = blocked_ips or {}
         self.monitor_limit_seconds = monitor_limit_seconds
         self.monitor_limit_count = monitor_limit_count
+        self.scope = scope  # keeps counts apart when several monitors share one backend
+        self.backend = backend if backend is not None else LocalMemoryBackend()
+        self.backend.configure(monitor_limit_seconds)
+        self.writer = writer if writer is not None else IpThrottleWriter()
+        self.subnet_limit_count = subnet_limit_count  # None = don't count requests per subnet
+        self.subnet_blocks = subnet_blocks if subnet_blocks is not None else PrefixTrie()
 
         logger.info(f'New IpMonitor created at {datetime.now().isoformat()}')
 
         # load blocked ips from database
         # if instantiated with blocked_ips present, do not overwrite
-        if len(self.blocked_ips) == 0:
+        if blocked_ips is None:
             db_blocked_ips = IpThrottle.objects.filter(block_expires__gte=datetime.now(pytz.UTC))
-            self.blocked_ips = {v.ip_address: v.block_expires for v in db_blocked_ips}
+            blocked_ips = {v.ip_address: v.block_expires for v in db_blocked_ips}
+        for ip, dt in blocked_ips.items():
+            self.apply_block(ip, dt)
+
+    @property
+    def blocked_ips(self):
+        return self.backend.get_blocks()
 
     def dump(self):
         output = {}
-        output['requests'] = [str(request) for request in self.requests.values()]
+        output['requests'] = self.backend.dump()
         output['count'] = self.count
         output['icount'] = self.icount
         output['blocked_ips'] = [f'{ip}: {dt.isoformat()}' for ip,dt in self.blocked_ips.items()]
         return output
 
-    def convert_request(self, request):
-        if isinstance(request, HttpRequest):
-            return IpRequest().from_django(request)
-        return request
-
     def get_period(self, dt):
         # define how to chunk time-periods
         return datetime(dt.year, dt.month, dt.day, dt.hour, dt.minute, int(dt.second/5)*5, tzinfo=dt.tzinfo)
 
-    def block_request(self, request):
-        # logger.info(f'status: {self.dump()}')
-        if request.ip_address in self.blocked_ips:
+    def get_window_start(self, now=None):
+        # earliest period (as a timestamp) that still counts towards the limit
+        if now is None:
+            now = time.time()
+        elif isinstance(now, datetime):
+            now = now.timestamp()
+        return math.ceil(now - self.monitor_limit_seconds)
+
+    def block_request(self, request, now=None):
+        return self.is_blocked(request.ip_address, now)
+
+    def is_blocked(self, ip_address, now=None):
+        if now is None:
+            now = datetime.now(pytz.UTC)
+        if len(self.subnet_blocks) and self.is_subnet_blocked(ip_address, now):
             return True
-        return False
-    
-    def add_request(self, request):
-        request = self.convert_request(request)
-        if self.block_request(request):
-            self.remove_old_blocks()  # if a user gets blocked, they cannot unblock themselves without this line
+        if self.is_block_active(ip_address, now):
+            return True
+
+        # a block on the address's /24 (/64) may have come from another worker, so that is looked up
+        # in the backend too - the trie only holds the networks this process knows about
+        ip = pack_ip(ip_address)
+        return isinstance(ip, int) and self.is_block_active(format_cidr(*get_subnet(ip)), now)
+
+    def is_block_active(self, ip_address, now):
+        expires = self.backend.get_block(ip_address)
+        if expires is None:
+            return False
+        if expires < now:
+            # if a user gets blocked, they cannot unblock themselves without this
+            self.backend.unblock(ip_address)
             return False
+        return True
 
-        request.datetime = self.get_period(request.datetime)
+    def is_subnet_blocked(self, ip_address, now=None):
+        # longest-prefix match, so one entry covers a whole /24 or /64
+        ip = pack_ip(ip_address)
+        if not isinstance(ip, int):
+            return False
+        match = self.subnet_blocks.longest_match(ip)
+        if match is None:
+            return False
+        network, length, expires = match
+        if expires < (now or datetime.now(pytz.UTC)):
+            self.subnet_blocks.remove(network, length)
+            return False
+        return True
 
-        if self.requests.get(request):
-            self.requests[request].count += 1
-        else:
-            self.requests[request] = request
+    def add_request(self, request):
+        # fast path for django requests - no IpRequest (or datetime) gets built
+        if isinstance(request, HttpRequest):
+            return self.add(get_client_ip(request), time.time())
+        return self.add(request.ip_address, request.timestamp)
+
+    def add(self, ip_address, timestamp):
+        if self.is_blocked(ip_address):
+            return False
+
+        # the backend gives back the total across all workers, so the limit holds globally
+        ip = pack_ip(ip_address)
+        total = self.backend.add(
+            ip,
+            get_period_timestamp(timestamp),
+            self.get_window_start(),
+            self.monitor_limit_seconds + PERIOD_SECONDS,
+            self.scope,
+        )
+        if total > self.monitor_limit_count:
+            self.block_ip(ip_address)
+
+        if self.subnet_limit_count:
+            self.add_subnet(ip, timestamp)
 
         self.count += 1
         self.icount += 1
         if self.icount >= self.commit_after_number:
             self.remove_old_requests()
-            self.remove_old_blocks()
-            self.block_ips()
             self.icount -= self.commit_after_number
         
         return True
 
-    def remove_old_blocks(self, now=None):
-        # loop through all blocked IPs and see if we are now beyond their blocking date. If so, remove them
+    def offence_count(self, ip_address):
+        # the backend's count is shared by every worker, the writer's comes from the db
+        count = self.backend.get_offences(ip_address)
+        return count if count is not None else self.writer.offence_count(ip_address)
+
+    def block_ip(self, ip_address):
+        # block repeat offenders for longer
+        # 5s -> 30s -> 60s -> 120s -> 240s ... -> MAX_BLOCK_SECONDS
+        # start at 5s because it could be a legit user who won't appreicate being banned.
+        # the doubling stops once it is past the cap, or a long-time offender overflows timedelta
+        previous_blocks = self.offence_count(ip_address)
+        doublings = min(previous_blocks, MAX_BLOCK_SECONDS.bit_length())
+        block_duration_seconds = 5 if previous_blocks == 0 else min(30 * (2 ** doublings), MAX_BLOCK_SECONDS)
+
+        logger.warn(f'IP block applied for {ip_address} at {datetime.now().isoformat()} for {block_duration_seconds}')
+        block_until = datetime.now(pytz.UTC)+timedelta(seconds=block_duration_seconds)
+        self.apply_block(ip_address, block_until)
+        self.backend.add_offence(ip_address, previous_blocks, OFFENCE_TTL_SECONDS)
+        self.writer.record(ip_address, block_until)
+
+    def add_subnet(self, ip, timestamp):
+        # botnets spread across a range get caught even if no single address is over the limit
+        if not isinstance(ip, int):
+            return
+        network, length = get_subnet(ip)
+        total = self.backend.add(
+            f'{network}/{length}',
+            get_period_timestamp(timestamp),
+            self.get_window_start(),
+            self.monitor_limit_seconds + PERIOD_SECONDS,
+            self.scope,
+        )
+        if total > self.subnet_limit_count:
+            self.block_ip(format_cidr(network, length))
+
+    def apply_block(self, ip_address, expires):
+        # ip_address may be a single address or a network in CIDR notation
+        if '/' in ip_address:
+            try:
+                network, length = parse_cidr(ip_address)
+            except ValueError:
+                logger.warn(f'Ignoring block for invalid network: {ip_address}')
+                return
+            self.subnet_blocks.insert(network, length, expires)
+        self.backend.block(ip_address, expires)
+
+    def remove_old_requests(self, now=None):
+        # removes anything that was added more than monitor_limit_seconds ago, and any expired blocks
         if now is None:
             now = datetime.now(pytz.UTC)
-        keys_to_delete = set()
-        for ip, dt in self.blocked_ips.items():  # dt is block expiry datetime
-            if dt < now:
-                keys_to_delete.add(ip)
+        self.backend.prune(self.get_window_start(now), now)
 
-        for key in keys_to_delete:
-            del self.blocked_ips[key]
-        
 
-    def total_up_requests_by_ip_address(self):
-        ip_addresses = {}
-        for key in self.requests:
-            if ip_addresses.get(key.ip_address):
-                ip_addresses[key.ip_address] += key.count
-            else:
-                ip_addresses[key.ip_address] = key.count
-        return ip_addresses
-
-    def block_ips(self):
-        ip_addresses = self.total_up_requests_by_ip_address()        
-        for key in ip_addresses:
-            if ip_addresses[key] > self.monitor_limit_count:
-
-                # block repeat offenders for longer
-                # 5s -> 30s -> 60s -> 120s -> 240s ...
-                # start at 5s because it could be a legit user who won't appreicate being banned
-                previous_blocks = IpThrottle.objects.filter(ip_address=key)
-                block_duration_seconds = 5 if len(previous_blocks) == 0 else 30 * (2 ** len(previous_blocks))
-
-                logger.warn(f'IP block applied for {key} at {datetime.now().isoformat()} for {block_duration_seconds}')
-                block_until = datetime.now(pytz.UTC)+timedelta(seconds=block_duration_seconds)
-                IpThrottle.objects.create(
-                    ip_address=key, 
-                    block_expires=block_until,
-                )
-                self.blocked_ips[key]=block_until
+class IpThrottleWriter(PeriodicFlusher):
+    '''
+    Persists blocks to IpThrottle. With flush_interval=0 every block is written straight
+    away; otherwise blocks are queued and a background thread bulk-inserts them every
+    flush_interval seconds, so a distributed attack doesn't turn into a burst of inserts
+    on the request path.
+
+    Also looks up how many times an IP has been blocked before, which IpMonitorLive falls
+    back on when its backend has no count for the IP - i.e. at most once a day per offender,
+    rather than loading every IP ever blocked at startup. If a write fails the blocks are
+    kept and tried again on the next flush.
+    '''
 
-    def remove_old_requests(self, now=None):
-        # removes anything that was added more than monitor_limit_seconds ago
-        if now is None:
-            now = datetime.now(pytz.UTC)
-        keys_to_delete = set()
-        for request in self.requests:
-            if (now - request.datetime).total_seconds() > self.monitor_limit_seconds:
-                keys_to_delete.add(request)
+    thread_name = 'ip-throttle-writer'
+
+    def __init__(self, flush_interval=0, batch_size=500):
+        super().__init__(flush_interval)
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
 
-        for key in keys_to_delete:
-            request = self.requests[key]
-            self.count -= request.count
-            # IpMonitor.objects.create(ip_address=request.ip_address, datetime=request.datetime, count=request.count)
-            del self.requests[key]
+    def offence_count(self, ip_address):
+        '''How many times ip_address has been blocked, from the db - two indexed lookups'''
+        # expired blocks get rolled up into IpOffence, so IpThrottle only holds recent ones
+        rolled_up = IpOffence.objects.filter(ip_address=ip_address).values_list('offences', flat=True).first() or 0
+        return rolled_up + IpThrottle.objects.filter(ip_address=ip_address).count()
+
+    def record(self, ip_address, block_until):
+        with self.lock:
+            self.pending.append(IpThrottle(ip_address=ip_address, block_expires=block_until))
+
+        if not self.flush_interval:
+            self.flush()
+        else:
+            self.start()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return 0
+
+        try:
+            IpThrottle.objects.bulk_create(pending, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f'Could not persist {len(pending)} IP blocks, will retry: {str(e)}')
+            with self.lock:
+                self.pending = pending + self.pending
+            return 0
+        return len(pending)
 
 
 class IpRequest:
+    '''
+    A single request from an IP address. Only used when the caller isn't a django request
+    (tests, replaying logs...) so it is kept small - no __dict__, the IP address packed to
+    an int where possible and the time held as integer epoch-seconds.
+    '''
+    __slots__ = ('ip', 'timestamp', 'count')
 
     def __init__(self, ip_address=None, dt=None, count=1):
-        self.ip_address = ip_address
-        self.datetime = datetime.now(pytz.UTC) if not dt else dt
+        self.ip = pack_ip(ip_address)
+        self.timestamp = int(time.time() if not dt else dt.timestamp())
         self.count = count
 
+    @property
+    def ip_address(self):
+        return unpack_ip(self.ip)
+
+    @property
+    def datetime(self):
+        return datetime.fromtimestamp(self.timestamp, pytz.UTC)
+
+    @property
+    def period(self):
+        return get_period_timestamp(self.timestamp)
+
     def __eq__(self, other):
-        if (
-            values_equal(self.ip_address, other.ip_address) 
-            and values_equal(self.datetime, other.datetime)
-        ):
-            return True
-        return False
+        return self.ip == other.ip and self.timestamp == other.timestamp
     
     def __hash__(self):
-        return hash((self.ip_address, self.datetime))
+        return hash((self.ip, self.timestamp))
     
     def __str__(self):
         return f'IP: ({self.ip_address}) @ {self.datetime.isoformat()} (x{self.count})'
@@ -187,13 +314,17 @@ class IpRequest:
     def __repr__(self):
         return str(self)
 
-    # https://stackoverflow.com/questions/4581789/how-do-i-get-user-ip-address-in-django
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        return x_forwarded_for.split(',')[0] if x_forwarded_for else request.META.get('REMOTE_ADDR')
+        return get_client_ip(request)
     
     def from_django(self, request):
-        self.ip_address = self.get_client_ip(request)
-        self.datetime = datetime.now(pytz.UTC)  # should have a way to get django request datetime?
+        self.ip = pack_ip(get_client_ip(request))
+        self.timestamp = int(time.time())  # should have a way to get django request datetime?
         self.count = 1
         return self
+
+
+def get_period_timestamp(timestamp):
+    # integer equivalent of IpMonitorLive.get_period
+    timestamp = int(timestamp)
+    return timestamp - timestamp % PERIOD_SECONDS
@@ -1,11 +1,16 @@
+from functools import lru_cache
+import ipaddress
 import json
 import random
 import logging
+import socket
 
 import pdb
 
 logger = logging.getLogger('fq')
 
+IPV4_MAPPED = 0xffff << 32
+
 
 def check_session(request):
     if not request.session.session_key:
@@ -14,14 +19,62 @@ def check_session(request):
         data = {
             'session_id': request.session.session_key,
             'user_agent': request.META.get('HTTP_USER_AGENT'),
-
-            # https://stackoverflow.com/questions/4581789/how-do-i-get-user-ip-address-in-django
-            'IP address': request.META.get('HTTP_X_FORWARDED_FOR').split(',')[0] if request.META.get('HTTP_X_FORWARDED_FOR') else request.META.get('REMOTE_ADDR')
+            'IP address': get_client_ip(request),
         }
         logger.info(f'NEW SESSION - {json.dumps(data)}')
     return request
 
 
+# https://stackoverflow.com/questions/4581789/how-do-i-get-user-ip-address-in-django
+def get_client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    return x_forwarded_for.split(',')[0] if x_forwarded_for else request.META.get('REMOTE_ADDR')
+
+
+@lru_cache(maxsize=65536)
+def pack_ip(ip_address):
+    '''
+    IPv4 and IPv6 addresses become a single int (IPv4 mapped into ::ffff:0:0/96 so the two
+    can't collide). Anything else (e.g. a hostname from a misconfigured proxy) is left as is.
+    Cached, so repeat visitors cost a dict lookup.
+    '''
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), 'big') | IPV4_MAPPED
+    except (OSError, TypeError):
+        pass
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_address), 'big')
+    except (OSError, TypeError):
+        return ip_address
+
+
+def unpack_ip(ip):
+    if not isinstance(ip, int):
+        return ip
+    if ip >> 32 == IPV4_MAPPED >> 32:
+        return socket.inet_ntop(socket.AF_INET, (ip & 0xffffffff).to_bytes(4, 'big'))
+    return socket.inet_ntop(socket.AF_INET6, ip.to_bytes(16, 'big'))
+
+
+def get_subnet(ip, ipv4_prefix=24, ipv6_prefix=64):
+    '''(network, prefix length) of the subnet containing a packed ip, both in packed (IPv6) space'''
+    length = 96 + ipv4_prefix if ip >> 32 == IPV4_MAPPED >> 32 else ipv6_prefix
+    return ip & (((1 << length) - 1) << (128 - length)), length
+
+
+def parse_cidr(cidr):
+    network = ipaddress.ip_network(cidr, strict=False)
+    if network.version == 4:
+        return int(network.network_address) | IPV4_MAPPED, 96 + network.prefixlen
+    return int(network.network_address), network.prefixlen
+
+
+def format_cidr(network, length):
+    if network >> 32 == IPV4_MAPPED >> 32 and length >= 96:
+        return f'{unpack_ip(network)}/{length - 96}'
+    return f'{unpack_ip(network)}/{length}'
+
+
 def get_data(request):
     # create a common interface to extract the request data
     DEFAULT_RESPONSE = {}
@@ -0,0 +1,65 @@
+'''
+Change counters, kept in the cache, for building ETags. Every write to something a read
+endpoint returns bumps its counter - 'categories' for the whole table, 'quote:<id>' per quote,
+and so on (see signals.py) - so an ETag is just a hash of the counters a response depends on,
+and a client that already has the current version gets a 304 without anything being
+queried or serialised.
+
+A counter that has never been set (or was evicted) starts from the clock in milliseconds, so
+it can't come back as a number that was handed out before.
+
+The counters live in the 'versions' cache, which must not have a per-worker tier in front of it:
+a bump has to be seen by every worker straight away, or the others keep answering 304 with
+the old ETag. Without that alias, 'default' is used.
+'''
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def get_cache():
+    return caches['versions' if 'versions' in settings.CACHES else 'default']
+
+
+def key(name):
+    return f'version:{name}'
+
+
+def get_versions(names):
+    cache = get_cache()
+    keys = {key(name): name for name in names}
+    found = cache.get_many(keys.keys())
+    versions = {}
+    for cache_key, name in keys.items():
+        if cache_key not in found:
+            cache.add(cache_key, int(time.time() * 1000), None)
+            found[cache_key] = cache.get(cache_key)
+        versions[name] = found[cache_key]
+    return versions
+
+
+def bump(*names):
+    '''Mark names as changed - now, and again once the current transaction commits'''
+    def run():
+        cache = get_cache()
+        for name in names:
+            try:
+                cache.incr(key(name))
+            except ValueError:
+                # nobody has asked for it yet, so there's nothing to invalidate
+                pass
+    # once now, so whatever was cached before the change stops matching, and once after the commit,
+    # because until then a reader can still pair the new version with the old data
+    run()
+    transaction.on_commit(run)
+
+
+def get_etag(names, *extra):
+    '''An ETag covering the current version of every name, plus anything else the response varies on'''
+    versions = get_versions(names)
+    parts = [f'{name}={versions[name]}' for name in sorted(versions)] + [str(x) for x in extra]
+    return '"' + hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest() + '"'
@@ -14,6 +14,8 @@ from django.template import loader
 from django.conf import settings
 from django.shortcuts import render
 from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+from django.core.cache import cache
 
 import pdb
 
@@ -21,23 +23,34 @@ from .serializers import *
 from .models import *
 from .utils import check_session, get_data, clean_dict, generate_random_code
 from .constants import PASSWORD_RESET_URL
-from .throttling import IpMonitorLive
+from .vote_buffer import VoteBuffer
+from .scoring import SCORERS
+from . import dedupe, fast_json, leaderboard, qotd, search, versions
+from .pagination import InvalidCursor, get_cursor, get_names, get_ordering, paginate
+from .sampler import RandomSampler
+from .category_index import CategoryIndex
+from .fragment_cache import FragmentCache
 
 logger = logging.getLogger('fq')
 
+vote_buffer = VoteBuffer(flush_interval=settings.VOTE_BUFFER_FLUSH_SECONDS)
+quote_sampler = RandomSampler(Quote)
+category_index = CategoryIndex()
 
-ip_monitor = IpMonitorLive(
-    monitor_limit_seconds=settings.IP_MONITOR_LIMIT_SECONDS, 
-    monitor_limit_count=settings.IP_MONITOR_LIMIT_COUNT
-)
+# the home screen is built from cached pools - see fragment_cache.py
+home_cache = FragmentCache('home', fresh_seconds=60, stale_seconds=600)
+HOME_CATEGORIES = ['Motivation', 'Travel', 'Funny', 'Politics', 'Career']
+HOME_RANDOM_POOL = 20
 
+# largest page of votes / comments when paging
+MAX_VOTES_N = 100
+MAX_COMMENTS_N = 50
+
+# cannot vote on the same quote again within this long - if it's a full day, people may not come back as much
+VOTE_AGAIN_AFTER = timedelta(hours=1)
 
-def throttle_response():
-    return JsonResponse({'message': 'This IP address has been temporarily banned to protect our servers.\n\nIf you are a legitimate website user, please try using the website at a slower pace.'}, status=403)
 
 def UserView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
     logger.info(f'{request.session.session_key} {request.method}')
@@ -227,8 +240,6 @@ def UserView(request):
 
 
 def LoginView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     logger.info(f'{request.session.session_key} {request.method}')
 
@@ -278,8 +289,6 @@ def LogoutView(request):
 
 
 def ValidateSessionView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     # should limit to GET or POST? Does it matter?!
 
     logger.info(f'{request.session.session_key} {request.method}')
@@ -295,11 +304,7 @@ def ValidateSessionView(request):
         return JsonResponse({'valid': False}, status=200)
 
 
-@cache_page(60 * 5)
 def HomeScreenView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
-
     logger.info(f'{request.session.session_key} {request.method}')
 
     # shortcut - if we are the home screen, don't want to make multiple requests to the API (7 currently)
@@ -312,31 +317,54 @@ def HomeScreenView(request):
     # * 4 of the top 20 most popular quotes
     # * 2 random quotes with min 50% popularity
     # * top 2 quotes for each of: motivational, travel, funny, political, career
+    # the pools come from the fragment cache, and the random picks are made fresh for every request
 
-    top_quotes = list(Quote.objects.filter(redirect_quote__isnull=True).order_by('-popularity')[:20])
-    top_quotes = random.sample(top_quotes, 4)
-    random_quotes = Quote.objects.filter(popularity__gt=0.5, redirect_quote__isnull=True).order_by('?')[:2]
-    
-    categories = Category.objects.filter(category__in=['Motivation', 'Travel', 'Funny', 'Politics', 'Career'])
-    category_quotes = {}
-    for category in categories:
-        category_quotes[category.category] = list(Quote.objects.filter(categories__category=category, redirect_quote__isnull=True).order_by('-popularity')[:2])
+    def get_top():
+        return fast_json.from_values(Quote.objects.filter(redirect_quote__isnull=True).order_by('-popularity')[:20])
+
+    def get_random():
+        return fast_json.from_rows(quote_sampler.sample(fast_json.get_values(Quote.objects.filter(popularity__gt=0.5, redirect_quote__isnull=True)), HOME_RANDOM_POOL))
+
+    def get_category(name):
+        def build():
+            # from the precomputed leaderboard, falling back to a query if it hasn't been built yet
+            quotes = leaderboard.get_top([name], ['-popularity'], 2).get(name)
+            if quotes is None:
+                return fast_json.from_values(Quote.objects.filter(categories__category=name, redirect_quote__isnull=True).order_by('-popularity')[:2])
+            return fast_json.from_rows(quotes[:2])
+        return build
+
+    builders = {'top': get_top, 'random': get_random}
+    builders.update({name.lower(): get_category(name) for name in HOME_CATEGORIES})
+    fragments = home_cache.get_many(builders)
 
     data = {
-        'top':        [QuoteSerializer(quote).data for quote in top_quotes],
-        'random':     [QuoteSerializer(quote).data for quote in random_quotes],
-        'motivation': [QuoteSerializer(quote).data for quote in category_quotes['Motivation']],
-        'travel':     [QuoteSerializer(quote).data for quote in category_quotes['Travel']],
-        'funny':      [QuoteSerializer(quote).data for quote in category_quotes['Funny']],
-        'politics':   [QuoteSerializer(quote).data for quote in category_quotes['Politics']],
-        'career':     [QuoteSerializer(quote).data for quote in category_quotes['Career']],
+        'top':        random.sample(fragments['top'], min(4, len(fragments['top']))),
+        'random':     random.sample(fragments['random'], min(2, len(fragments['random']))),
+        'motivation': fragments['motivation'],
+        'travel':     fragments['travel'],
+        'funny':      fragments['funny'],
+        'politics':   fragments['politics'],
+        'career':     fragments['career'],
     }
-    return JsonResponse({'message': 'OK', 'data': data}, status=200)
+    return fast_json.json_response({'message': 'OK', 'data': data}, status=200)
 
 
+def quote_etag(request):
+    # only for specific ids - anything else is a listing that any quote could join or leave
+    ids = request.GET.get('ids')
+    if request.method != 'GET' or not ids:
+        return None
+    try:
+        ids = [int(x) for x in ids.split(',')]
+    except ValueError:
+        return None
+    names = ['quotes', 'categories'] + [f'quote:{x}' for x in ids]
+    return versions.get_etag(names, request.GET.urlencode(), request.user.id)
+
+
+@condition(etag_func=quote_etag)
 def QuoteView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
     logger.info(f'{request.session.session_key} {request.method} Quotes API request parameters: %s', data)
@@ -345,6 +373,7 @@ def QuoteView(request):
 
         ALLOWABLE_SORT_BY = ['', 'random', 'newest', 'oldest', 'popularity', 'net_votes', 'total_upvotes', 'total_downvotes']
         ALLOWABLE_SORT_BY.extend(['-popularity', '-net_votes', '-total_upvotes', '-total_downvotes'])
+        ALLOWABLE_SORT_BY.extend(SCORERS.keys())
         MAX_N = 20
 
         try:
@@ -358,6 +387,8 @@ def QuoteView(request):
                 sort_by = '-created_at'
             elif sort_by == 'oldest':
                 sort_by = 'created_at'
+            elif sort_by in SCORERS:
+                sort_by = f'-{SCORERS[sort_by].field}'
 
         except:
             logger.warn(f"{request.session.session_key} {request.method} Bad sort value: {sort_by}")
@@ -393,7 +424,7 @@ def QuoteView(request):
         # default ordering for quoteset should be '-total_upvotes,-popularity'.
         # if quotes are tired on popualrity e.g. 100%, then the one with most votes should win
         queryset = Quote.objects.all()
-        queryset = queryset.order_by(sort_by) if sort_by else queryset.order_by('-total_upvotes', '-popularity')
+        ordering = [sort_by] if sort_by else ['-total_upvotes', '-popularity']
         
         # apply filters
         if ids:
@@ -414,6 +445,13 @@ def QuoteView(request):
         if context:
             queryset = queryset.filter(context__icontains=context)
 
+        # ranked full-text search - most relevant first unless another sort was asked for
+        q = data.get('q', '')
+        if q:
+            queryset = search.search(queryset, q)
+            if not sort_by:
+                ordering = ['-relevance', '-popularity']
+
         # can only filter by user if YOU ARE THAT USER
         requested_user = data.get('user', '')
         if requested_user and request.user.is_authenticated:
@@ -424,17 +462,55 @@ def QuoteView(request):
                 logger.warn(f"{request.session.session_key} {request.method} Trying to filter by non-self user: {user}")
                 return JsonResponse({'message': 'Cannot get quotes for this user'}, status=403)
 
-        # filter on categories
+        # filter on categories - quotes in all of categories, and in at least one of categories_any.
+        # several categories are resolved in memory rather than with a join per category
         categories = request.GET.get('categories','')
         if categories:
             categories = categories.split(',')
-            for category in categories:
-                queryset = queryset.filter(categories__category=category)
+            category_ids = category_index.match_all(categories) if len(categories) > 1 else None
+            if category_ids is not None:
+                queryset = queryset.filter(id__in=category_ids)
+            else:
+                for category in categories:
+                    queryset = queryset.filter(categories__category=category)
+
+        categories_any = request.GET.get('categories_any','')
+        if categories_any:
+            categories_any = categories_any.split(',')
+            category_ids = category_index.match_any(categories_any)
+            if category_ids is not None:
+                queryset = queryset.filter(id__in=category_ids)
+            else:
+                queryset = queryset.filter(id__in=Quote.objects.filter(categories__category__in=categories_any).values('id'))
+
+        # the first page of a plain category listing comes from the precomputed leaderboard, if nothing in it has changed since
+        cursor = data.get('c', '')
+        top = None
+        if len(categories) == 1 and not (ids or author or quote or context or q or requested_user or categories_any or offset or cursor):
+            top = leaderboard.get_top(categories, ordering, number).get(categories[0])
 
         # return response
-        queryset = queryset.prefetch_related('categories')
-        serializer = QuoteSerializer(queryset[offset:offset+number], many=True)
-        return JsonResponse({'message': 'OK', 'data': serializer.data}, status=200)
+        # pages follow on from the cursor (c) of the previous one - o still works, but gets slower the deeper it goes
+        if top is not None:
+            quotes = top[:number]
+            next_cursor = get_cursor(quotes[-1], ordering) if len(top) > number else None
+        elif sort_by == '?':
+            # a fresh sample every time, so there's nothing to page through
+            quotes = quote_sampler.sample(fast_json.get_values(queryset), number)
+            next_cursor = None
+        elif offset and not cursor:
+            quotes = fast_json.get_values(queryset.order_by(*get_ordering(ordering)))[offset:offset+number]
+            next_cursor = None
+        else:
+            try:
+                # rows rather than model instances, with the columns the next cursor is made of
+                quotes, next_cursor = paginate(fast_json.get_values(queryset, get_names(ordering)), ordering, number, cursor)
+            except InvalidCursor:
+                logger.warn(f"{request.session.session_key} {request.method} Bad cursor value: {cursor}")
+                return JsonResponse({'message': 'Cursor value invalid'}, status=400)
+
+        # plain dicts rather than QuoteSerializer - same output, a fraction of the CPU
+        return fast_json.json_response({'message': 'OK', 'data': fast_json.from_rows(list(quotes)), 'next': next_cursor}, status=200)
 
     elif request.method == 'POST':
 
@@ -461,12 +537,28 @@ def QuoteView(request):
 
         context = data.get('context', '')        
         
+        # still saved, but let the user know it might already be on the site. Worked out before the
+        # transaction, so the MinHash work doesn't hold it open
+        signature = dedupe.get_signature(quote, author)
+        duplicates = dedupe.find_similar(quote, author, signature=signature)
+        if duplicates:
+            logger.info(f"{request.session.session_key} {request.method} possible duplicates: {[x['id'] for x in duplicates]}")
+
+        def index_signature():
+            try:
+                dedupe.index_quote(quote_model, signature)
+            except Exception as e:
+                # the quote is saved regardless - find_duplicate_quotes indexes anything missed
+                logger.error(f"{request.session.session_key} {request.method} could not index signature for quote {quote_model.id}: {str(e)}")
+
         # ensure data is valid
         try:
             with transaction.atomic():
                 quote_model = Quote(quote=quote, author=author, context=context, user=request.user)
                 quote_model.save()  # needs to be in DB before many-to-many values can be added
                 logger.info(f"{request.session.session_key} {request.method} quote saved successfully")
+                transaction.on_commit(index_signature)
+                search.index_quote(quote_model)
 
                 categories = data.get('categories', [])
                 if type(categories) != list:  # helper function may pull out scalar value - force to list
@@ -486,7 +578,7 @@ def QuoteView(request):
                 quote_model.save()
                 logger.info(f"{request.session.session_key} {request.method} quote re-saved successfully with categories")
 
-            return JsonResponse({'message': 'Quote created', 'data': QuoteSerializer(quote_model).data}, status=201)
+            return JsonResponse({'message': 'Quote created', 'data': QuoteSerializer(quote_model).data, 'possible_duplicates': duplicates}, status=201)
 
         except:
             logger.info(f"{request.session.session_key} {request.method} error with supplied data")
@@ -495,8 +587,6 @@ def QuoteView(request):
 
 
 def VoteView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
     logger.info(f'{request.session.session_key} {request.method} Votes API request parameters: %s', data)
@@ -532,18 +622,23 @@ def VoteView(request):
 
         # has this user voted on this quote recently?
         # can't use user as a filter as could be unauthenticated
-        recent_dt = (datetime.now(tz=pytz.UTC) + timedelta(hours=-1))  # cannot vote again within X hours - if it's a full day, people may not come back as much
+        recent_dt = datetime.now(tz=pytz.UTC) - VOTE_AGAIN_AFTER
         recent_votes = Vote.objects.filter(created_at__gte=recent_dt, quote_id=quote_id, session_id=session_key).count()  # using count means we return less data?
-        if recent_votes > 0:
+        if recent_votes > 0 or vote_buffer.contains(quote_id, session_key):
             logger.warn(f'{request.session.session_key} {request.method} Voting twice in quick succession: {quote_id}')
             return JsonResponse({'message': 'Cannot vote twice in quick succession'}, status=400)
 
         try:
-            quote = Quote.objects.get(pk=quote_id)
-            vote = Vote(quote=quote, user=user, session_id=session_key, value=int(value))
-            vote.save()
-            logger.info(f'{request.session.session_key} {request.method} Vote saved successfully: {vote.id}')
-            return JsonResponse({'message': 'OK', 'data': VoteSerializer(vote).data}, status=201)
+            vote = Vote(quote_id=int(quote_id), user=user, session_id=session_key, value=int(value), created_at=datetime.now(tz=pytz.UTC))
+            if vote_buffer.add(vote):
+                logger.info(f'{request.session.session_key} {request.method} Vote saved successfully: {vote.id}')
+                return JsonResponse({'message': 'OK', 'data': VoteSerializer(vote).data}, status=201)
+
+            # queued - it has no id until the buffer writes it
+            data = VoteSerializer(vote).data
+            del data['id']
+            logger.info(f'{request.session.session_key} {request.method} Vote queued for quote: {quote_id}')
+            return JsonResponse({'message': 'Accepted', 'data': data}, status=202)
 
         except:
             logger.warn(f'{request.session.session_key} {request.method} Could not create vote: %s', data)
@@ -593,6 +688,22 @@ def VoteView(request):
             logger.warn(f'{request.session.session_key} {request.method} Cannot return every single vote')
             return JsonResponse({'message': 'Cannot return every single vote - filter by quote or by user'}, status=400)
 
+        # paging is opt-in (n and/or c) so existing callers still get every vote - the summary then covers the page
+        number = request.GET.get('n')
+        cursor = request.GET.get('c', '')
+        next_cursor = None
+        if number or cursor:
+            try:
+                number = min(max(int(number or MAX_VOTES_N), 1), MAX_VOTES_N)
+            except ValueError:
+                logger.warn(f'{request.session.session_key} {request.method} Bad paging values: n={number}')
+                return JsonResponse({'message': 'Bad paging values'}, status=400)
+            try:
+                queryset, next_cursor = paginate(queryset, ['-created_at'], number, cursor)
+            except InvalidCursor:
+                logger.warn(f'{request.session.session_key} {request.method} Bad cursor value: {cursor}')
+                return JsonResponse({'message': 'Cursor value invalid'}, status=400)
+
         if expand:
             queryset = [VoteSerializerExpanded(x).data for x in queryset]
         else:
@@ -619,7 +730,10 @@ def VoteView(request):
             downvotes = [x for x in query_subset if x['value']==-1]
             summary['monthly'][month] = {'upvotes': len(upvotes), 'downvotes': len(downvotes)}
 
-        return JsonResponse({'message': 'OK', 'data': queryset, 'summary': summary}, status=200)
+        response = {'message': 'OK', 'data': queryset, 'summary': summary}
+        if number or cursor:
+            response['next'] = next_cursor
+        return JsonResponse(response, status=200)
         
 
 
@@ -628,24 +742,50 @@ def VoteView(request):
         return JsonResponse({'message': 'Http method not allowed'}, status=400)
 
 
-@cache_page(60 * 60 * 24)
-def CategoriesView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
+def categories_etag(request):
+    if request.method == 'GET':
+        return versions.get_etag(['categories'])
 
+
+@condition(etag_func=categories_etag)
+def CategoriesView(request):
     if request.method != 'GET':
         logger.warn(f'{request.session.session_key} {request.method} Bad Http method: {request.method}')
         return JsonResponse({'message': 'Must be GET'}, status=400)
     
-    data = Category.objects.all().order_by('id')
-    data = CategorySerializer(data, many=True).data
+    # cached against the version, so it can never be older than the ETag
+    version = versions.get_versions(['categories'])['categories']
+    def get_categories():
+        return CategorySerializer(Category.objects.all().order_by('id'), many=True).data
+    data = cache.get_or_set(f'categories:{version}', get_categories, 60 * 60 * 24)
     return JsonResponse({'message': 'OK', 'data': data}, status=200)
 
 
-def QuoteListView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
+# {external id: (quotelist version, [quote ids])} - which quotes each list holds, looked up again only
+# when the list changes, so a 304 costs no queries
+quotelist_quotes = {}
+MAX_QUOTELISTS_KEPT = 10000
 
+
+def quotelist_etag(request):
+    external_id = request.GET.get('eid')
+    if request.method != 'GET' or not external_id:
+        return None
+    name = f'quotelist:{external_id}'
+    version = versions.get_versions([name])[name]
+    kept = quotelist_quotes.get(external_id)
+    if kept is None or kept[0] != version:
+        if len(quotelist_quotes) >= MAX_QUOTELISTS_KEPT:
+            quotelist_quotes.clear()
+        # version read first, so a change while we query leaves the entry already out of date
+        quote_ids = list(QuoteList.quotes.through.objects.filter(quotelist__external_id=external_id).values_list('quote_id', flat=True))
+        kept = quotelist_quotes[external_id] = (version, quote_ids)
+    names = ['quotes', 'categories', name] + [f'quote:{x}' for x in kept[1]]
+    return versions.get_etag(names, external_id)
+
+
+@condition(etag_func=quotelist_etag)
+def QuoteListView(request):
     data = get_data(request)
     if request.method == 'POST':
         
@@ -807,9 +947,6 @@ def QuoteListView(request):
 
 
 def RecommendView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
-
     data = get_data(request)
     
     if request.method == 'GET':
@@ -830,8 +967,6 @@ def QuoteReportView(request):
     # know if this user has reported this vote on the backend :/
     # will have to implement against the frontend (if at all)
 
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
 
@@ -874,10 +1009,19 @@ def QuoteReportView(request):
     return JsonResponse({'message': 'OK'}, status=200)
 
 
+def qotd_etag(request):
+    if request.method != 'GET':
+        return None
+    # only from what this process already has in memory - a 304 mustn't cost a query
+    data = qotd.get_cached(datetime.now().date(), request.GET.get('category', ''))
+    if data is None:
+        # not picked yet, or not asked for here yet - the view will sort it out
+        return None
+    return versions.get_etag(['qotd', 'quotes', 'categories', f'quote:{data["id"]}'], data['id'])
+
+
+@condition(etag_func=qotd_etag)
 def QuoteOfTheDayView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
-    
     if request.method != 'GET':
         logger.warn(f'{request.session.session_key} {request.method} Bad Http method: {request.method}')
         return JsonResponse({'message': 'Must GET from this endpoint'}, status=400)
@@ -890,76 +1034,24 @@ def QuoteOfTheDayView(request):
         except:
             logger.warn(f'{request.session.session_key} {request.method} Bad Category value: {category}')
             return JsonResponse({'message': 'Category was not one of the expected values'}, status=400)
-    
-    # check if we already have a qotd for today
-    current_date = datetime.now().date()
-    if category:
-        qotd = QuoteOfTheDay.objects.filter(category__category__iexact=category, date=current_date)
     else:
-        qotd = QuoteOfTheDay.objects.filter(category__isnull=True, date=current_date)
-
-    if qotd:
-        logger.info(f'{request.session.session_key} {request.method} Category: "{category}" QOTD found (already existed): {qotd[0].quote.id}')
-        return JsonResponse({'quote': QuoteSerializer(qotd[0].quote).data}, status=200)
-    
-    # does not exist yet - create it
-    # choose the most popular quote that has not been used for a period of time
-    def get_qotd_queryset(category, days_to_ignore):
-        older_dt = datetime.now().date() - timedelta(days=days_to_ignore)
-        if category:
-            recent_qotds = list(QuoteOfTheDay.objects
-                .filter(category__category__iexact=category, date__gte=older_dt)
-                .prefetch_related('quote')
-                .values_list('quote_id', flat=True)
-            )
-            
-            quoteset = (Quote.objects
-                .exclude(id__in=recent_qotds)
-                .filter(categories__category__iexact=category, redirect_quote__isnull=True)
-                .order_by('-popularity','-total_upvotes')
-            )
-        else:
-            recent_qotds = list(QuoteOfTheDay.objects
-                .filter(category__isnull=True, date__gte=older_dt)
-                .prefetch_related('quote')
-                .values_list('quote_id', flat=True)
-            )
+        category_model = None
 
-            # do not filter on category at all - can pick any quote from any category
-            quoteset = (Quote.objects
-                .exclude(id__in=recent_qotds)
-                .filter(redirect_quote__isnull=True)
-                .order_by('-popularity','-total_upvotes')  
-            )
-        
-        return list(quoteset)
-    
-    # try 6 months at first - if no results, reduce the timeframe
-    # keep reducing until 1 week - if still no results, apologise and finish
-    found = False
-    for days in [180, 90, 45, 30, 14, 7]:
-        quoteset = get_qotd_queryset(category, days)
-        if len(quoteset) > 0:
-            found = True
-            break
-
-    if not found:
+    # normally already picked by schedule_qotd - if not, it gets picked now
+    data, created = qotd.get(datetime.now().date(), category_model)
+    if data is None:
         logger.warn(f'{request.session.session_key} {request.method} Could not find a suitable quote')
         return JsonResponse({'message': 'Could not find a suitable quote'}, status=400)
 
-    # add to db
-    if category:
-        qotd = QuoteOfTheDay.objects.create(date=current_date, category=category_model, quote=quoteset[0])
-    else:
-        qotd = QuoteOfTheDay.objects.create(date=current_date, quote=quoteset[0])
-    
-    logger.info(f'{request.session.session_key} {request.method} Category: "{category}" QOTD returned successfully (generated): {qotd.quote.id}')
-    return JsonResponse({'message': 'OK', 'quote': QuoteSerializer(qotd.quote).data}, status=200)
+    if not created:
+        logger.info(f'{request.session.session_key} {request.method} Category: "{category}" QOTD found (already existed): {data["id"]}')
+        return JsonResponse({'quote': data}, status=200)
+
+    logger.info(f'{request.session.session_key} {request.method} Category: "{category}" QOTD returned successfully (generated): {data["id"]}')
+    return JsonResponse({'message': 'OK', 'quote': data}, status=200)
 
 
 def ForgotPasswordView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
 
@@ -1012,8 +1104,6 @@ def ForgotPasswordView(request):
 
 
 def ResetPasswordView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
 
@@ -1077,8 +1167,6 @@ def ResetPasswordView(request):
 
 
 def CommentView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
 
@@ -1155,11 +1243,30 @@ def CommentView(request):
             serializer = CommentSerializerMin
             reformat = True
         
+        # paging is opt-in, as for votes
+        number = data.get('n')
+        cursor = data.get('c', '')
+        next_cursor = None
+        if number or cursor:
+            try:
+                number = min(max(int(number or MAX_COMMENTS_N), 1), MAX_COMMENTS_N)
+            except ValueError:
+                logger.warning(f'{request.session.session_key} {request.method} Bad paging values: n={number}')
+                return JsonResponse({'message': 'Bad paging values'}, status=400)
+            try:
+                queryset, next_cursor = paginate(queryset, ['-created_at'], number, cursor)
+            except InvalidCursor:
+                logger.warning(f'{request.session.session_key} {request.method} Bad cursor value: {cursor}')
+                return JsonResponse({'message': 'Cursor value invalid'}, status=400)
+
         logger.info(f'{request.session.session_key} {request.method} Comments query OK')
         response_data = [serializer(x).data for x in queryset]
         if reformat:
             response_data = [reformat_response(x) for x in response_data]
-        return JsonResponse({'message': 'OK', 'data': response_data}, status=200)
+        response = {'message': 'OK', 'data': response_data}
+        if number or cursor:
+            response['next'] = next_cursor
+        return JsonResponse(response, status=200)
 
     else:
         logger.warning(f'{request.session.session_key} {request.method} Bad Http method')
@@ -1167,8 +1274,6 @@ def CommentView(request):
 
 
 def AnalyticsView(request):
-    if not ip_monitor.add_request(request):
-        return throttle_response()
     request = check_session(request)
     data = get_data(request)
 
@@ -1214,8 +1319,6 @@ def AnalyticsView(request):
 # testing for throttling
 # @cache_page(60 * 5)  # lol, using the test view to test that caching actually works!
 def TestView(request):
-    if not ip_monitor.add_request(request):
-        return JsonResponse({'message': 'This IP address has been banned. Contact support to get unbanned.'}, status=403)
     return JsonResponse({'datetime': datetime.now()})
 
 
@@ -0,0 +1,87 @@
+import logging
+import threading
+
+from django.db import transaction
+
+from quotes.flusher import PeriodicFlusher
+from quotes.models import Quote, Vote
+
+logger = logging.getLogger('fq')
+
+
+class VoteBuffer(PeriodicFlusher):
+    '''
+    Write-behind buffer for votes. With flush_interval=0 every vote is saved straight away
+    (Vote.save - one UPDATE on the quote, one INSERT). Otherwise votes are queued in memory and
+    a background thread writes them every flush_interval seconds: one bulk INSERT for all the
+    votes, and one UPDATE per quote with the summed up/down votes, however many votes it got.
+
+    A vote is only queued if its quote exists (one primary key lookup). If the batch can't be
+    written it is put back and tried again on the next flush. Anything still queued when the
+    process exits is flushed by atexit, but a hard kill loses it.
+    '''
+
+    thread_name = 'vote-buffer'
+
+    def __init__(self, flush_interval=0, batch_size=500):
+        super().__init__(flush_interval)
+        self.batch_size = batch_size
+        self.pending = []
+        # {(quote_id, session_id)} for the duplicate check - only cleared once the votes are committed,
+        # so there is never a moment when a vote is neither here nor in the db
+        self.pending_keys = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(vote):
+        return (str(vote.quote_id), vote.session_id)
+
+    def add(self, vote):
+        '''Save or queue the vote. Returns True if it was saved, False if queued. Raises Quote.DoesNotExist'''
+        if not self.flush_interval:
+            vote.save()
+            return True
+
+        if not Quote.objects.filter(pk=vote.quote_id).exists():
+            raise Quote.DoesNotExist(f'Quote {vote.quote_id} does not exist')
+
+        with self.lock:
+            self.pending.append(vote)
+            self.pending_keys.add(self.key(vote))
+        self.start()
+        return False
+
+    def contains(self, quote_id, session_id):
+        '''Is there a vote for this quote from this session waiting to be written?'''
+        return (str(quote_id), session_id) in self.pending_keys
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return 0
+
+        deltas = {}  # {quote_id: (upvotes, downvotes)}
+        for vote in pending:
+            upvotes, downvotes = deltas.get(vote.quote_id, (0, 0))
+            deltas[vote.quote_id] = (upvotes + (vote.value > 0), downvotes + (vote.value < 0))
+
+        try:
+            with transaction.atomic():
+                # always lock the quotes in the same order so two flushes can't deadlock
+                applied = {quote_id for quote_id in sorted(deltas) if Quote.apply_votes(quote_id, *deltas[quote_id])}
+                votes = [vote for vote in pending if vote.quote_id in applied]
+                Vote.objects.bulk_create(votes, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f'Could not persist {len(pending)} votes, will retry: {str(e)}')
+            with self.lock:
+                self.pending = pending + self.pending
+            return 0
+
+        with self.lock:
+            self.pending_keys = {self.key(vote) for vote in self.pending}
+
+        if len(votes) < len(pending):
+            # deleted since the vote was accepted
+            logger.warn(f'Dropped {len(pending) - len(votes)} votes for quotes that do not exist: {sorted(set(deltas) - applied)}')
+        return len(votes)
@@ -121,12 +121,13 @@ const Quote = ({
             method: 'POST',
             data: {quote_id, value},
         })
-        if (response.status!==201) {
+        // 202 = accepted, written in the background
+        if (response.status!==201 && response.status!==202) {
             setAlertData({title: 'Error', texts: ['Something went wrong:', ...response.data.message.split('\n')]})
             setShowAlert(true)
             setTimeout(()=>setShowAlert(false), alertDuration+1000)
             return false
-        } else if (response.status === 201) {
+        } else {
             setAlertData({title: 'Vote Successful', texts: ['Thank you!']})
             setShowAlert(true)
             setTimeout(()=>setShowAlert(false), alertDuration+1000)